@@ -21,4 +21,5 @@ COMMAND_SIGNAL = 'command'
 JOB_COMMAND_SIGNAL = 'job_command'
 PUBLISH_SIGNAL = 'publish'
 TRANSFER_RATE_SIGNAL = 'transfer_rate'
-TRANSFER_CALLBACK_SIGNAL = 'transfer_callback'
\ No newline at end of file
+TRANSFER_CALLBACK_SIGNAL = 'transfer_callback'
+LOCAL_CHANGE_SIGNAL = 'local_change'
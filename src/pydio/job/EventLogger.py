@@ -24,8 +24,200 @@ import sys
 from pathlib import *
 import datetime
 import logging
+import threading
+import collections
+import atexit
 from pydio.job.localdb import DBCorruptedException
 
+# Events are written at most EVENTS_FLUSH_DELAY seconds after being logged, or as soon as EVENTS_FLUSH_COUNT are
+# waiting
+EVENTS_FLUSH_DELAY = 2
+EVENTS_FLUSH_COUNT = 500
+# Latest events kept in memory to answer the UI without reading the database
+RECENT_EVENTS_COUNT = 50
+EVENT_KEYS = ('id', 'type', 'message', 'source', 'action', 'target', 'status', 'date')
+
+
+class EventsBuffer():
+
+    buffers = {}
+    buffers_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, db):
+        """
+        Buffer of a database, shared by all the EventLogger of the process writing to it
+        :param db: str path of pydio.sqlite
+        :return: EventsBuffer
+        """
+        key = os.path.abspath(db)
+        with cls.buffers_lock:
+            if key not in cls.buffers:
+                cls.buffers[key] = EventsBuffer(db)
+            return cls.buffers[key]
+
+    @classmethod
+    def discard(cls, db):
+        """
+        Drop the buffer of a database about to be removed, with the events it did not write yet. The loggers still
+        holding it then ignore their events instead of writing them to a new file.
+        :param db: str path of pydio.sqlite
+        :return:
+        """
+        with cls.buffers_lock:
+            events_buffer = cls.buffers.pop(os.path.abspath(db), None)
+        if events_buffer:
+            events_buffer.close()
+
+    @classmethod
+    def flush_all(cls):
+        with cls.buffers_lock:
+            buffers = cls.buffers.values()
+        for events_buffer in buffers:
+            events_buffer.flush()
+
+    def __init__(self, db):
+        """
+        Write-behind buffer for the events table: events are inserted in batches, in one transaction, and the
+        uniq events (states, notifications) are only written with their last value.
+        :param db: str path of pydio.sqlite
+        :return:
+        """
+        self.db = db
+        self.pending = []
+        self.states = collections.OrderedDict()
+        self.recent = collections.deque(maxlen=RECENT_EVENTS_COUNT)
+        self._lock = threading.RLock()
+        self._timer = None
+        self.discarded = False
+        # OperationalError of the database, raised as a DBCorruptedException by the next uniq event
+        self.corrupted = None
+        self.create_indexes()
+
+    def create_indexes(self):
+        # Databases created before the indexes were added to create.sql
+        conn = sqlite3.connect(self.db)
+        try:
+            conn.execute('CREATE INDEX IF NOT EXISTS events_type_date ON events (type, date)')
+            conn.execute('CREATE INDEX IF NOT EXISTS events_date ON events (date)')
+            conn.commit()
+        except sqlite3.OperationalError as oe:
+            logging.error('Cannot create events indexes: %s' % oe)
+            self.corrupted = oe
+        except sqlite3.Error as e:
+            logging.debug('Cannot create events indexes: %s' % e)
+        conn.close()
+
+    def add(self, event, uniq=False):
+        """
+        :param event: dict() event without id
+        :param uniq: bool replace the existing events of the same type
+        :return:
+        """
+        with self._lock:
+            if self.discarded:
+                return
+            if uniq and self.corrupted:
+                # States are logged by the merger while indexing: it clears the job data on this exception
+                corrupted, self.corrupted = self.corrupted, None
+                raise DBCorruptedException(corrupted)
+            if uniq:
+                self.states.pop(event['type'], None)
+                self.states[event['type']] = event
+                for recent in [e for e in self.recent if e['type'] == event['type']]:
+                    self.recent.remove(recent)
+            else:
+                self.pending.append(event)
+            self.recent.append(event)
+            if len(self.pending) >= EVENTS_FLUSH_COUNT:
+                self.flush()
+            elif not self._timer:
+                self._timer = threading.Timer(EVENTS_FLUSH_DELAY, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """
+        Write the waiting events, in one transaction
+        :return:
+        """
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            if not self.pending and not self.states:
+                return
+            pending, self.pending = self.pending, []
+            states, self.states = self.states.values(), collections.OrderedDict()
+            conn = None
+            try:
+                conn = sqlite3.connect(self.db)
+                conn.executemany("INSERT INTO events('type', 'message', 'source', 'action', 'target', 'status', 'date') "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?)", (self.row(e) for e in pending))
+                for e in states:
+                    cursor = conn.execute("UPDATE events SET type=?, message=?, source=?, action=?, target=?, status=?, "
+                                          "date=? WHERE type=?", self.row(e) + (e['type'],))
+                    if not cursor.rowcount:
+                        conn.execute("INSERT INTO events('type', 'message', 'source', 'action', 'target', 'status', "
+                                     "'date') VALUES (?, ?, ?, ?, ?, ?, ?)", self.row(e))
+                conn.commit()
+            except sqlite3.OperationalError as oe:
+                logging.error('sql insert error while trying to log events : %s ' % (oe.message,))
+                self.corrupted = oe
+            except sqlite3.Error as e:
+                logging.error('sql insert error while trying to log events : %s ' % (e.message,))
+            finally:
+                if conn:
+                    conn.close()
+
+    def close(self):
+        """
+        Stop the flush timer and drop the waiting events, see EventsBuffer.discard
+        :return:
+        """
+        with self._lock:
+            self.discarded = True
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            self.pending = []
+            self.states = collections.OrderedDict()
+            self.recent.clear()
+
+    @staticmethod
+    def row(event):
+        return (event['type'], event['message'], event['source'], event['action'], event['target'], event['status'],
+                event['date'])
+
+    def get_recent(self, limit, offset, filter_type=None, filter_action=None):
+        """
+        Latest events, if they are all in memory: they were logged by this process, so they are more recent than
+        the ones of the database
+        :return: list of events, or None if the database must be queried
+        """
+        with self._lock:
+            events = []
+            for event in reversed(self.recent):
+                if filter_type and event['type'] != filter_type:
+                    continue
+                if filter_action and event['action'] != filter_action:
+                    continue
+                if not filter_type and not filter_action and event['type'] == 'notif':
+                    continue
+                events.append(dict(event))
+            if len(events) < offset + limit:
+                return None
+            return events[offset:offset + limit]
+
+    def forget(self, event_type):
+        with self._lock:
+            self.states.pop(event_type, None)
+            for recent in [e for e in self.recent if e['type'] == event_type]:
+                self.recent.remove(recent)
+
+
+atexit.register(EventsBuffer.flush_all)
+
 
 class EventLogger():
 
@@ -35,6 +227,7 @@ class EventLogger():
             os.mkdir(job_data_path)
         if not os.path.exists(self.db):
             self.init_db()
+        self.buffer = EventsBuffer.get(self.db)
 
     def init_db(self):
         conn = sqlite3.connect(self.db)
@@ -56,31 +249,32 @@ class EventLogger():
         self.log('notif', message, 'loop', status, uniq=True)
 
     def log(self, event_type, message, action, status, source='', target='', uniq=False):
-        insert = True
-        conn = sqlite3.connect(self.db)
-        if uniq:
-            try:
-                sel = conn.execute('SELECT id FROM events WHERE type=?', (event_type, ))
-                for r in sel:
-                    insert = False
-            except sqlite3.OperationalError as oe:
-                raise DBCorruptedException(oe)
-
-        try:
-            date_time = str(datetime.datetime.now())
-            if insert:
-                conn.execute("INSERT INTO events('type', 'message', 'source', 'action', 'target', 'status', 'date') "
-                             "VALUES (?, ?, ?, ?, ?, ?, ?)", (event_type, message, source, action, target, status, date_time))
-            else:
-                conn.execute("UPDATE events SET type=?, message=?, source=?, action=?, target=?, status=?, date=? "
-                             " WHERE type=?", (event_type, message, source, action, target, status, date_time, event_type))
+        """
+        Record an event. It is written to the database within EVENTS_FLUSH_DELAY seconds (see EventsBuffer), but
+        is immediately visible to the readers of this process.
+        :param uniq: bool only keep the last event of this type
+        :return:
+        """
+        event = {
+            'id': None,
+            'type': event_type,
+            'message': message,
+            'source': source,
+            'action': action,
+            'target': target,
+            'status': status,
+            'date': str(datetime.datetime.now())
+        }
+        self.buffer.add(event, uniq=uniq)
 
-            conn.commit()
-        except sqlite3.Error as e:
-            logging.error('sql insert error while trying to log event : %s ' % (e.message,))
-        conn.close()
+    def flush(self):
+        self.buffer.flush()
 
     def get_all(self, limit=10, offset=0, filter_type=None, filter_action=None):
+        recent = self.buffer.get_recent(limit, offset, filter_type=filter_type, filter_action=filter_action)
+        if recent is not None:
+            return recent
+        self.buffer.flush()
         conn = sqlite3.connect(self.db)
         events = []
         try:
@@ -110,8 +304,16 @@ class EventLogger():
         return events
 
     def consume_notification(self):
+        """
+        Read and remove the last notification. When the job runs in its own process (see JobProcess), the notification
+        may still be waiting in the buffer of that process: it is then returned by a later call, once written. It is
+        never returned twice, as a buffer only writes the events logged since its previous flush.
+        :return: dict event, or None
+        """
         events = self.get_all(1, 0, filter_type='notif')
         if len(events):
+            self.buffer.forget('notif')
+            self.buffer.flush()
             conn = sqlite3.connect(self.db)
             conn.execute("DELETE FROM events WHERE type=?", ('notif',))
             conn.commit()
@@ -120,6 +322,7 @@ class EventLogger():
         return None
 
     def filter(self, filter, filter_parameter):
+        self.buffer.flush()
         logging.debug("Filtering logs on '%s' with filter '%s'" %(filter, filter_parameter))
         if filter=='type':
             return self.get_all_from_type(filter_parameter)
@@ -20,13 +20,51 @@
 import os
 import logging
 import shutil
-from pydio.utils.global_config import ConfigManager
+import tempfile
+import time
+from contextlib import contextmanager
 from pydio.utils import i18n
 _ = i18n.language.ugettext
 
+# Used by the delta/full cost model until real values are measured
+DEFAULT_TRANSFER_RATE = 1024 * 1024
+DEFAULT_RTT = 0.1
+# Part of a modified file expected to be sent again in a delta
+DELTA_EXPECTED_CHANGE_RATIO = 0.1
+# librsync signature: 4 bytes weak sum + 8 bytes strong sum per 2048 bytes block
+DELTA_SIGNATURE_RATIO = 12.0 / 2048
+# Signatures and deltas bigger than this are spooled to the system temporary folder
+DELTA_SPOOL_SIZE = 4 * 1024 * 1024
+
+
+@contextmanager
+def no_transfer_slot():
+    yield
+
+
+@contextmanager
+def delta_temporary_files(*suffixes):
+    """
+    Temporary files for rdiff, in the system temporary folder rather than in the synchronized one, removed on exit
+    :param suffixes: str suffix of each file
+    :return: context manager giving the list of paths
+    """
+    paths = []
+    try:
+        for suffix in suffixes:
+            fd, path = tempfile.mkstemp(prefix='pydio-', suffix=suffix)
+            os.close(fd)
+            paths.append(path)
+        yield paths
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
 
 class ChangeProcessor:
-    def __init__(self, change, change_store, job_config, local_sdk, remote_sdk, status_handler, event_logs_handler):
+    def __init__(self, change, change_store, job_config, local_sdk, remote_sdk, status_handler, event_logs_handler,
+                 global_progress=None):
         """
 
         :param change: dict
@@ -35,6 +73,7 @@ class ChangeProcessor:
         :param local_sdk: pydio.sdk.local.SystemSdk
         :param status_handler: pydio.local.status_handler
         :param event_logs_handler: pydio.job.EventLogger
+        :param global_progress: dict progress of the merger, gives the last transfer rate
         :type remote_sdk: pydio.sdk.remote.PydioSdk
         """
         self.job_config = job_config
@@ -44,6 +83,7 @@ class ChangeProcessor:
         self.log_handler = event_logs_handler
         self.change_store = change_store
         self.change = change
+        self.global_progress = global_progress
 
     def log(self, type, action, status, message, console_message, source='', target=''):
         logging.info(console_message)
@@ -203,26 +243,135 @@ class ChangeProcessor:
                  message=(_('Moved %(source)s to %(target)s') % ({'source': source, 'target': target})))
         self.remote_sdk.rename(source, target)
 
+    def remote_stat_from_change(self, item):
+        """
+        Expected stat of a remote node, as recorded in the change, so that the download does not have to stat it
+        :param item: change item, with its node loaded
+        :return: dict() {size, mtime, hash} or None
+        """
+        if not item or not item.get('node') or item['node'].get('bytesize') in (None, ''):
+            return None
+        node = item['node']
+        remote_stat = {'size': int(node['bytesize']), 'mtime': node.get('mtime')}
+        if node.get('md5') and node['md5'] != 'directory':
+            remote_stat['hash'] = node['md5']
+        return remote_stat
+
+    def transfer_rate(self):
+        if self.global_progress and self.global_progress.get('last_transfer_rate', -1) > 0:
+            return float(self.global_progress['last_transfer_rate'])
+        return DEFAULT_TRANSFER_RATE
+
+    def choose_delta_transfer(self, path, full_path, transfer_size, direction):
+        """
+        Estimate whether a delta (signature + delta + patch requests) is cheaper than a full transfer of the file.
+        Full: one request and the whole file on the wire. Delta: three requests, the signature and the expected
+        changed part on the wire, and the file read twice locally (signature/delta computation and patch).
+        :param path: str relative path of the file
+        :param full_path: str absolute path of the local file
+        :param transfer_size: int bytes sent by a full transfer
+        :param direction: str 'up' or 'down'
+        :return: dict decision, with the estimates, to be logged with the realized time
+        """
+        decision = {'path': path, 'direction': direction, 'size': transfer_size, 'strategy': 'full'}
+        if not self.remote_sdk.is_rsync_supported() or not self.local_sdk.is_delta_supported(full_path):
+            return decision
+        try:
+            local_size = os.path.getsize(full_path)
+        except OSError:
+            return decision
+        rate = self.transfer_rate()
+        rtt = self.remote_sdk.rtt if self.remote_sdk.rtt > 0 else DEFAULT_RTT
+        full_cost = rtt + transfer_size / rate
+        delta_cost = 3 * rtt \
+            + (local_size * DELTA_SIGNATURE_RATIO + transfer_size * DELTA_EXPECTED_CHANGE_RATIO) / rate \
+            + 2.0 * max(local_size, transfer_size) / self.local_sdk.delta_rate(full_path)
+        decision.update({'rtt': round(rtt, 4), 'rate': int(rate), 'full_cost': round(full_cost, 3),
+                         'delta_cost': round(delta_cost, 3)})
+        if delta_cost < full_cost:
+            decision['strategy'] = 'delta'
+        return decision
+
+    def log_transfer_decision(self, decision, start):
+        """
+        Log the chosen strategy with its estimates and the realized duration, one line per transfer, so that the
+        cost model constants can be tuned from the logs.
+        """
+        decision['time'] = round(time.time() - start, 3)
+        logging.info('Transfer strategy: ' + ' '.join('%s=%s' % (k, decision[k]) for k in sorted(decision)))
+
+    def transfer_slot(self):
+        """
+        Slot among the concurrent transfers of all jobs, when the sdk shares resources with other jobs
+        :return: context manager
+        """
+        resources = getattr(self.remote_sdk, 'resources', None)
+        if resources:
+            return resources.transfer_slot(interrupted=lambda: self.remote_sdk.interrupt_tasks)
+        return no_transfer_slot()
+
+    def download_delta(self, path, full_path):
+        """
+        Patch the local file with the delta of the remote one. The signature is built in memory (spooled to the
+        system temporary folder when big) and the delta is applied while it is received: nothing is written in the
+        synchronized folder but the patched file.
+        :param path: str path relative to the job directory
+        :param full_path: str absolute path of the local file
+        """
+        if self.local_sdk.use_builtin_delta(full_path):
+            with tempfile.SpooledTemporaryFile(max_size=DELTA_SPOOL_SIZE, prefix='pydio-') as signature:
+                self.local_sdk.rsync_signature_stream(full_path, signature)
+                with self.remote_sdk.rsync_delta_stream(path, signature) as delta_stream:
+                    self.local_sdk.rsync_patch_stream(full_path, delta_stream)
+            return
+        with delta_temporary_files('.signature', '.delta') as (sig_path, delta_path):
+            self.local_sdk.rsync_signature(full_path, sig_path)
+            self.remote_sdk.rsync_delta(path, sig_path, delta_path)
+            self.local_sdk.rsync_patch(full_path, delta_path)
+
+    def upload_delta(self, path, full_path):
+        """
+        Patch the remote file with the delta of the local one. The signature is parsed while it is received and the
+        delta is built in memory (spooled to the system temporary folder when big), then posted.
+        :param path: str path relative to the job directory
+        :param full_path: str absolute path of the local file
+        """
+        if self.local_sdk.use_builtin_delta(full_path):
+            signature = self.remote_sdk.rsync_signature_stream(path)
+            with tempfile.SpooledTemporaryFile(max_size=DELTA_SPOOL_SIZE, prefix='pydio-') as delta_fd:
+                self.local_sdk.rsync_delta_from_signature(full_path, signature, delta_fd)
+                self.remote_sdk.rsync_patch(path, delta_fd)
+            return
+        with delta_temporary_files('.signature', '.delta') as (sig_path, delta_path):
+            self.remote_sdk.rsync_signature(path, sig_path)
+            self.local_sdk.rsync_delta(full_path, sig_path, delta_path)
+            self.remote_sdk.rsync_patch(path, delta_path)
+
     def process_download(self, path, is_mod=False, callback_dict=None):
         self.update_node_status(path, 'DOWN')
         full_path = self.job_config.directory + path
         message = path + ' <====DOWNLOAD==== ' + path
-        if is_mod and self.remote_sdk.is_rsync_supported() and ConfigManager.Instance().get_rdiff_path():
-            sig_path = os.path.join(os.path.dirname(full_path), "." + os.path.basename(path)+".signature")
-            delta_path = os.path.join(os.path.dirname(full_path), "." + os.path.basename(path)+".delta")
-            try:
-                self.local_sdk.rsync_signature(full_path, sig_path)
-                self.remote_sdk.rsync_delta(path, sig_path, delta_path)
-                self.local_sdk.rsync_patch(full_path, delta_path)
-                message = path + ' <====PATCH====== ' + path
-            except Exception as e:
-                self.remote_sdk.download(path, self.job_config.directory + path, callback_dict)
-            if os.path.exists(sig_path):
-                os.remove(sig_path)
-            if os.path.exists(delta_path):
-                os.remove(delta_path)
-        else:
-            self.remote_sdk.download(path, self.job_config.directory + path, callback_dict)
+        remote_stat = self.remote_stat_from_change(callback_dict)
+        decision = None
+        if is_mod and os.path.exists(full_path):
+            size = remote_stat['size'] if remote_stat else os.path.getsize(full_path)
+            decision = self.choose_delta_transfer(path, full_path, size, 'down')
+        with self.transfer_slot():
+            start = time.time()
+            if decision and decision['strategy'] == 'delta':
+                try:
+                    self.download_delta(path, full_path)
+                    message = path + ' <====PATCH====== ' + path
+                except Exception as e:
+                    logging.info('Delta download of %s failed (%s), downloading the full file' % (path, e))
+                    decision['strategy'] = 'delta-failed'
+                    self.remote_sdk.download(path, self.job_config.directory + path, callback_dict,
+                                             remote_stat=remote_stat)
+            else:
+                self.remote_sdk.download(path, self.job_config.directory + path, callback_dict,
+                                         remote_stat=remote_stat)
+            if decision:
+                self.log_transfer_decision(decision, start)
 
         self.update_node_status(path, 'IDLE')
         self.log(type='local', action='download', status='success',
@@ -236,25 +385,25 @@ class ChangeProcessor:
 
         full_path = self.job_config.directory + path
         message = path + ' =====UPLOAD====> ' + path
-        if is_mod and self.remote_sdk.is_rsync_supported() and ConfigManager.Instance().get_rdiff_path():
-            sig_path = os.path.join(os.path.dirname(full_path), "." + os.path.basename(path)+".signature")
-            delta_path = os.path.join(os.path.dirname(full_path), "." + os.path.basename(path)+".delta")
-            try:
-                self.remote_sdk.rsync_signature(path, sig_path)
-                self.local_sdk.rsync_delta(full_path, sig_path, delta_path)
-                self.remote_sdk.rsync_patch(path, delta_path)
-                message = path + ' =====PATCH=====> ' + path
-            except Exception as e:
+        decision = None
+        if is_mod and os.path.exists(full_path):
+            decision = self.choose_delta_transfer(path, full_path, os.path.getsize(full_path), 'up')
+        with self.transfer_slot():
+            start = time.time()
+            if decision and decision['strategy'] == 'delta':
+                try:
+                    self.upload_delta(path, full_path)
+                    message = path + ' =====PATCH=====> ' + path
+                except Exception as e:
+                    logging.info('Delta upload of %s failed (%s), uploading the full file' % (path, e))
+                    decision['strategy'] = 'delta-failed'
+                    self.remote_sdk.upload(full_path, self.local_sdk.stat(path), path, callback_dict,
+                                   max_upload_size=max_upload_size)
+            else:
                 self.remote_sdk.upload(full_path, self.local_sdk.stat(path), path, callback_dict,
-                               max_upload_size=max_upload_size)
-            finally:
-                if os.path.exists(sig_path):
-                    os.remove(sig_path)
-                if os.path.exists(delta_path):
-                    os.remove(delta_path)
-        else:
-            self.remote_sdk.upload(full_path, self.local_sdk.stat(path), path, callback_dict,
-                               max_upload_size=max_upload_size)
+                                   max_upload_size=max_upload_size)
+            if decision:
+                self.log_transfer_decision(decision, start)
 
         self.update_node_status(path, 'IDLE')
         self.log(type='remote', action='upload', status='success', target=path,
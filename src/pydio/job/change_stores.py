@@ -24,6 +24,10 @@ import os
 import logging
 import fnmatch
 import math
+import heapq
+import sys
+import threading
+import Queue
 
 from pydio.sdk.exceptions import InterruptException
 
@@ -31,16 +35,24 @@ from pydio.sdk.exceptions import InterruptException
 class SqliteChangeStore():
     conn = None
     DEBUG = False;
+    # Number of changes inserted at once by store()
+    STORE_BATCH_SIZE = 1000
+    # (seq_id, row_id) heaps of the remaining changes by location, see start_seqs_tracking()
+    seqs_heaps = None
 
     def __init__(self, filename, includes, excludes):
         self.db = filename
         self.includes = includes
         self.excludes = excludes
         self.create = False
+        self.insert_buffer = []
+        self.echoes = None
         if not os.path.exists(self.db):
             self.create = True
 
     def open(self):
+        self.insert_buffer = []
+        self.echoes = None
         self.conn = sqlite3.connect(self.db)
         self.conn.row_factory = sqlite3.Row
         if self.create:
@@ -60,15 +72,46 @@ class SqliteChangeStore():
             self.conn.execute("CREATE INDEX buffer_type ON ajxp_last_buffer (type)")
             self.conn.execute("CREATE INDEX buffer_source ON ajxp_last_buffer (source)")
             self.conn.execute("CREATE INDEX buffer_target ON ajxp_last_buffer (target)")
-        else:
-            self.conn.execute("DELETE FROM ajxp_changes")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS ajxp_checkpoints (location TEXT PRIMARY KEY, seq_id INTEGER)")
+        if not self.create:
+            if self.get_checkpoint('remote'):
+                # An initial remote snapshot was interrupted, keep what was already loaded to resume it
+                self.conn.execute("DELETE FROM ajxp_changes WHERE location<>?", ('remote',))
+            else:
+                self.conn.execute("DELETE FROM ajxp_changes")
         self.conn.commit()
 
+    def get_checkpoint(self, location):
+        """
+        Last sequence of a partial load that is fully committed in the store
+        :param location: 'remote' or 'local'
+        :return: int sequence, 0 if there is no checkpoint
+        """
+        for row in self.conn.execute("SELECT seq_id FROM ajxp_checkpoints WHERE location=?", (location,)):
+            return row['seq_id']
+        return 0
+
+    def checkpoint(self, location, seq_id):
+        """
+        Commit the changes stored so far, along with the sequence they were loaded up to.
+        :param location: 'remote' or 'local'
+        :param seq_id: int all changes with a sequence lower or equal are stored
+        :return:
+        """
+        self.flush_inserts()
+        self.conn.execute("INSERT OR REPLACE INTO ajxp_checkpoints (location, seq_id) VALUES (?, ?)",
+                          (location, seq_id))
+        self.conn.commit()
+
+    def clear_checkpoint(self, location):
+        self.conn.execute("DELETE FROM ajxp_checkpoints WHERE location=?", (location,))
+
 
     def __len__(self):
         return self.get_row_count()
 
     def get_row_count(self, location='all'):
+        self.flush_inserts()
         if location == 'all':
             res = self.conn.execute("SELECT count(row_id) FROM ajxp_changes")
         else:
@@ -78,11 +121,18 @@ class SqliteChangeStore():
             logging.info("Changes store count #"+str(count[0]))
         return count[0]
 
-    def process_changes_with_callback(self, callback):
+    def process_changes_with_callback(self, callback, in_group=False):
+        """
+        Pass the changes to the callback (folders first), and remove the ones successfully processed.
+        :param callback: function(change) returning True if the change was processed
+        :param in_group: bool only process the changes selected by select_group()
+        :return:
+        """
+        group_filter = ' AND row_id IN (SELECT row_id FROM ajxp_group)' if in_group else ''
         c = self.conn.cursor()
 
         res = c.execute('SELECT * FROM ajxp_changes WHERE md5="directory" AND location="local" '
-                        'AND type="create" ORDER BY source,target')
+                        'AND type="create"' + group_filter + ' ORDER BY source,target')
         mkdirs = []
         ids = []
         for row in res:
@@ -94,20 +144,22 @@ class SqliteChangeStore():
             callback({'type':'bulk_mkdirs', 'location':'local', 'pathes':mkdirs[i*splitsize:(i+1)*splitsize]})
             ids_list = str(','.join(ids[i*splitsize:(i+1)*splitsize]))
             self.conn.execute('DELETE FROM ajxp_changes WHERE row_id IN (' + ids_list + ')')
+            self.forget_rows(ids[i*splitsize:(i+1)*splitsize])
         self.conn.commit()
 
-        res = c.execute('SELECT * FROM ajxp_changes WHERE md5="directory" ORDER BY source,target')
+        res = c.execute('SELECT * FROM ajxp_changes WHERE md5="directory"' + group_filter + ' ORDER BY source,target')
         for row in res:
             try:
                 output = callback(self.sqlite_row_to_dict(row, load_node=True))
                 if output:
                     self.conn.execute('DELETE FROM ajxp_changes WHERE row_id=?', (row['row_id'],))
+                    self.forget_rows([row['row_id']])
             except InterruptException as e:
                 break
         self.conn.commit()
 
         #now go to the rest
-        res = c.execute('SELECT * FROM ajxp_changes ORDER BY seq_id ASC')
+        res = c.execute('SELECT * FROM ajxp_changes WHERE 1' + group_filter + ' ORDER BY seq_id ASC')
         rows_to_process = []
         for row in res:
             rows_to_process.append(self.sqlite_row_to_dict(row, load_node=True))
@@ -118,11 +170,153 @@ class SqliteChangeStore():
                 output = callback(r)
                 if output:
                     self.conn.execute('DELETE FROM ajxp_changes WHERE row_id=?', (r['row_id'],))
+                    self.forget_rows([r['row_id']])
             except InterruptException as e:
                 break
         self.conn.commit()
 
 
+    def get_change_groups(self, batch_size=400):
+        """
+        Split the changes in independent groups, that can be filtered and processed while the next ones are still
+        being filtered. Changes depend on each other when they share a path, or when one path is inside the other
+        (e.g. a folder move and a change in that folder). Folders creations only have to happen before the changes
+        inside them: they go in the first group, unless a parent folder is itself changed.
+        Small groups are gathered until batch_size changes, so that their stats are loaded in a few requests.
+        :param batch_size: int minimum number of changes per group (except the last one)
+        :return: list of lists of changes (see sqlite_row_to_dict), ordered by their first sequence
+        """
+        folders = []
+        changes = []
+        for row in self.conn.execute('SELECT * FROM ajxp_changes ORDER BY seq_id ASC'):
+            change = self.sqlite_row_to_dict(row)
+            if change['md5'] == 'directory' and change['type'] == 'create':
+                folders.append(change)
+            else:
+                changes.append(change)
+
+        parents = {}
+
+        def find(key):
+            root = key
+            while parents.setdefault(root, root) != root:
+                root = parents[root]
+            while parents[key] != root:
+                parents[key], key = root, parents[key]
+            return root
+
+        pathes = set()
+        for change in changes:
+            pathes.update(p for p in (change['source'], change['target']) if p != 'NULL')
+        if '' in pathes or '/' in pathes:
+            # A change on the root folder itself: everything depends on it
+            return [folders + changes] if folders or changes else []
+        for path in pathes:
+            parent = os.path.dirname(path)
+            while parent not in ('', '/'):
+                if parent in pathes:
+                    parents[find(path)] = find(parent)
+                    break
+                parent = os.path.dirname(parent)
+        groups = {}
+        ordered = []
+        for change in changes:
+            keys = [p for p in (change['source'], change['target']) if p != 'NULL']
+            for key in keys[1:]:
+                parents[find(key)] = find(keys[0])
+        for change in changes:
+            keys = [p for p in (change['source'], change['target']) if p != 'NULL']
+            root = find(keys[0]) if keys else None
+            if root not in groups:
+                groups[root] = []
+                ordered.append(groups[root])
+            groups[root].append(change)
+
+        first = []
+        for folder in folders:
+            path = folder['target']
+            while path not in ('', '/') and path not in pathes:
+                path = os.path.dirname(path)
+            if path in ('', '/'):
+                first.append(folder)
+            else:
+                groups[find(path)].append(folder)
+
+        batches = [first] if first else []
+        batch = []
+        for group in ordered:
+            batch.extend(group)
+            if len(batch) >= batch_size:
+                batches.append(batch)
+                batch = []
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def select_group(self, changes):
+        """
+        Select the changes used by the next calls with in_group=True (see detect_conflicts and
+        process_changes_with_callback)
+        :param changes: list of changes
+        """
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS ajxp_group (row_id INTEGER PRIMARY KEY)')
+        self.conn.execute('DELETE FROM ajxp_group')
+        self.conn.executemany('INSERT INTO ajxp_group VALUES (?)', ((c['row_id'],) for c in changes))
+        self.conn.commit()
+
+    @staticmethod
+    def stat_pathes(changes):
+        """
+        Pathes to stat on each side to filter the changes (see filter_change)
+        :param changes: list of changes
+        :return: (dict() local path => bool with hash, list() remote pathes)
+        """
+        local = {}
+        remote = set()
+        for c in changes:
+            if c['location'] == 'local':
+                if c['type'] == 'delete':
+                    local.setdefault(c['source'], False)
+                for p in (c['source'], c['target']):
+                    if p != 'NULL':
+                        remote.add(p)
+            else:
+                if c['type'] == 'delete':
+                    remote.add(c['source'])
+                if c['source'] != 'NULL':
+                    local.setdefault(c['source'], False)
+                if c['target'] != 'NULL':
+                    local[c['target']] = True
+        return local, list(remote)
+
+    def filter_group(self, changes, local_sdk, remote_sdk, local_stats, remote_stats):
+        """
+        Same as detect_unnecessary_changes, for a group of changes whose stats were loaded beforehand
+        :param changes: list of changes
+        :param local_stats: dict() local stats of the pathes given by stat_pathes
+        :param remote_stats: dict() remote stats of the pathes given by stat_pathes
+        :return: list of the changes that were kept
+        """
+        self.local_sdk = local_sdk
+        self.remote_sdk = remote_sdk
+        ids_to_delete = []
+        kept = []
+        for change in changes:
+            if change['location'] == 'local':
+                unnecessary = self.filter_change(change, local_stats, remote_stats)
+            else:
+                unnecessary = self.filter_change(change, remote_stats, local_stats)
+            if unnecessary:
+                ids_to_delete.append(str(change['row_id']))
+            else:
+                kept.append(change)
+        if ids_to_delete:
+            self.conn.execute('DELETE FROM ajxp_changes WHERE row_id IN (' + ','.join(ids_to_delete) + ')')
+            self.conn.commit()
+            self.forget_rows(ids_to_delete)
+        logging.debug('[change store] Filtering unnecessary changes : pruned %i rows', len(ids_to_delete))
+        return kept
+
     def list_changes(self, cursor=0, limit=5, where=''):
         c = self.conn.cursor()
         sql = 'SELECT * FROM ajxp_changes ORDER BY seq_id LIMIT ?,?'
@@ -150,6 +344,19 @@ class SqliteChangeStore():
             logging.info("Total size of changes:" + str(total) + " bytes")
         return total
 
+    def count_changes(self):
+        """
+        Number of changes by location and type, and their total size
+        :return: (dict() location => dict() type => count, float total bytesize)
+        """
+        counts = {}
+        total = 0.0
+        for row in self.conn.execute('SELECT location, type, COUNT(*) as count, SUM(bytesize) as total '
+                                     'FROM ajxp_changes GROUP BY location, type'):
+            counts.setdefault(row['location'], {})[row['type']] = row['count']
+            total += float(row['total'] or 0)
+        return counts, total
+
     def commonprefix(self, path_list):
         return os.path.commonprefix(path_list).rpartition('/')[0]
 
@@ -306,6 +513,10 @@ class SqliteChangeStore():
         return map(lambda row: str(row['row_id']), to_remove)
 
     def clean_and_detect_conflicts(self, status_handler):
+        self.clean_solved_conflicts(status_handler)
+        return self.detect_conflicts(status_handler)
+
+    def clean_solved_conflicts(self, status_handler):
 
         # transform solved conflicts into process operation
         def handle_solved(node):
@@ -321,6 +532,13 @@ class SqliteChangeStore():
         status_handler.list_solved_nodes_w_callback(handle_solved)
         self.conn.commit()
 
+    def detect_conflicts(self, status_handler, in_group=False):
+        """
+        Store a CONFLICT status on nodes modified differently on both sides
+        :param status_handler: LocalDbHandler
+        :param in_group: bool only look at the changes selected by select_group()
+        :return: int number of conflicts
+        """
         sql = '         SELECT * ' \
               '                 FROM ajxp_changes t1 ' \
               '                 WHERE EXISTS (' \
@@ -332,6 +550,8 @@ class SqliteChangeStore():
               '                         t1.md5 != t2.md5 OR ( t1.md5 != "directory" AND t1.bytesize != t2.bytesize) ' \
               '                     )   ' \
               '                 )'
+        if in_group:
+            sql += ' AND t1.row_id IN (SELECT row_id FROM ajxp_group)'
         res = self.conn.execute(sql)
         conflicts = 0
         for row in res:
@@ -414,12 +634,14 @@ class SqliteChangeStore():
 
 
     def buffer_real_operation(self, location, type, source, target):
+        self.echoes = None
         location = 'remote' if location == 'local' else 'local'
         self.conn.execute("INSERT INTO ajxp_last_buffer (type,location,source,target) VALUES (?,?,?,?)",
                           (type, location, source.replace("\\", "/"), target.replace("\\", "/")))
         self.conn.commit()
 
     def bulk_buffer_real_operation(self, bulk):
+        self.echoes = None
         if bulk :
             for operation in bulk:
                 location = operation['location']
@@ -429,6 +651,7 @@ class SqliteChangeStore():
 
 
     def clear_operations_buffer(self):
+        self.echoes = None
         self.conn.execute("DELETE FROM ajxp_last_buffer")
         self.conn.commit()
 
@@ -453,7 +676,35 @@ class SqliteChangeStore():
         else:
             return self.local_sdk.stat(path, with_hash=True)
 
+    def start_seqs_tracking(self):
+        """
+        Keep the sequences of the remaining changes in memory, so that get_min_seq() does not query the db after
+        each processed change. Changes removed while tracking must be passed to forget_rows(), others are only
+        seen when tracking stops (the min sequence is then lower than needed, never higher).
+        """
+        self.flush_inserts()
+        self.seqs_heaps = {}
+        self.forgotten_rows = set()
+        for row in self.conn.execute('SELECT row_id, location, seq_id FROM ajxp_changes'):
+            self.seqs_heaps.setdefault(row['location'], []).append((row['seq_id'], row['row_id']))
+        for heap in self.seqs_heaps.values():
+            heapq.heapify(heap)
+
+    def stop_seqs_tracking(self):
+        self.seqs_heaps = None
+
+    def forget_rows(self, row_ids):
+        if self.seqs_heaps is not None:
+            self.forgotten_rows.update(int(row_id) for row_id in row_ids)
+
     def get_min_seq(self, location, success=False):
+        if self.seqs_heaps is not None:
+            heap = self.seqs_heaps.get(location, [])
+            while heap and heap[0][1] in self.forgotten_rows:
+                heapq.heappop(heap)
+            if not heap or not heap[0][0]:
+                return -1
+            return heap[0][0] if success else heap[0][0] - 1
         res = self.conn.execute("SELECT min(seq_id) FROM ajxp_changes WHERE location=?", (location,))
         for row in res:
             if not row[0]:
@@ -517,10 +768,23 @@ class SqliteChangeStore():
             bytesize,
             json.dumps(change)
         )
-        self.conn.execute("INSERT INTO ajxp_changes (seq_id, location, type, source, target, content, md5,"
-                          " bytesize, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", data)
+        self.insert_buffer.append(data)
+        if len(self.insert_buffer) >= self.STORE_BATCH_SIZE:
+            self.flush_inserts()
+
+    def flush_inserts(self):
+        """
+        Write the changes buffered by store() in one executemany
+        :return:
+        """
+        if not self.insert_buffer:
+            return
+        self.conn.executemany("INSERT INTO ajxp_changes (seq_id, location, type, source, target, content, md5,"
+                              " bytesize, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self.insert_buffer)
+        self.insert_buffer = []
 
     def remove(self, location, seq_id):
+        self.flush_inserts()
         self.conn.execute("DELETE FROM ajxp_changes WHERE location=? AND seq_id=?", (location, seq_id))
 
     #showing the changes store state
@@ -533,16 +797,24 @@ class SqliteChangeStore():
         logging.info("\n" + 15*"#" + 2*"\n")
 
     def sync(self):
+        self.flush_inserts()
         self.conn.commit()
 
     def echo_match(self, location, change):
         #if location == 'remote':
         #    pass
 
+        if self.echoes is None:
+            # ajxp_last_buffer is small, keep it in memory instead of querying it for each streamed change
+            self.echoes = set()
+            for row in self.conn.execute("SELECT type, location, source, target FROM ajxp_last_buffer"):
+                self.echoes.add((row['type'], row['location'], row['source'], row['target']))
+        if not self.echoes:
+            return False
         source = change['source'].replace("\\", "/")
         target = change['target'].replace("\\", "/")
         action = change['type']
-        for _ in self.conn.execute("SELECT id FROM ajxp_last_buffer WHERE type=? AND location=? AND source=? AND target=?", (action, location, source, target)):
+        if (action, location, source, target) in self.echoes:
             logging.debug('MATCHING ECHO FOR RECORD %s - %s - %s - %s' % (location, action, source, target,))
             return True
         return False
@@ -566,7 +838,7 @@ class SqliteChangeStore():
             last_info['max_seq'] = max_seq
 
             if not self.echo_match(location, row):
-                logging.debug("processing " + row['source'] + " -> " + row['target'])
+                logging.debug("processing %s -> %s", row['source'], row['target'])
                 source = row.pop('source')
                 target = row.pop('target')
                 if source == 'NULL':
@@ -647,3 +919,69 @@ class PathOperation(object):
     @staticmethod
     def path_compare(path1, path2):
         return os.path.normcase(os.path.normpath(path1)) == os.path.normcase(os.path.normpath(path2))
+
+
+class ChangeGroupsStatsLoader(threading.Thread):
+
+    def __init__(self, groups, local_sdk, remote_sdk, with_stats=True, max_ahead=2):
+        """
+        Load in background the stats needed to filter each group of changes (see SqliteChangeStore.get_change_groups
+        and filter_group), so that a group can be processed while the stats of the next ones are loaded.
+        Iterate over the loader to get (group, stats) tuples as they are ready.
+        :param groups: list of lists of changes
+        :param local_sdk: pydio.sdk.local.SystemSdk
+        :param remote_sdk: pydio.sdk.remote.PydioSdk
+        :param with_stats: bool if False, groups are given without stats (no filtering)
+        :param max_ahead: int number of groups loaded in advance
+        :return:
+        """
+        super(ChangeGroupsStatsLoader, self).__init__(name='ChangeGroupsStatsLoader')
+        self.daemon = True
+        self.groups = groups
+        self.local_sdk = local_sdk
+        self.remote_sdk = remote_sdk
+        self.with_stats = with_stats
+        self.queue = Queue.Queue(max_ahead)
+        self.stopped = False
+
+    def load_stats(self, group):
+        local_pathes, remote_pathes = SqliteChangeStore.stat_pathes(group)
+        local_stats = dict((path, self.local_sdk.stat(path, with_hash=with_hash))
+                           for (path, with_hash) in local_pathes.items())
+        remote_stats = {}
+        if remote_pathes:
+            remote_stats = self.remote_sdk.bulk_stat(remote_pathes, with_hash=True) or {}
+        return local_stats, remote_stats
+
+    def put(self, item):
+        while not self.stopped:
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except Queue.Full:
+                pass
+
+    def run(self):
+        for group in self.groups:
+            if self.stopped:
+                return
+            try:
+                stats = self.load_stats(group) if self.with_stats else None
+            except Exception:
+                self.put((group, None, sys.exc_info()))
+                return
+            self.put((group, stats, None))
+        self.put(None)
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            group, stats, exc_info = item
+            if exc_info:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            yield group, stats
+
+    def stop(self):
+        self.stopped = True
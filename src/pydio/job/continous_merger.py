@@ -25,21 +25,25 @@ import sys
 import threading
 import pickle
 import logging
+from collections import OrderedDict, Counter
 
 from requests.exceptions import ConnectionError, RequestException, Timeout, SSLError, ProxyError, TooManyRedirects, ChunkedEncodingError, ContentDecodingError, InvalidSchema, InvalidURL
 from pydio.job.change_processor import ChangeProcessor, StorageChangeProcessor
-from pydio.job.job_config import JobsLoader
+from pydio.job.change_stores import ChangeGroupsStatsLoader
+from pydio.job.job_config import JobsLoader, JobConfig
 from pydio.job.localdb import LocalDbHandler, SqlEventHandler, DBCorruptedException
 from pydio.job.local_watcher import LocalWatcher
 from pydio.sdk.exceptions import ProcessException, InterruptException, PydioSdkDefaultException
 from pydio.sdk.remote import PydioSdk
+from pydio.sdk.parallel import AsyncPydioSdk
+from pydio.sdk.journal import UploadJournal
 from pydio.sdk.local import SystemSdk
 from pydio.job.EventLogger import EventLogger
 
 from pydio.utils.functions import connection_helper
 
 from pydispatch import dispatcher
-from pydio import PUBLISH_SIGNAL, TRANSFER_RATE_SIGNAL, TRANSFER_CALLBACK_SIGNAL
+from pydio import PUBLISH_SIGNAL, TRANSFER_RATE_SIGNAL, TRANSFER_CALLBACK_SIGNAL, LOCAL_CHANGE_SIGNAL
 # -*- coding: utf-8 -*-
 from pydio.utils.global_config import ConfigManager
 
@@ -50,17 +54,24 @@ _ = i18n.language.ugettext
 class ContinuousDiffMerger(threading.Thread):
     """Main Thread grabbing changes from both sides, computing the necessary changes to apply, and applying them"""
 
-    def __init__(self, job_config, job_data_path):
+    def __init__(self, job_config, job_data_path, resources=None):
         """
         Initialize thread internals
         :param job_config: JobConfig instance
         :param job_data_path: Filesystem path where the job data are stored
+        :param resources: pydio.job.resources.ResourceManager shared with the other jobs (optional)
         :return:
         """
         threading.Thread.__init__(self)
         self.last_run = 0
         self.configs_path = job_data_path
         self.job_config = job_config
+        # Progress counters are updated by the processing and transfer threads and read by the web API
+        self.progress_lock = threading.Lock()
+        self.processing_signals = {}
+        self.current_tasks = []
+        # Changes of the group being processed, by row_id, see process_changes_pipelined
+        self.pending_tasks = None
         self.init_global_progress()
 
         self.basepath = job_config.directory
@@ -72,8 +83,13 @@ class ContinuousDiffMerger(threading.Thread):
             user_id=job_config.user_id,
             device_id=ConfigManager.Instance().get_device_id(),
             skip_ssl_verify=job_config.trust_ssl,
-            proxies=ConfigManager.Instance().get_defined_proxies()
+            proxies=ConfigManager.Instance().get_defined_proxies(),
+            session=resources.get_session(job_config.server) if resources else None
         )
+        if resources:
+            self.sdk.resources = resources.register_job(job_config.id, limits=job_config.get_bandwidth_limits)
+        # Blocking facade given to the change processors, answering the metadata calls prefetched for a group
+        self.async_sdk = AsyncPydioSdk(self.sdk)
         self.system = SystemSdk(job_config.directory)
         self.remote_seq = 0
         self.local_seq = 0
@@ -86,12 +102,36 @@ class ContinuousDiffMerger(threading.Thread):
         self.event_timer = 2
         self.online_timer = 10
         self.offline_timer = 60
+        # Cycles are started by trigger_sync() (local changes, remote push) or, without trigger, by timers. Remote
+        # changes are polled every online_timer; upload-only jobs just run a safety cycle every idle_timer.
+        self.idle_timer = 300
+        # A trigger starts the cycle once no new trigger came for trigger_debounce seconds, or after trigger_max_delay
+        self.trigger_debounce = 0.5
+        self.trigger_max_delay = 5
+        self.sync_event = threading.Event()
+        self.sync_requested = False
+        # Local pathes written by the processing of remote changes => expiry time. The watcher events on these
+        # pathes are echoes of our own writes, they must not trigger a new cycle.
+        self.local_echoes = dict()
+        self.local_echoes_lock = threading.Lock()
+        self.local_echo_delay = 10
+        # Cycles started, and cycles skipped by the is_cycle_needed() pre-check
+        self.cycles_stats = {'executed': 0, 'skipped': 0}
+        # Initial remote snapshot is committed every checkpoint_count changes or checkpoint_delay seconds
+        self.checkpoint_count = 5000
+        self.checkpoint_delay = 30
+        # While processing, the sequences file is written every sequences_checkpoint_count changes or
+        # sequences_checkpoint_delay seconds, and at the end of the cycle
+        self.sequences_checkpoint_count = 100
+        self.sequences_checkpoint_delay = 5
+        self.saved_sequences = None
+        self.unsaved_sequences = 0
+        self.sequences_time = 0
         self.online_status = True
         self.job_status_running = True
         self.direction = job_config.direction
         self.event_logger = EventLogger(self.configs_path)
-        self.processing_signals = {}
-        self.current_tasks = []
+        self.sdk.upload_journal = UploadJournal(self.configs_path + '/uploads.sqlite')
         self.event_handler = None
         self.watcher = None
         self.watcher_first_run = True
@@ -116,6 +156,7 @@ class ContinuousDiffMerger(threading.Thread):
                 sequences = pickle.load(open(self.configs_path + "/sequences", "rb"))
                 self.remote_seq = sequences['remote']
                 self.local_seq = sequences['local']
+                self.saved_sequences = (self.local_seq, self.remote_seq)
                 if self.event_handler:
                     self.event_handler.last_seq_id = self.local_seq
 
@@ -126,15 +167,20 @@ class ContinuousDiffMerger(threading.Thread):
 
         dispatcher.connect(self.handle_transfer_rate_event, signal=TRANSFER_RATE_SIGNAL, sender=self.sdk)
         dispatcher.connect(self.handle_transfer_callback_event, signal=TRANSFER_CALLBACK_SIGNAL, sender=self.sdk)
+        if self.event_handler:
+            self.trigger_debounce = self.event_handler.db_wait_duration
+            dispatcher.connect(self.handle_local_change_event, signal=LOCAL_CHANGE_SIGNAL, sender=self.event_handler)
 
         if self.job_config.frequency == 'manual':
             self.job_status_running = False
 
 
     def handle_transfer_callback_event(self, sender, change):
-        self.processing_signals[change['target']] = change
-        self.global_progress["queue_bytesize"] -= change['bytes_sent']
-        self.global_progress["queue_done"] += float(change['bytes_sent']) / float(change["total_size"])
+        with self.progress_lock:
+            self.processing_signals[change['target']] = change
+            self.global_progress["queue_bytesize"] -= change['bytes_sent']
+            self.global_progress["bytes_done"] += change['bytes_sent']
+            self.global_progress["queue_done"] += float(change['bytes_sent']) / float(change["total_size"])
 
     def handle_transfer_rate_event(self, sender, transfer_rate):
         """
@@ -143,10 +189,93 @@ class ContinuousDiffMerger(threading.Thread):
         :param transfer_rate:float
         :return:
         """
-        if self.global_progress['last_transfer_rate'] > 0:
-            self.global_progress['last_transfer_rate'] = (float(transfer_rate) + self.global_progress['last_transfer_rate']) / 2.0
-        else:
-            self.global_progress['last_transfer_rate'] = float(transfer_rate)
+        with self.progress_lock:
+            if self.global_progress['last_transfer_rate'] > 0:
+                self.global_progress['last_transfer_rate'] = (float(transfer_rate) + self.global_progress['last_transfer_rate']) / 2.0
+            else:
+                self.global_progress['last_transfer_rate'] = float(transfer_rate)
+
+    def handle_local_change_event(self, sender, pathes=None):
+        """
+        Handler for LOCAL_CHANGE_SIGNAL, sent by the watcher each time a change is indexed. Changes that are only
+        echoes of the files written by the merger itself are ignored.
+        :param sender: SqlEventHandler
+        :param pathes: list() of the pathes concerned, None if unknown
+        :return:
+        """
+        if pathes and all(self.is_local_echo(path) for path in pathes):
+            logging.debug('Ignoring local change on %s, written by the sync' % ', '.join(pathes))
+            return
+        self.trigger_sync()
+
+    def expect_local_echo(self, change):
+        """
+        Remember the local pathes that a remote change is going to write, until local_echo_delay seconds after
+        this call. Called before and after processing the change.
+        :param change: dict change about to be (or just) processed
+        :return:
+        """
+        if change.get('location') != 'remote' or change.get('type') == 'bulk_mkdirs':
+            return
+        now = time.time()
+        with self.local_echoes_lock:
+            if len(self.local_echoes) > 1000:
+                self.local_echoes = dict((p, t) for (p, t) in self.local_echoes.items() if t > now)
+            for path in (change.get('source'), change.get('target')):
+                if path and path != 'NULL':
+                    self.local_echoes[path.replace('\\', '/').rstrip('/')] = now + self.local_echo_delay
+
+    def is_local_echo(self, path):
+        """
+        Whether a local path (or one of its parents) was recently written by the processing of remote changes
+        :param path: str node path, relative to the job directory
+        :return: bool
+        """
+        path = path.replace('\\', '/').rstrip('/')
+        now = time.time()
+        with self.local_echoes_lock:
+            while path:
+                expiry = self.local_echoes.get(path)
+                if expiry is not None and expiry > now:
+                    return True
+                path = path.rsplit('/', 1)[0]
+        return False
+
+    def trigger_sync(self):
+        """
+        Ask for a sync cycle as soon as possible, instead of waiting for the next timer. Can be called from any
+        thread (watcher, remote push channel...), triggers received while a cycle runs start another one after it.
+        :return:
+        """
+        self.sync_requested = True
+        self.sync_event.set()
+
+    def wait_for_trigger(self, timeout):
+        """
+        Block until trigger_sync() is called or timeout expires. Bursts of triggers (e.g. an application saving
+        a file in many writes) are debounced into a single cycle.
+        :param timeout: float max seconds to wait
+        :return: bool whether a trigger was received
+        """
+        if not self.sync_event.wait(timeout):
+            return False
+        first = time.time()
+        while not self.interrupt:
+            self.sync_event.clear()
+            if not self.sync_event.wait(self.trigger_debounce) or time.time() - first > self.trigger_max_delay:
+                break
+        return True
+
+    def next_cycle_delay(self):
+        """
+        Seconds to wait, since the last cycle, before starting a cycle without trigger
+        :return: float
+        """
+        if not self.online_status:
+            return self.offline_timer
+        if self.watcher and self.job_config.direction == 'up':
+            return self.idle_timer
+        return self.online_timer
 
     def is_running(self):
         """
@@ -160,27 +289,94 @@ class ContinuousDiffMerger(threading.Thread):
         Initialize the internal progress data
         :return:None
         """
-        self.global_progress = {
-            'status_indexing'   :0,
-            'queue_length'      :0,
-            'queue_done'        :0.0,
-            'queue_bytesize'    :0,
-            'last_transfer_rate':-1,
-            'queue_start_time'  :time.clock(),
-            'total_time'        :0
-        }
+        with self.progress_lock:
+            self.global_progress = {
+                'status_indexing'   :0,
+                'queue_length'      :0,
+                'queue_done'        :0.0,
+                'queue_bytesize'    :0,
+                'queue_counts'      :{},
+                'bytes_done'        :0,
+                'last_transfer_rate':-1,
+                'queue_start_time'  :time.clock(),
+                'total_time'        :0
+            }
+            self.processing_signals = {}
+
+    def init_queue_progress(self):
+        """
+        Set the progress counters from the changes of the current store, before processing them. They are then
+        updated as changes are processed or filtered out, without querying the store again.
+        :return:
+        """
+        counts, bytesize = self.current_store.count_changes()
+        with self.progress_lock:
+            self.global_progress['queue_counts'] = counts
+            self.global_progress['queue_length'] = sum(sum(types.values()) for types in counts.values())
+            self.global_progress['queue_bytesize'] = bytesize
+            self.global_progress['bytes_done'] = 0
+
+    def update_queue_progress(self, change, processed=True):
+        """
+        Remove a change from the progress counters
+        :param change: dict change processed (see process_changes_with_callback), or filtered out
+        :param processed: bool whether the change was processed, or just removed from the queue
+        :return:
+        """
+        if change['type'] == 'bulk_mkdirs':
+            count, bytesize = len(change['pathes']), 0
+            location, change_type = 'local', 'create'
+        else:
+            count, bytesize = 1, float(change['bytesize'] or 0)
+            location, change_type = change['location'], change['type']
+        with self.progress_lock:
+            counts = self.global_progress['queue_counts'].get(location, {})
+            if change_type in counts:
+                counts[change_type] = max(counts[change_type] - count, 0)
+            if self.pending_tasks is not None:
+                if change['type'] == 'bulk_mkdirs':
+                    for row_id, task in self.pending_tasks.items():
+                        if task['location'] == 'local' and task['type'] == 'create' \
+                                and task['target'] in change['pathes']:
+                            del self.pending_tasks[row_id]
+                else:
+                    self.pending_tasks.pop(change.get('row_id'), None)
+            transfer = self.processing_signals.pop(change.get('target'), None)
+            if transfer:
+                # Bytes already counted by the transfer callbacks
+                bytesize -= transfer.get('total_bytes_sent', 0)
+            self.global_progress['queue_bytesize'] = max(self.global_progress['queue_bytesize'] - bytesize, 0)
+            if processed:
+                self.global_progress['bytes_done'] += max(bytesize, 0)
+            else:
+                self.global_progress['queue_length'] -= count
 
-    def update_global_progress(self, compute_queue_size=True):
+    def update_global_progress(self, compute_queue_size=False):
         """
         Compute a dict representation with many indications about the current state of the queue
+        :param compute_queue_size: bool compute the queue size from the store instead of the progress counters
         :return: dict
         """
+        stats = self.sdk.resources.get_stats() if self.sdk.resources else None
+        queue_bytesize = self.compute_queue_bytesize() if compute_queue_size else None
+        with self.progress_lock:
+            return self._update_global_progress(stats, queue_bytesize)
+
+    def _update_global_progress(self, stats, queue_bytesize):
         self.global_progress['total_time'] = time.clock() - self.global_progress['queue_start_time']
-        if compute_queue_size:
-            self.global_progress["queue_bytesize"] = self.compute_queue_bytesize()
+        if stats:
+            # Bytes actually sent and received recently, throttling included
+            self.global_progress['upload_rate'] = stats['rate_up']
+            self.global_progress['download_rate'] = stats['rate_down']
+            self.global_progress['upload_limit'] = stats['limit_up']
+            self.global_progress['download_limit'] = stats['limit_down']
+            if stats['rate_up'] or stats['rate_down']:
+                self.global_progress['last_transfer_rate'] = float(stats['rate_up'] + stats['rate_down'])
+        if queue_bytesize is not None:
+            self.global_progress["queue_bytesize"] = queue_bytesize
         # compute an eta
         eta = -1
-        if self.global_progress['last_transfer_rate'] > -1 and self.global_progress['queue_bytesize'] > 0:
+        if self.global_progress['last_transfer_rate'] > 0 and self.global_progress['queue_bytesize'] > 0:
             eta = self.global_progress['queue_bytesize'] / self.global_progress['last_transfer_rate']
         elif self.global_progress['queue_done']:
             remaining_operations = self.global_progress['queue_length'] - self.global_progress['queue_done']
@@ -192,33 +388,83 @@ class ContinuousDiffMerger(threading.Thread):
         return self.global_progress
 
     def get_global_progress(self):
-        self.update_global_progress(compute_queue_size=False)
-        return self.global_progress
+        """
+        Snapshot of the progress counters, safe to read from another thread and without any query on the store
+        :return: dict
+        """
+        stats = self.sdk.resources.get_stats() if self.sdk.resources else None
+        with self.progress_lock:
+            progress = dict(self._update_global_progress(stats, None))
+            progress['queue_counts'] = dict((location, dict(types)) for location, types
+                                            in progress['queue_counts'].items())
+        return progress
 
-    def update_current_tasks(self, cursor=0, limit=5):
+    def get_resources_stats(self):
         """
-        Get a list of the current tasks
-        :return: list()
+        Throughput of the job, see pydio.job.resources.JobResources
+        :return: dict or None if the job does not use shared resources
         """
-        if not hasattr(self, 'current_store'):
-            return []
-        self.current_tasks = self.current_store.list_changes(cursor, limit)
-        for change in self.current_tasks:
-            if change['target'] in self.processing_signals:
-                progress = self.processing_signals[change['target']]
-                for key in progress.keys():
-                    change[key] = progress[key]
+        if not self.sdk.resources:
+            return None
+        return self.sdk.resources.get_stats()
+
+    def set_bandwidth(self, bandwidth):
+        """
+        Change the bandwidth settings of the job, running transfers included
+        :param bandwidth: dict, see JobConfig.bandwidth
+        :return:
+        """
+        self.job_config.bandwidth = JobConfig.normalize_bandwidth(bandwidth)
+        if self.sdk.resources:
+            self.sdk.resources.apply_limits()
+
+    def set_pending_tasks(self, changes):
+        """
+        Set the changes about to be processed, the current tasks are then taken from them without querying the store
+        :param changes: list of changes, None when processing is over
+        :return:
+        """
+        with self.progress_lock:
+            if changes is None:
+                self.pending_tasks = None
+            else:
+                self.pending_tasks = OrderedDict((change['row_id'], change) for change in changes)
+        self.update_current_tasks()
+
+    def update_current_tasks(self, change=None, limit=5):
+        """
+        Refresh the list of the current tasks: the change being processed, then the next pending ones
+        :param change: dict change being processed, if any
+        :param limit: int maximum number of tasks
+        :return:
+        """
+        with self.progress_lock:
+            current_tasks = []
+            if change and change['type'] != 'bulk_mkdirs':
+                current_tasks.append(change)
+            for row_id, task in (self.pending_tasks or {}).iteritems():
+                if len(current_tasks) >= limit:
+                    break
+                if not change or row_id != change.get('row_id'):
+                    current_tasks.append(task)
+            self.current_tasks = current_tasks
 
     def get_current_tasks(self):
-        for change in self.current_tasks:
-            if change['target'] in self.processing_signals:
-                progress = self.processing_signals[change['target']]
-                for key in progress.keys():
-                    change[key] = progress[key]
-        return {
-            'total': self.global_progress['queue_length'],
-            'current': self.current_tasks
-        }
+        """
+        Snapshot of the next changes to process, with the progress of the ones being transferred
+        :return: dict
+        """
+        with self.progress_lock:
+            current = []
+            for task in self.current_tasks:
+                change = dict(task)
+                if change['target'] in self.processing_signals:
+                    change.update(self.processing_signals[change['target']])
+                current.append(change)
+            return {
+                'total': self.global_progress['queue_length'],
+                'current': current
+            }
 
     def compute_queue_bytesize(self):
         """
@@ -229,14 +475,16 @@ class ContinuousDiffMerger(threading.Thread):
             return 0
         total = 0
         exclude_pathes = []
-        for task in self.processing_signals:
-            if 'remaining_bytes' in task:
-                total += float(task['remaining_bytes'])
-                exclude_pathes.append('"' + task['target'] + '"')
-        where = ''
+        with self.progress_lock:
+            transfers = self.processing_signals.values()
+        for task in transfers:
+            if 'total_size' in task and 'total_bytes_sent' in task:
+                # Files being transferred only count for their remaining bytes
+                total += float(task['total_size']) - float(task['total_bytes_sent'])
+                exclude_pathes.append('"' + task['target'].replace('"', '""') + '"')
         if len(exclude_pathes):
-            where = "target IN (" + ','.join(exclude_pathes) + ")"
-            return self.current_store.sum_sizes(where)
+            where = "target NOT IN (" + ','.join(exclude_pathes) + ")"
+            return total + self.current_store.sum_sizes(where)
         else:
             return self.current_store.sum_sizes()
 
@@ -248,6 +496,7 @@ class ContinuousDiffMerger(threading.Thread):
         self.last_run = 0
         self.sdk.remove_interrupt()
         self.resume()
+        self.trigger_sync()
 
     def pause(self):
         """
@@ -277,7 +526,9 @@ class ContinuousDiffMerger(threading.Thread):
             self.watcher.stop()
         self.info(_('Job stopping'), toUser='PAUSE', channel='status')
         self.sdk.set_interrupt()
+        self.async_sdk.shutdown()
         self.interrupt = True
+        self.sync_event.set()
 
     def sleep_offline(self):
         """
@@ -298,6 +549,7 @@ class ContinuousDiffMerger(threading.Thread):
         time.sleep(self.event_timer)
 
     def exit_loop_clean(self, logger):
+        self.save_sequences()
         self.marked_for_snapshot_pathes = []
         self.current_store.close()
         self.init_global_progress()
@@ -344,15 +596,18 @@ class ContinuousDiffMerger(threading.Thread):
 
             try:
                 # logging.info('Starting cycle with cycles local %i and remote %is' % (self.local_seq, self.remote_seq))
-                self.processing_signals = {}
                 self.init_global_progress()
                 if very_first:
                     self.global_progress['status_indexing'] = 1
 
-                interval = int(time.time() - self.last_run)
-                if (self.online_status and interval < self.online_timer) or (not self.online_status and interval < self.offline_timer):
-                    time.sleep(self.event_timer)
-                    continue
+                # When offline, wait for the timer anyway: a local change cannot reach the server
+                if not self.sync_requested or not self.online_status:
+                    delay = self.next_cycle_delay() - (time.time() - self.last_run)
+                    if delay > 0:
+                        self.wait_for_trigger(delay)
+                        continue
+                self.sync_requested = False
+                self.sync_event.clear()
 
                 if not self.job_status_running:
                     logging.debug("self.online_timer: %s" % self.online_timer)
@@ -385,6 +640,18 @@ class ContinuousDiffMerger(threading.Thread):
                                                         raise InterruptException()
                         self.watcher.check_from_snapshot(snap_path)
 
+                if not very_first and not self.is_cycle_needed():
+                    self.cycles_stats['skipped'] += 1
+                    logging.debug('No change since last cycle (%(executed)i cycles executed, %(skipped)i skipped)'
+                                  % self.cycles_stats)
+                    self.online_status = True
+                    self.last_run = time.time()
+                    continue
+                self.cycles_stats['executed'] += 1
+
+                # Remote nodes may have changed since last cycle
+                self.sdk.remote_cache.clear()
+
                 # Load local and/or remote changes, depending on the direction
                 from pydio.job.change_stores import SqliteChangeStore
                 self.current_store = SqliteChangeStore(self.configs_path + '/changes.sqlite', self.job_config.filters['includes'], self.job_config.filters['excludes'])
@@ -396,6 +663,7 @@ class ContinuousDiffMerger(threading.Thread):
                             logger.log_state(_('Gathering data from remote workspace, this can take a while...'), 'sync')
                             very_first = True
                         self.remote_target_seq = self.load_remote_changes_in_store(self.remote_seq, self.current_store)
+                        self.current_store.clear_checkpoint('remote')
                         self.current_store.sync()
                     else:
                         self.remote_target_seq = 1
@@ -449,23 +717,11 @@ class ContinuousDiffMerger(threading.Thread):
                 logging.debug('Dedup changes')
                 self.current_store.dedup_changes()
                 self.update_min_seqs_from_store()
-                if not self.storage_watcher or very_first:
-                    logging.debug('Detect unnecessary changes')
-                    self.current_store.detect_unnecessary_changes(local_sdk=self.system, remote_sdk=self.sdk)
-                self.update_min_seqs_from_store()
                 logging.debug('Clearing op and pruning folders moves')
                 self.current_store.clear_operations_buffer()
                 self.current_store.prune_folders_moves()
                 self.update_min_seqs_from_store()
-
-                logging.debug('Store conflicts')
-                store_conflicts = self.current_store.clean_and_detect_conflicts(self.db_handler)
-                if store_conflicts:
-                    logging.info('Conflicts detected, cannot continue!')
-                    logger.log_state(_('Conflicts detected, cannot continue!'), 'error')
-                    self.current_store.close()
-                    self.sleep_offline()
-                    continue
+                self.current_store.clean_solved_conflicts(self.db_handler)
 
                 changes_length = len(self.current_store)
                 if not changes_length:
@@ -476,7 +732,7 @@ class ContinuousDiffMerger(threading.Thread):
 
                 self.global_progress['status_indexing'] = 0
                 import change_processor
-                self.global_progress['queue_length'] = changes_length
+                self.init_queue_progress()
                 logging.info('Processing %i changes' % changes_length)
                 logger.log_state(_('Processing %i changes') % changes_length, "start")
                 counter = [1]
@@ -484,17 +740,20 @@ class ContinuousDiffMerger(threading.Thread):
                     try:
                         if self.interrupt or not self.job_status_running:
                             raise InterruptException()
-                        self.update_current_tasks()
-                        self.update_global_progress()
+                        self.update_current_tasks(change)
                         Processor = StorageChangeProcessor if self.storage_watcher else ChangeProcessor
-                        proc = Processor(change, self.current_store, self.job_config, self.system, self.sdk,
-                                               self.db_handler, self.event_logger)
-                        proc.process_change()
+                        proc = Processor(change, self.current_store, self.job_config, self.system, self.async_sdk,
+                                               self.db_handler, self.event_logger, self.global_progress)
+                        self.expect_local_echo(change)
+                        try:
+                            proc.process_change()
+                        finally:
+                            self.expect_local_echo(change)
                         self.update_min_seqs_from_store(success=True)
-                        self.global_progress['queue_done'] = float(counter[0])
+                        self.update_queue_progress(change)
+                        with self.progress_lock:
+                            self.global_progress['queue_done'] = float(counter[0])
                         counter[0] += 1
-                        self.update_current_tasks()
-                        self.update_global_progress()
                         time.sleep(0.1)
                         if self.interrupt or not self.job_status_running:
                             raise InterruptException()
@@ -511,12 +770,17 @@ class ContinuousDiffMerger(threading.Thread):
                         return False
                     return True
 
-                try:
-                    if sys.platform.startswith('win'):
-                        self.marked_for_snapshot_pathes = list(set(self.current_store.find_modified_parents()) - set(self.marked_for_snapshot_pathes))
-                    self.current_store.process_changes_with_callback(processor_callback)
-                except InterruptException as iexc:
-                    pass
+                if sys.platform.startswith('win'):
+                    self.marked_for_snapshot_pathes = list(set(self.current_store.find_modified_parents()) - set(self.marked_for_snapshot_pathes))
+                store_conflicts = self.process_changes_pipelined(processor_callback,
+                                                                 filter_changes=(not self.storage_watcher or very_first))
+                if store_conflicts:
+                    logging.info('Conflicts detected, cannot continue!')
+                    logger.log_state(_('Conflicts detected, cannot continue!'), 'error')
+                    self.save_sequences()
+                    self.current_store.close()
+                    self.sleep_offline()
+                    continue
                 logger.log_state(_('%i files modified') % self.global_progress['queue_done'], 'success')
                 if self.global_progress['queue_done']:
                     logger.log_notif(_('%i files modified') % self.global_progress['queue_done'], 'success')
@@ -557,9 +821,158 @@ class ContinuousDiffMerger(threading.Thread):
                     logger.log_state(_('Unexpected Error: %s') % e.message, 'error')
 
             logging.debug('Finished this cycle, waiting for %i seconds' % self.online_timer)
+            logging.debug('Http connections opened: %(connections)i for %(requests)i requests'
+                          % self.sdk.get_connection_stats())
+            logging.debug('Cycles: %(executed)i executed, %(skipped)i skipped' % self.cycles_stats)
+            cache_stats = self.sdk.get_cache_stats()
+            logging.debug('Remote cache: %i hits, %i misses (%.0f%%), %i entries'
+                          % (cache_stats['hits'], cache_stats['misses'], cache_stats['hit_rate'] * 100,
+                             cache_stats['entries']))
             self.exit_loop_clean(logger)
             very_first = False
 
+    def is_cycle_needed(self):
+        """
+        Pre-check done before loading the changes: compare the last local sequence of the index and the last remote
+        sequence with the ones already synced. The change store, the changes streams and the sequences file are
+        only touched when something changed.
+        :return: bool
+        """
+        if self.marked_for_snapshot_pathes or not self.job_config.server_configs:
+            return True
+        if self.job_config.direction != 'down' and self.db_handler.get_max_seq() > self.local_seq:
+            return True
+        if self.job_config.direction != 'up':
+            if not self.remote_seq:
+                return True
+            try:
+                last_seq = self.sdk.peek_changes(self.remote_seq)
+            except Exception as e:
+                # Let the full cycle handle and report the error
+                logging.debug('Cannot check remote changes: %s' % e)
+                return True
+            if last_seq is None:
+                return True
+            if last_seq != self.remote_seq:
+                # Only changes filtered out by the server, nothing to load
+                self.remote_seq = self.remote_target_seq = last_seq
+                self.save_sequences()
+        return False
+
+    def process_changes_pipelined(self, processor_callback, filter_changes=True):
+        """
+        Filter, check for conflicts and process the changes of the current store by groups of independent
+        changes (see SqliteChangeStore.get_change_groups): the first transfers start as soon as the first group is
+        filtered, while the stats of the next groups are loaded in background. The changes of a group with
+        conflicts are not processed, the other groups are.
+        :param processor_callback: function(change) processing one change
+        :param filter_changes: bool remove unnecessary changes (see SqliteChangeStore.filter_change) first
+        :return: int number of conflicts detected
+        """
+        groups = self.current_store.get_change_groups()
+        logging.debug('Processing changes in %i groups' % len(groups))
+        loader = ChangeGroupsStatsLoader(groups, self.system, self.sdk, with_stats=filter_changes)
+        loader.start()
+        self.current_store.start_seqs_tracking()
+        conflicts = 0
+        try:
+            for group, stats in loader:
+                if self.interrupt or not self.job_status_running:
+                    break
+                if stats:
+                    kept = self.current_store.filter_group(group, self.system, self.sdk, stats[0], stats[1])
+                    if len(kept) < len(group):
+                        kept_ids = set(change['row_id'] for change in kept)
+                        for change in group:
+                            if change['row_id'] not in kept_ids:
+                                self.update_queue_progress(change, processed=False)
+                        self.update_min_seqs_from_store()
+                    group = kept
+                if not group:
+                    continue
+                self.current_store.select_group(group)
+                group_conflicts = self.current_store.detect_conflicts(self.db_handler, in_group=True)
+                if group_conflicts:
+                    conflicts += group_conflicts
+                    continue
+                self.set_pending_tasks(group)
+                try:
+                    if not self.storage_watcher:
+                        self.prefetch_remote_metadata(group)
+                    self.current_store.process_changes_with_callback(processor_callback, in_group=True)
+                except InterruptException:
+                    break
+                finally:
+                    self.async_sdk.discard_prefetched()
+        finally:
+            loader.stop()
+            self.current_store.stop_seqs_tracking()
+            self.set_pending_tasks(None)
+        return conflicts
+
+    def prefetch_remote_metadata(self, group):
+        """
+        Start the remote deletes, moves and empty file creations of a group concurrently (see AsyncPydioSdk), so that
+        the change processors, which handle the changes one by one, find their results instead of waiting for one
+        request after the other. Only the changes that no other change of the group depends on are prefetched: none
+        of their pathes is equal to, inside or above a path of another change. For a move, the source is stated
+        first, as ChangeProcessor does, and only renamed if it exists.
+        :param group: list of changes about to be processed, see SqliteChangeStore.get_change_groups
+        :return: int number of changes prefetched
+        """
+        if self.job_config.direction == 'down' or self.interrupt:
+            return 0
+
+        def pathes(change):
+            return set(p for p in (change.get('source'), change.get('target')) if p and p != 'NULL')
+
+        def ancestors(path):
+            parts = path.strip('/').split('/')
+            return set('/' + '/'.join(parts[:i]) for i in range(len(parts)))
+
+        # Changes using each path, and changes with a path inside each folder
+        used = Counter()
+        inside = Counter()
+        for change in group:
+            own = pathes(change)
+            used.update(own)
+            inside.update(set.union(set(), *[ancestors(p) for p in own]))
+
+        independent = []
+        for change in group:
+            if change['location'] != 'local':
+                continue
+            if change['type'] not in ('delete', 'path') and (change['type'] not in ('create', 'content') or
+                                                             change['md5'] == 'directory' or change['bytesize'] != 0):
+                continue
+            own = pathes(change)
+            own_ancestors = set.union(set(), *[ancestors(p) for p in own])
+            if [p for p in own if used[p] > 1 or inside[p] > (1 if p in own_ancestors else 0)]:
+                continue
+            if [a for a in own_ancestors if used[a] > (1 if a in own else 0)]:
+                continue
+            independent.append(change)
+        if not independent:
+            return 0
+
+        moves = [change for change in independent if change['type'] == 'path']
+        stats = [self.async_sdk.prefetch('stat', change['source']) for change in moves]
+        for change in independent:
+            if change['type'] == 'delete':
+                self.async_sdk.prefetch('delete', change['source'])
+            elif change['type'] != 'path':
+                self.async_sdk.prefetch('mkfile', change['target'])
+        for change, stat in zip(moves, stats):
+            try:
+                exists = stat.result()
+            except Exception:
+                # Raised again by the processor of the change
+                continue
+            if exists:
+                self.async_sdk.prefetch('rename', change['source'], change['target'])
+        logging.debug('Prefetched the remote metadata operations of %i changes' % len(independent))
+        return len(independent)
+
     def update_min_seqs_from_store(self, success=False):
         self.local_seq = self.current_store.get_min_seq('local', success=success)
         if self.local_seq == -1:
@@ -567,14 +980,41 @@ class ContinuousDiffMerger(threading.Thread):
         self.remote_seq = self.current_store.get_min_seq('remote', success=success)
         if self.remote_seq == -1:
             self.remote_seq = self.remote_target_seq
-        logging.debug('Storing sequences remote=%i local=%i', self.remote_seq, self.local_seq)
-        pickle.dump(dict(
-            local=self.local_seq,
-            remote=self.remote_seq
-        ), open(self.configs_path + '/sequences', 'wb'))
+        self.save_sequences(force=False)
         if self.event_handler:
             self.event_handler.last_seq_id = self.local_seq
 
+    def save_sequences(self, force=True):
+        """
+        Write the sequences file if they changed. It is written to a temporary file first and then renamed, so that
+        a crash cannot leave a truncated file.
+        :param force: bool if False, only write every sequences_checkpoint_count changes or sequences_checkpoint_delay
+        seconds: a crash in between only means that the last changes are loaded (and filtered out) again.
+        :return:
+        """
+        sequences = (self.local_seq, self.remote_seq)
+        if sequences == self.saved_sequences:
+            return
+        self.unsaved_sequences += 1
+        if not force and self.unsaved_sequences < self.sequences_checkpoint_count \
+                and time.time() - self.sequences_time < self.sequences_checkpoint_delay:
+            return
+        logging.debug('Storing sequences remote=%i local=%i', self.remote_seq, self.local_seq)
+        path = self.configs_path + '/sequences'
+        with open(path + '.tmp', 'wb') as fd:
+            pickle.dump(dict(
+                local=self.local_seq,
+                remote=self.remote_seq
+            ), fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        if sys.platform.startswith('win') and os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '.tmp', path)
+        self.saved_sequences = sequences
+        self.unsaved_sequences = 0
+        self.sequences_time = time.time()
+
     def ping_remote(self):
         """
         Simple stat of the remote server root, to know if it's reachable.
@@ -589,5 +1029,38 @@ class ContinuousDiffMerger(threading.Thread):
             dispatcher.send(signal=PUBLISH_SIGNAL, sender=self, channel=channel, message=message)
 
     def load_remote_changes_in_store(self, seq_id, store):
-        last_seq = self.sdk.changes_stream(seq_id, store.flatten_and_store)
+        if seq_id != 0:
+            last_seq = self.sdk.changes_stream(seq_id, store.flatten_and_store)
+            return last_seq
+
+        # Initial snapshot: commit it by batches along with a checkpoint, so that it can be resumed from the
+        # last checkpoint if the connection drops (see SqliteChangeStore.open)
+        checkpoint = store.get_checkpoint('remote')
+        if checkpoint:
+            logging.info('Resuming initial remote snapshot from sequence %i' % checkpoint)
+        state = {'previous_seq': checkpoint, 'ordered': True, 'count': 0, 'time': time.time()}
+
+        def checkpoint_callback(location, row, info):
+            if not row:
+                return store.flatten_and_store(location, row, info)
+            seq = row['seq']
+            previous_node = info.get('node_id')
+            store.flatten_and_store(location, row, info)
+            # When a new node starts, the change of the previous node has been stored (echoes are skipped)
+            new_node = (info.get('node_id') != previous_node)
+            if state['ordered'] and seq < state['previous_seq']:
+                # Stream is not sorted by sequence, a checkpoint would not tell what is already loaded
+                logging.info('Remote changes are not sorted by sequence, initial snapshot cannot be resumed')
+                state['ordered'] = False
+                store.clear_checkpoint('remote')
+                store.sync()
+            state['count'] += 1
+            if state['ordered'] and new_node and (state['count'] >= self.checkpoint_count or
+                                                  time.time() - state['time'] > self.checkpoint_delay):
+                store.checkpoint('remote', state['previous_seq'])
+                state['count'] = 0
+                state['time'] = time.time()
+            state['previous_seq'] = seq
+
+        last_seq = self.sdk.changes_stream(checkpoint, checkpoint_callback, flatten=True)
         return last_seq
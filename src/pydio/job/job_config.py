@@ -24,7 +24,9 @@ import json
 import urlparse
 import os
 import logging
+import datetime
 from pydio.utils.functions import Singleton
+from pydio.job.EventLogger import EventsBuffer
 
 
 @Singleton
@@ -95,8 +97,12 @@ class JobsLoader():
         job_data_path = self.build_job_data_path(job_id)
         if os.path.exists(job_data_path + "/sequences"):
             os.remove(job_data_path + "/sequences")
+        # Events still buffered for the job must not be written to, or recreate, the removed database
+        EventsBuffer.discard(job_data_path + "/pydio.sqlite")
         if os.path.exists(job_data_path + "/pydio.sqlite"):
             os.remove(job_data_path + "/pydio.sqlite")
+        if os.path.exists(job_data_path + "/uploads.sqlite"):
+            os.remove(job_data_path + "/uploads.sqlite")
         if parent and os.path.exists(job_data_path):
             import shutil
             shutil.rmtree(job_data_path)
@@ -121,6 +127,10 @@ class JobConfig:
         self.solve = 'manual'
         self.monitor = True
         self.trust_ssl = False
+        # Transfer rate limits in KB/s, 0 for no limit. Schedule entries override them during a time range:
+        # {"start": {"h": 8, "m": 0}, "end": {"h": 18, "m": 0}, "days": [0, 1, 2, 3, 4], "up": 100, "down": 500}
+        # (days are optional, 0 is monday; a range ending before its start goes past midnight)
+        self.bandwidth = {'up': 0, 'down': 0, 'schedule': []}
         self.filters = dict(
             includes=['*'],
             excludes=['.*', '*/.*', '/recycle_bin*', '*.pydio_dl', '*.DS_Store', '.~lock.*']
@@ -135,6 +145,108 @@ class JobConfig:
             i += 1
         self.id = test_id
 
+    def get_bandwidth_limits(self, now=None):
+        """
+        Transfer rate limits applying at a given time
+        :param now: datetime.datetime, current local time if None
+        :return: dict {'up': bytes per second, 'down': bytes per second}, 0 for no limit
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        limits = dict((direction, JobConfig.normalize_rate(self.bandwidth.get(direction, 0)) or 0)
+                      for direction in ('up', 'down'))
+        minutes = now.hour * 60 + now.minute
+        for entry in self.bandwidth.get('schedule', []):
+            entry = JobConfig.normalize_schedule_entry(entry)
+            if not entry:
+                continue
+            start = entry['start']['h'] * 60 + entry['start']['m']
+            end = entry['end']['h'] * 60 + entry['end']['m']
+            if start <= end:
+                active = start <= minutes < end
+                day = now.weekday()
+            else:
+                active = minutes >= start or minutes < end
+                # After midnight, the range belongs to the day it started
+                day = now.weekday() if minutes >= start else (now.weekday() - 1) % 7
+            if active and ('days' not in entry or day in entry['days']):
+                for direction in ('up', 'down'):
+                    if direction in entry:
+                        limits[direction] = entry[direction]
+                break
+        return dict((direction, int(limits[direction] * 1024)) for direction in limits)
+
+    @staticmethod
+    def normalize_rate(value):
+        """
+        Check a transfer rate limit
+        :param value: int KB/s
+        :return: int KB/s, None if it is not a positive number or 0
+        """
+        if isinstance(value, bool):
+            return None
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return None
+        return value if value >= 0 else None
+
+    @staticmethod
+    def normalize_schedule_entry(entry):
+        """
+        Check a bandwidth schedule entry, see JobConfig.bandwidth
+        :param entry: dict
+        :return: dict with int values, None if the entry is malformed
+        """
+        if not isinstance(entry, dict):
+            return None
+        normalized = dict()
+        try:
+            for bound in ('start', 'end'):
+                h, m = int(entry[bound]['h']), int(entry[bound].get('m', 0))
+                if not (0 <= h < 24 and 0 <= m < 60):
+                    return None
+                normalized[bound] = {'h': h, 'm': m}
+            if 'days' in entry:
+                normalized['days'] = [int(day) for day in entry['days']]
+                if [day for day in normalized['days'] if not 0 <= day < 7]:
+                    return None
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return None
+        for direction in ('up', 'down'):
+            if direction in entry:
+                normalized[direction] = JobConfig.normalize_rate(entry[direction])
+                if normalized[direction] is None:
+                    return None
+        return normalized
+
+    @staticmethod
+    def normalize_bandwidth(bandwidth):
+        """
+        Check bandwidth settings coming from the config file or the API. Invalid limits are reset to 0 (no limit)
+        and malformed schedule entries are dropped.
+        :param bandwidth: dict, see JobConfig.bandwidth
+        :return: dict
+        """
+        normalized = {'up': 0, 'down': 0, 'schedule': []}
+        if not isinstance(bandwidth, dict):
+            return normalized
+        for direction in ('up', 'down'):
+            if direction in bandwidth:
+                rate = JobConfig.normalize_rate(bandwidth[direction])
+                if rate is None:
+                    logging.warning('Ignoring invalid %s bandwidth limit %r' % (direction, bandwidth[direction]))
+                else:
+                    normalized[direction] = rate
+        schedule = bandwidth.get('schedule', [])
+        for entry in schedule if isinstance(schedule, list) else []:
+            checked = JobConfig.normalize_schedule_entry(entry)
+            if checked is None:
+                logging.warning('Ignoring invalid bandwidth schedule entry %r' % (entry,))
+            else:
+                normalized['schedule'].append(checked)
+        return normalized
+
     @staticmethod
     def encoder(obj):
         if isinstance(obj, JobConfig):
@@ -151,6 +263,7 @@ class JobConfig:
                     "solve": obj.solve,
                     "start_time": obj.start_time,
                     "trust_ssl":obj.trust_ssl,
+                    "bandwidth": obj.bandwidth,
                     "active": obj.active}
         raise TypeError(repr(JobConfig) + " can't be encoded")
 
@@ -200,6 +313,8 @@ class JobConfig:
                 job_config.direction = obj['direction']
             if 'trust_ssl' in obj and obj['trust_ssl'] in [True, False]:
                 job_config.trust_ssl = obj['trust_ssl']
+            if 'bandwidth' in obj:
+                job_config.bandwidth = JobConfig.normalize_bandwidth(obj['bandwidth'])
             if 'monitor' in obj and obj['monitor'] in [True, False]:
                 job_config.monitor = obj['monitor']
             if 'frequency' in obj and obj['frequency'] in ['auto', 'manual', 'time']:
@@ -34,6 +34,8 @@ from watchdog.events import FileSystemEventHandler
 from watchdog.utils.dirsnapshot import DirectorySnapshotDiff
 
 from pydio.utils.functions import hashfile, set_file_hidden, guess_filesystemencoding
+from pydio import LOCAL_CHANGE_SIGNAL
+from pydispatch import dispatcher
 
 import cProfile
 
@@ -309,6 +311,18 @@ class LocalDbHandler():
         conn.commit()
         conn.close()
 
+    def get_max_seq(self):
+        """
+        Sequence of the last change recorded by the watcher
+        :return: int, 0 if there is no change
+        """
+        conn = sqlite3.connect(self.db)
+        try:
+            row = conn.execute("SELECT MAX(seq) FROM ajxp_changes").fetchone()
+        finally:
+            conn.close()
+        return row[0] if row and row[0] is not None else 0
+
     def get_local_changes_as_stream(self, seq_id, flatten_and_store_callback):
         if self.event_handler:
             i = 1
@@ -455,7 +469,7 @@ class SqlEventHandler(FileSystemEventHandler):
         self.db = db_handler.db
         self.reading = False
         self.last_write_time = 0
-        self.db_wait_duration = 1
+        self.db_wait_duration = 0.5
         self.last_seq_id = 0
         self.prevent_atomic_commit = False
         self.con = None
@@ -536,7 +550,7 @@ class SqlEventHandler(FileSystemEventHandler):
         except Exception as ex:
             logging.exception(ex)
 
-        self.last_write_time = int(round(time.time() * 1000))
+        self.notify_change([source_key, target_key])
 
     def on_created(self, event):
         if not self.included(event):
@@ -552,7 +566,7 @@ class SqlEventHandler(FileSystemEventHandler):
             self.updateOrInsert(src_path, is_directory=event.is_directory, skip_nomodif=False)
         except Exception as ex:
             logging.exception(ex)
-        self.last_write_time = int(round(time.time() * 1000))
+        self.notify_change([self.remove_prefix(self.get_unicode_path(event.src_path))])
 
     def on_deleted(self, event):
         if not self.included(event):
@@ -574,7 +588,7 @@ class SqlEventHandler(FileSystemEventHandler):
 
         except Exception as ex:
             logging.exception(ex)
-        self.unlock_db()
+        self.unlock_db([self.remove_prefix(self.get_unicode_path(event.src_path))])
 
     def on_modified(self, event):
         super(SqlEventHandler, self).on_modified(event)
@@ -582,6 +596,7 @@ class SqlEventHandler(FileSystemEventHandler):
             logging.debug('ignoring modified event ' + event.src_path)
             return
         self.lock_db()
+        modified_filename = None
         try:
             src_path = self.get_unicode_path(event.src_path)
             if event.is_directory:
@@ -603,7 +618,7 @@ class SqlEventHandler(FileSystemEventHandler):
                 self.updateOrInsert(modified_filename, is_directory=False, skip_nomodif=True)
         except Exception as ex:
             logging.exception(ex)
-        self.unlock_db()
+        self.unlock_db([self.remove_prefix(modified_filename)] if modified_filename else None)
 
     def updateOrInsert(self, src_path, is_directory, skip_nomodif, force_insert = False):
         search_key = self.remove_prefix(src_path)
@@ -761,5 +776,14 @@ class SqlEventHandler(FileSystemEventHandler):
         self.last_write_time = int(round(time.time() * 1000))
         ###################################################################
 
-    def unlock_db(self):
-        self.last_write_time = int(round(time.time() * 1000))
\ No newline at end of file
+    def unlock_db(self, pathes=None):
+        self.notify_change(pathes)
+
+    def notify_change(self, pathes=None):
+        """
+        A change was written in the index: let the merger know that a sync cycle is needed (LOCAL_CHANGE_SIGNAL).
+        The pathes let it ignore the echoes of its own writes.
+        :param pathes: list() of the node pathes concerned, relative to the base folder, None if unknown
+        """
+        self.last_write_time = int(round(time.time() * 1000))
+        dispatcher.send(signal=LOCAL_CHANGE_SIGNAL, sender=self, pathes=pathes)
\ No newline at end of file
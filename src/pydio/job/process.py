@@ -0,0 +1,197 @@
+#
+# Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+# This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import logging
+import multiprocessing
+import threading
+import time
+
+from pydispatch import dispatcher
+from pydio import PUBLISH_SIGNAL
+
+# -*- coding: utf-8 -*-
+
+# Delay between two progress snapshots sent by a job process
+PROGRESS_SNAPSHOT_DELAY = 1.0
+# Commands of the parent process that a job process executes
+PROCESS_COMMANDS = ('start_now', 'pause', 'resume', 'stop', 'set_bandwidth')
+
+
+def run_job_process(conn, job_config, job_data_path, configs_path, data_path, rdiff_path):
+    """
+    Entry point of a job process: run a ContinuousDiffMerger and relay commands, status messages and progress
+    between it and the JobProcess proxy of the parent process.
+    :param conn: multiprocessing.Connection to the parent process
+    :param job_config: JobConfig
+    :param job_data_path: Filesystem path where the job data are stored
+    :param configs_path: ConfigManager configs path of the parent process
+    :param data_path: ConfigManager data path of the parent process
+    :param rdiff_path: rdiff executable path of the parent process
+    :return:
+    """
+    reset_logging_locks()
+    from pydio.utils.global_config import ConfigManager
+    ConfigManager.Instance(configs_path=configs_path, data_path=data_path).set_rdiff_path(rdiff_path)
+    from pydio.job.continous_merger import ContinuousDiffMerger
+    from pydio.job.resources import ResourceManager
+    from pydio.job.EventLogger import EventsBuffer
+
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def publish(sender, channel, message):
+        try:
+            send(('publish', channel, message))
+        except (IOError, EOFError):
+            pass
+
+    # This process only runs one job, its messages are all relayed (including the ones sent by the constructor)
+    dispatcher.connect(publish, signal=PUBLISH_SIGNAL, sender=dispatcher.Any, weak=False)
+    # Bandwidth limits of the job still apply; transfer slots and connections are shared by this job only
+    merger = ContinuousDiffMerger(job_config, job_data_path=job_data_path, resources=ResourceManager())
+    merger.start()
+    try:
+        while merger.is_alive():
+            if conn.poll(PROGRESS_SNAPSHOT_DELAY):
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    # Parent process is gone
+                    merger.stop()
+                    break
+                command, args = message[0], message[1:]
+                if command in PROCESS_COMMANDS:
+                    getattr(merger, command)(*args)
+            try:
+                send(('progress', {
+                    'running': merger.is_running(),
+                    'global': merger.get_global_progress(),
+                    'tasks': merger.get_current_tasks(),
+                    'resources': merger.get_resources_stats(),
+                }))
+            except RuntimeError:
+                # Progress changed while it was serialized, next snapshot will do
+                pass
+        merger.join()
+    finally:
+        # Multiprocessing children exit without running atexit handlers
+        EventsBuffer.flush_all()
+        try:
+            send(('exit',))
+        except (IOError, EOFError):
+            pass
+        conn.close()
+
+
+class JobProcess(threading.Thread):
+
+    def __init__(self, job_config, job_data_path):
+        """
+        Run a job in a child process instead of a thread: hashing, changes decoding and databases work of the job
+        then use another core, and do not slow down the other jobs and the web API. This thread stands for the job
+        in the scheduler, with the same interface as a ContinuousDiffMerger: commands are sent to the process,
+        status messages are published again here, and progress is read from the last snapshot received.
+
+        :param job_config: JobConfig
+        :param job_data_path: Filesystem path where the job data are stored
+        :return:
+        """
+        threading.Thread.__init__(self, name='JobProcess-' + str(job_config.id))
+        from pydio.utils.global_config import ConfigManager
+        config_manager = ConfigManager.Instance()
+        self.job_config = job_config
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=run_job_process, name='PydioJob-' + str(job_config.id),
+                                               args=(child_conn, job_config, job_data_path,
+                                                     config_manager.get_configs_path(),
+                                                     config_manager.get_data_path(),
+                                                     config_manager.get_rdiff_path()))
+        self.snapshot = {'running': True, 'global': {}, 'tasks': {'total': 0, 'current': []}, 'resources': None}
+        self._send_lock = threading.Lock()
+
+    def start(self):
+        self.process.start()
+        threading.Thread.start(self)
+
+    def run(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, IOError):
+                break
+            if message[0] == 'progress':
+                self.snapshot = message[1]
+            elif message[0] == 'publish':
+                dispatcher.send(signal=PUBLISH_SIGNAL, sender=self, channel=message[1], message=message[2])
+            elif message[0] == 'exit':
+                break
+        self.process.join()
+        self.snapshot['running'] = False
+        logging.info('Process of job %s exited with code %s' % (self.job_config.id, self.process.exitcode))
+
+    def send(self, *message):
+        with self._send_lock:
+            try:
+                self.conn.send(message)
+            except (IOError, EOFError):
+                logging.debug('Process of job %s is not running' % self.job_config.id)
+
+    def start_now(self):
+        self.send('start_now')
+
+    def pause(self):
+        self.snapshot['running'] = False
+        self.send('pause')
+
+    def resume(self):
+        self.send('resume')
+
+    def stop(self):
+        self.send('stop')
+
+    def set_bandwidth(self, bandwidth):
+        self.send('set_bandwidth', bandwidth)
+
+    def is_running(self):
+        return self.snapshot['running']
+
+    def get_global_progress(self):
+        return self.snapshot['global']
+
+    def get_current_tasks(self):
+        return self.snapshot['tasks']
+
+    def get_resources_stats(self):
+        return self.snapshot['resources']
+
+
+def reset_logging_locks():
+    """
+    A forked process only gets a copy of the forking thread: logging locks held by other threads at that time
+    would never be released. Create them again in the child.
+    :return:
+    """
+    logging._lock = threading.RLock()
+    for handler_ref in logging._handlerList:
+        handler = handler_ref()
+        if handler:
+            handler.createLock()
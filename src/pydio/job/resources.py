@@ -0,0 +1,252 @@
+#
+# Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+# This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import collections
+import threading
+import time
+from contextlib import contextmanager
+from urlparse import urlparse
+
+from pydio.sdk.exceptions import InterruptException
+from pydio.sdk.utils import TokenBucket, build_pooled_session
+
+# -*- coding: utf-8 -*-
+
+MAX_CONCURRENT_TRANSFERS = 4
+RATE_WINDOW = 5
+# Delay between two evaluations of the time-of-day bandwidth schedule of a job
+LIMITS_CHECK_DELAY = 30
+# Delay between two checks of the interruption of a job waiting for a transfer slot
+SLOT_WAIT_CHECK_DELAY = 0.5
+
+
+class ResourceManager(object):
+
+    def __init__(self, max_transfers=MAX_CONCURRENT_TRANSFERS, global_up=0, global_down=0):
+        """
+        Resources shared by all the jobs run by the scheduler: keep-alive HTTP sessions (one per server), a bounded
+        number of concurrent file transfers and a global bandwidth budget. Transfer slots are handed out round-robin
+        between the jobs waiting for one, so a job with a long queue of files cannot starve the others.
+
+        :param max_transfers: int max number of files transferred at the same time, all jobs included
+        :param global_up: int upload bytes per second for all the jobs, 0 for no limit
+        :param global_down: int download bytes per second for all the jobs, 0 for no limit
+        :return:
+        """
+        self.max_transfers = max_transfers
+        self.buckets = {'up': TokenBucket(global_up), 'down': TokenBucket(global_down)}
+        self.sessions = {}
+        self.jobs = {}
+        self.active_transfers = 0
+        self._waiting = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._lock = threading.Lock()
+
+    def get_session(self, url):
+        """
+        Requests session shared by the jobs connected to the same server
+        :param url: str server url
+        :return: requests.Session
+        """
+        parsed = urlparse(url)
+        key = parsed.scheme + '://' + parsed.netloc
+        with self._lock:
+            if key not in self.sessions:
+                self.sessions[key] = build_pooled_session()
+            return self.sessions[key]
+
+    def register_job(self, job_id, limits=None):
+        """
+        :param job_id: str
+        :param limits: callable returning the current limits of this job, {'up': bytes/s, 'down': bytes/s}
+        :return: JobResources
+        """
+        with self._lock:
+            if job_id not in self.jobs:
+                self.jobs[job_id] = JobResources(self, job_id)
+            job = self.jobs[job_id]
+        job.set_limits(limits)
+        return job
+
+    def unregister_job(self, job_id):
+        with self._lock:
+            self.jobs.pop(job_id, None)
+
+    def set_global_rates(self, up=0, down=0):
+        self.buckets['up'].set_rate(up)
+        self.buckets['down'].set_rate(down)
+
+    def acquire_transfer(self, job_id, interrupted=None):
+        """
+        Wait for a free transfer slot. When a slot is released it goes to the job that follows, in the waiting
+        order, the last job served.
+        :param job_id: str
+        :param interrupted: callable returning True when the job is stopped or paused, checked while waiting
+        :return: float seconds waited
+        """
+        start = time.time()
+        ticket = object()
+        with self._condition:
+            self._waiting.setdefault(job_id, collections.deque()).append(ticket)
+            while self.active_transfers >= self.max_transfers or self._next_ticket() is not ticket:
+                if interrupted and interrupted():
+                    self._cancel_ticket(job_id, ticket)
+                    raise InterruptException()
+                self._condition.wait(SLOT_WAIT_CHECK_DELAY)
+            tickets = self._waiting.pop(job_id)
+            tickets.popleft()
+            if tickets:
+                # Job goes back to the end of the line
+                self._waiting[job_id] = tickets
+            self.active_transfers += 1
+            self._condition.notify_all()
+        return time.time() - start
+
+    def _next_ticket(self):
+        for tickets in self._waiting.itervalues():
+            return tickets[0]
+        return None
+
+    def _cancel_ticket(self, job_id, ticket):
+        tickets = self._waiting[job_id]
+        tickets.remove(ticket)
+        if not tickets:
+            del self._waiting[job_id]
+        # The next ticket may now be served
+        self._condition.notify_all()
+
+    def release_transfer(self):
+        with self._condition:
+            self.active_transfers -= 1
+            self._condition.notify_all()
+
+    def get_job_stats(self, job_id):
+        job = self.jobs.get(job_id)
+        if not job:
+            return None
+        return job.get_stats()
+
+
+class JobResources(object):
+
+    def __init__(self, manager, job_id):
+        """
+        Share of the ResourceManager resources given to a job, and the throughput measured for this job.
+        Set as PydioSdk.resources, it receives the size of every block of data transferred.
+        :param manager: ResourceManager
+        :param job_id: str
+        :return:
+        """
+        self.manager = manager
+        self.job_id = job_id
+        self.buckets = {'up': TokenBucket(), 'down': TokenBucket()}
+        self.limits = None
+        self.limits_time = 0
+        self.bytes = {'up': 0, 'down': 0}
+        self.window = {'up': collections.deque(), 'down': collections.deque()}
+        self.transfers = 0
+        self.wait_time = 0
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes, direction, interrupted=None):
+        """
+        Account for a block of transferred data, waiting if the job or global budget is exceeded
+        :param nbytes: int
+        :param direction: 'up' or 'down'
+        :param interrupted: callable returning True when the waiting must be aborted (InterruptException is raised)
+        :return:
+        """
+        now = time.time()
+        if self.limits and now - self.limits_time > LIMITS_CHECK_DELAY:
+            self.apply_limits()
+        waited = self.buckets[direction].consume(nbytes, interrupted=interrupted)
+        waited += self.manager.buckets[direction].consume(nbytes, interrupted=interrupted)
+        now = time.time()
+        with self._lock:
+            self.bytes[direction] += nbytes
+            self.wait_time += waited
+            window = self.window[direction]
+            window.append((now, nbytes))
+            while window and window[0][0] < now - RATE_WINDOW:
+                window.popleft()
+
+    def set_limits(self, limits):
+        """
+        :param limits: callable returning {'up': bytes/s, 'down': bytes/s}, evaluated again every
+        LIMITS_CHECK_DELAY seconds during transfers so that time-of-day schedules apply to long transfers. None
+        for no limit.
+        :return:
+        """
+        self.limits = limits
+        self.apply_limits()
+
+    def apply_limits(self):
+        self.limits_time = time.time()
+        limits = self.limits() if self.limits else {}
+        for direction in ('up', 'down'):
+            rate = limits.get(direction, 0)
+            if rate != self.buckets[direction].rate:
+                self.buckets[direction].set_rate(rate)
+
+    @contextmanager
+    def transfer_slot(self, interrupted=None):
+        """
+        Hold one of the manager transfer slots
+        :param interrupted: callable returning True when the waiting must be aborted (InterruptException is raised)
+        """
+        waited = self.manager.acquire_transfer(self.job_id, interrupted=interrupted)
+        with self._lock:
+            self.wait_time += waited
+        try:
+            yield
+        finally:
+            self.manager.release_transfer()
+            with self._lock:
+                self.transfers += 1
+
+    def rate(self, direction):
+        """
+        Bytes per second actually transferred in the last RATE_WINDOW seconds
+        :param direction: 'up' or 'down'
+        :return: int
+        """
+        now = time.time()
+        with self._lock:
+            samples = [(t, n) for t, n in self.window[direction] if t >= now - RATE_WINDOW]
+        if not samples:
+            return 0
+        # Bytes received after the first block, over the time elapsed since it: a transfer that started less than
+        # RATE_WINDOW ago is measured over its own duration
+        span = now - samples[0][0]
+        if len(samples) == 1 or span < 1.0:
+            return int(sum(n for t, n in samples) / max(span, 1.0))
+        return int(sum(n for t, n in samples[1:]) / span)
+
+    def get_stats(self):
+        stats = {
+            'bytes_up': self.bytes['up'],
+            'bytes_down': self.bytes['down'],
+            'rate_up': self.rate('up'),
+            'rate_down': self.rate('down'),
+            'transfers': self.transfers,
+            'wait_time': round(self.wait_time, 2),
+            'limit_up': self.buckets['up'].rate,
+            'limit_down': self.buckets['down'].rate,
+        }
+        return stats
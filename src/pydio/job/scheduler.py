@@ -22,18 +22,27 @@ import logging, sys
 from pydispatch import dispatcher
 
 from pydio.job.continous_merger import ContinuousDiffMerger
+from pydio.job.job_config import JobConfig
+from pydio.job.resources import ResourceManager
+from pydio.job.process import JobProcess
 from pydio import COMMAND_SIGNAL, JOB_COMMAND_SIGNAL
 from pydio.utils.functions import Singleton, guess_filesystemencoding
+from pydio.utils.global_config import ConfigManager
 from pydio.job import manager
 
 
 @Singleton
 class PydioScheduler():
-    def __init__(self, jobs_root_path, jobs_loader):
+    def __init__(self, jobs_root_path, jobs_loader, process_isolation=False):
         self.control_threads = {}
+        # Run each job in its own process instead of a thread
+        self.process_isolation = process_isolation
         self.jobs_loader = jobs_loader
         self.job_configs = jobs_loader.get_jobs()
         self.jobs_root_path = jobs_root_path
+        # Transfer slots, bandwidth and server connections shared by all the jobs
+        bandwidth = ConfigManager.Instance().get_global_bandwidth()
+        self.resources = ResourceManager(global_up=bandwidth['up'] * 1024, global_down=bandwidth['down'] * 1024)
         dispatcher.connect(self.handle_job_signal, signal=JOB_COMMAND_SIGNAL, sender=dispatcher.Any)
         dispatcher.connect(self.handle_generic_signal, signal=COMMAND_SIGNAL, sender=dispatcher.Any)
 
@@ -66,7 +75,10 @@ class PydioScheduler():
             job_data_path.mkdir(parents=True)
         job_data_path = str(job_data_path).decode(guess_filesystemencoding())
 
-        merger = ContinuousDiffMerger(job_config, job_data_path=job_data_path)
+        if self.process_isolation:
+            merger = JobProcess(job_config, job_data_path=job_data_path)
+        else:
+            merger = ContinuousDiffMerger(job_config, job_data_path=job_data_path, resources=self.resources)
         try:
             merger.start()
             self.control_threads[job_config.id] = merger
@@ -83,7 +95,8 @@ class PydioScheduler():
         thread = self.get_thread(job_id)
         if not thread:
             return False
-        return {"global": thread.get_global_progress(), "tasks": thread.get_current_tasks()}
+        return {"global": thread.get_global_progress(), "tasks": thread.get_current_tasks(),
+                "resources": thread.get_resources_stats()}
 
     def pause_job(self, job_id):
         thread = self.get_thread(job_id)
@@ -105,6 +118,42 @@ class PydioScheduler():
             return
         thread.stop()
         self.control_threads.pop(job_id, None)
+        self.resources.unregister_job(job_id)
+
+    def set_job_bandwidth(self, job_id, up=None, down=None):
+        """
+        Change the transfer rate limits of a job, running transfers included, and save them in its config
+        :param job_id: str
+        :param up: int KB/s, 0 for no limit, None to keep the current value
+        :param down: int KB/s, 0 for no limit, None to keep the current value
+        :return: dict current limits in bytes per second
+        """
+        job_config = self.get_config(job_id)
+        if not job_config:
+            return False
+        if up is not None:
+            job_config.bandwidth['up'] = up
+        if down is not None:
+            job_config.bandwidth['down'] = down
+        job_config.bandwidth = JobConfig.normalize_bandwidth(job_config.bandwidth)
+        self.jobs_loader.update_job(job_config)
+        thread = self.get_thread(job_id)
+        if thread:
+            thread.set_bandwidth(job_config.bandwidth)
+        return job_config.get_bandwidth_limits()
+
+    def set_global_bandwidth(self, up=None, down=None):
+        """
+        Change the transfer rate limits shared by all the jobs run in this process, running transfers included, and
+        save them in the global config
+        :param up: int KB/s, 0 for no limit, None to keep the current value
+        :param down: int KB/s, 0 for no limit, None to keep the current value
+        :return: dict current limits in bytes per second
+        """
+        bandwidth = ConfigManager.Instance().set_global_bandwidth(up=up, down=down)
+        limits = dict((direction, bandwidth[direction] * 1024) for direction in ('up', 'down'))
+        self.resources.set_global_rates(up=limits['up'], down=limits['down'])
+        return limits
 
     def handle_job_signal(self, sender, command, job_id):
         if command == 'start' or command == 'resume':
@@ -0,0 +1,133 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import contextmanager
+
+import mock
+
+from pydio.job.change_processor import ChangeProcessor
+
+# -*- coding: utf-8 -*-
+
+
+class ProcessDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        with open(os.path.join(self.tmp, 'file'), 'wb') as fd:
+            fd.write('basis')
+        job_config = mock.Mock(directory=self.tmp)
+        self.local_sdk = mock.Mock()
+        self.local_sdk.use_builtin_delta.return_value = True
+        self.remote_sdk = mock.Mock(resources=None)
+        self.local_sdk.rsync_signature_stream.side_effect = lambda full_path, sig_fd: sig_fd.write('signature')
+        self.delta_stream = mock.Mock()
+        self.delta_closed = []
+        self.posted_signatures = []
+
+        @contextmanager
+        def rsync_delta_stream(path, signature):
+            signature.seek(0)
+            self.posted_signatures.append(signature.read())
+            try:
+                yield self.delta_stream
+            finally:
+                self.delta_closed.append(path)
+        self.remote_sdk.rsync_delta_stream = rsync_delta_stream
+        self.processor = ChangeProcessor({}, mock.Mock(), job_config, self.local_sdk, self.remote_sdk, mock.Mock(),
+                                         mock.Mock())
+        self.processor.choose_delta_transfer = lambda path, full_path, size, direction: {'strategy': 'delta'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_delta_response_is_closed(self):
+        self.processor.process_download('/file', is_mod=True)
+        self.local_sdk.rsync_patch_stream.assert_called_once_with(os.path.join(self.tmp, 'file'), self.delta_stream)
+        self.assertEqual(['/file'], self.delta_closed)
+        self.assertFalse(self.remote_sdk.download.called)
+
+    def test_delta_response_is_closed_when_patch_fails(self):
+        self.local_sdk.rsync_patch_stream.side_effect = IOError('connection reset')
+        self.processor.process_download('/file', is_mod=True)
+        self.assertEqual(['/file'], self.delta_closed)
+        self.assertTrue(self.remote_sdk.download.called)
+
+    def test_signature_is_posted_from_memory(self):
+        self.processor.process_download('/file', is_mod=True)
+        self.assertEqual(['signature'], self.posted_signatures)
+        self.assertEqual(['file'], os.listdir(self.tmp))
+
+    def test_no_temporary_file_left_when_fallback_fails(self):
+        self.local_sdk.use_builtin_delta.return_value = False
+        self.local_sdk.rsync_patch.side_effect = IOError('corrupted delta')
+        self.remote_sdk.download.side_effect = IOError('connection reset')
+        temporaries = []
+        self.local_sdk.rsync_signature.side_effect = lambda full_path, sig_path: temporaries.append(sig_path)
+        self.assertRaises(IOError, self.processor.process_download, '/file', is_mod=True)
+        self.assertEqual(['file'], os.listdir(self.tmp))
+        self.assertEqual(1, len(temporaries))
+        self.assertNotEqual(self.tmp, os.path.dirname(temporaries[0]))
+        self.assertFalse(os.path.exists(temporaries[0]))
+
+
+class ProcessUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        with open(os.path.join(self.tmp, 'file'), 'wb') as fd:
+            fd.write('new content')
+        job_config = mock.Mock(directory=self.tmp, server_configs=None)
+        self.local_sdk = mock.Mock()
+        self.local_sdk.use_builtin_delta.return_value = True
+        self.local_sdk.rsync_delta_from_signature.side_effect = \
+            lambda full_path, signature, delta_fd: delta_fd.write('delta')
+        self.remote_sdk = mock.Mock(resources=None)
+        self.posted_deltas = []
+
+        def rsync_patch(path, delta):
+            delta.seek(0)
+            self.posted_deltas.append(delta.read())
+        self.remote_sdk.rsync_patch.side_effect = rsync_patch
+        self.processor = ChangeProcessor({}, mock.Mock(), job_config, self.local_sdk, self.remote_sdk, mock.Mock(),
+                                         mock.Mock())
+        self.processor.choose_delta_transfer = lambda path, full_path, size, direction: {'strategy': 'delta'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_delta_is_posted_from_memory(self):
+        self.processor.process_upload('/file', is_mod=True)
+        self.assertEqual(['delta'], self.posted_deltas)
+        self.assertEqual(['file'], os.listdir(self.tmp))
+        self.assertFalse(self.remote_sdk.upload.called)
+
+    def test_full_upload_when_patch_fails(self):
+        self.remote_sdk.rsync_patch.side_effect = IOError('connection reset')
+        self.processor.process_upload('/file', is_mod=True)
+        self.assertTrue(self.remote_sdk.upload.called)
+        self.assertEqual(['file'], os.listdir(self.tmp))
+
+
+if __name__ == '__main__':
+    unittest.main()
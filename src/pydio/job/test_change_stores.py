@@ -0,0 +1,245 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from pydio.job.change_stores import SqliteChangeStore, ChangeGroupsStatsLoader
+
+# -*- coding: utf-8 -*-
+
+
+class ChangeStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = SqliteChangeStore(os.path.join(self.tmp, 'changes.sqlite'), ['*'], [])
+        self.store.open()
+        self.seq = 0
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp)
+
+    def add(self, location, change_type, source='NULL', target='NULL', md5='md5', bytesize=10):
+        self.seq += 1
+        node_path = target if target != 'NULL' else source
+        self.store.store(location, self.seq, {'type': change_type, 'source': source, 'target': target,
+                                              'node': {'md5': md5, 'bytesize': bytesize, 'node_path': node_path}})
+        self.store.flush_inserts()
+
+    def groups(self):
+        return [[(c['type'], c['source'], c['target']) for c in group]
+                for group in self.store.get_change_groups(batch_size=1)]
+
+
+class ChangeGroupsTest(ChangeStoreTestCase):
+
+    def test_folder_move_and_change_inside_share_a_group(self):
+        self.add('remote', 'content', target='/other')
+        self.add('local', 'path', '/folder', '/moved', md5='directory')
+        self.add('remote', 'content', target='/folder/sub/file')
+        self.add('local', 'delete', source='/moved/file2')
+        groups = self.groups()
+        self.assertEqual(2, len(groups))
+        self.assertEqual([('content', 'NULL', '/other')], groups[0])
+        self.assertEqual([('path', '/folder', '/moved'), ('content', 'NULL', '/folder/sub/file'),
+                          ('delete', '/moved/file2', 'NULL')], groups[1])
+
+    def test_independent_changes_are_separated_and_batched(self):
+        for i in range(5):
+            self.add('remote', 'content', target='/file%i' % i)
+        self.assertEqual(5, len(self.groups()))
+        self.assertEqual([5], [len(g) for g in self.store.get_change_groups(batch_size=400)])
+        self.assertEqual([2, 2, 1], [len(g) for g in self.store.get_change_groups(batch_size=2)])
+
+    def test_root_level_change_collapses_everything(self):
+        self.add('remote', 'content', target='/a')
+        self.add('local', 'create', target='/folder', md5='directory')
+        self.add('remote', 'content', target='/')
+        self.add('local', 'delete', source='/b')
+        groups = self.groups()
+        self.assertEqual(1, len(groups))
+        self.assertEqual(4, len(groups[0]))
+
+    def test_folder_creates_come_first(self):
+        self.add('remote', 'content', target='/a')
+        self.add('local', 'create', target='/new', md5='directory')
+        self.add('local', 'create', target='/new/sub', md5='directory')
+        self.add('remote', 'path', '/old', '/renamed', md5='directory')
+        self.add('local', 'create', target='/renamed/child', md5='directory')
+        groups = self.groups()
+        self.assertEqual([('create', 'NULL', '/new'), ('create', 'NULL', '/new/sub')], groups[0])
+        self.assertEqual([('content', 'NULL', '/a')], groups[1])
+        # The create inside a changed folder must wait for the move
+        self.assertEqual([('path', '/old', '/renamed'), ('create', 'NULL', '/renamed/child')], groups[2])
+
+    def test_conflicting_changes_share_a_group(self):
+        self.add('local', 'content', target='/doc', md5='local-md5')
+        self.add('remote', 'content', target='/unrelated')
+        self.add('remote', 'content', target='/doc', md5='remote-md5')
+        groups = self.store.get_change_groups(batch_size=1)
+        doc_group = [g for g in groups if any(c['target'] == '/doc' for c in g)]
+        self.assertEqual(1, len(doc_group))
+        self.assertEqual(['local', 'remote'], sorted(c['location'] for c in doc_group[0]))
+
+        status_handler = mock.Mock()
+        self.store.select_group(doc_group[0])
+        self.assertEqual(1, self.store.detect_conflicts(status_handler, in_group=True))
+        self.assertEqual('/doc', status_handler.update_node_status.call_args[0][0])
+        self.assertEqual('CONFLICT', status_handler.update_node_status.call_args[0][1])
+
+        other_group = [g for g in groups if g is not doc_group[0]][0]
+        self.store.select_group(other_group)
+        self.assertEqual(0, self.store.detect_conflicts(mock.Mock(), in_group=True))
+
+
+class StatPathesAndFilterTest(ChangeStoreTestCase):
+
+    def test_stat_pathes(self):
+        self.add('local', 'content', target='/up')
+        self.add('local', 'delete', source='/local-deleted')
+        self.add('remote', 'path', '/from', '/to')
+        self.add('remote', 'delete', source='/remote-deleted')
+        local, remote = SqliteChangeStore.stat_pathes(self.store.get_change_groups()[0])
+        self.assertEqual({'/local-deleted': False, '/from': False, '/to': True, '/remote-deleted': False}, local)
+        self.assertEqual(['/local-deleted', '/remote-deleted', '/up'], sorted(remote))
+
+    def test_filter_group_removes_unnecessary_changes(self):
+        self.add('remote', 'content', target='/same', md5='abc', bytesize=3)
+        self.add('remote', 'content', target='/different', md5='abc', bytesize=3)
+        self.add('remote', 'delete', source='/already-deleted')
+        group = self.store.get_change_groups()[0]
+        local_stats = {'/same': {'size': 3, 'hash': 'abc'}, '/different': {'size': 4, 'hash': 'def'},
+                       '/already-deleted': False}
+        kept = self.store.filter_group(group, mock.Mock(), mock.Mock(), local_stats, {})
+        self.assertEqual(['/different'], [c['target'] for c in kept])
+        self.assertEqual(1, self.store.count_changes()[0]['remote']['content'])
+
+
+class ChangeGroupsStatsLoaderTest(unittest.TestCase):
+
+    def test_groups_are_given_with_their_stats(self):
+        groups = [[{'location': 'remote', 'type': 'content', 'source': 'NULL', 'target': '/a'}],
+                  [{'location': 'local', 'type': 'content', 'source': 'NULL', 'target': '/b'}]]
+        local_sdk = mock.Mock()
+        local_sdk.stat.side_effect = lambda path, with_hash=False: {'size': 1, 'path': path}
+        remote_sdk = mock.Mock()
+        remote_sdk.bulk_stat.side_effect = lambda pathes, with_hash=False: dict((p, {'size': 2}) for p in pathes)
+        loader = ChangeGroupsStatsLoader(groups, local_sdk, remote_sdk)
+        loader.start()
+        result = list(loader)
+        self.assertEqual(groups, [group for (group, stats) in result])
+        self.assertEqual(({'/a': {'size': 1, 'path': '/a'}}, {}), result[0][1])
+        self.assertEqual(({}, {'/b': {'size': 2}}), result[1][1])
+
+    def test_without_stats(self):
+        groups = [['change']]
+        loader = ChangeGroupsStatsLoader(groups, None, None, with_stats=False)
+        loader.start()
+        self.assertEqual([(['change'], None)], list(loader))
+
+    def test_load_error_is_raised_in_consumer(self):
+        groups = [['first'], ['second'], ['third']]
+        loader = ChangeGroupsStatsLoader(groups, None, None)
+
+        def load_stats(group):
+            if group == ['second']:
+                raise IOError('stat failed')
+            return {}, {}
+        loader.load_stats = load_stats
+        loader.start()
+        received = []
+        with self.assertRaises(IOError):
+            for group, stats in loader:
+                received.append(group)
+        self.assertEqual([['first']], received)
+        loader.stop()
+        loader.join(5)
+        self.assertFalse(loader.is_alive())
+
+
+class MinSeqTrackingTest(ChangeStoreTestCase):
+
+    def untracked_min_seqs(self):
+        return [self.store.conn.execute('SELECT min(seq_id) FROM ajxp_changes WHERE location=?', (location,))
+                .fetchone()[0] or -1 for location in ('local', 'remote')]
+
+    def tracked_min_seqs(self):
+        return [self.store.get_min_seq(location, success=True) for location in ('local', 'remote')]
+
+    def test_tracking_follows_processed_changes(self):
+        for i in range(10):
+            self.add('remote' if i % 2 else 'local', 'content', target='/file%i' % i)
+        self.store.start_seqs_tracking()
+        self.assertEqual([1, 2], self.tracked_min_seqs())
+        self.assertEqual(0, self.store.get_min_seq('local'))
+
+        processed = []
+
+        def callback(change):
+            processed.append(change['target'])
+            if change['target'] in ('/file3', '/file6'):
+                return False
+            self.assertEqual(self.untracked_min_seqs(), self.tracked_min_seqs())
+            return True
+        self.store.process_changes_with_callback(callback)
+        self.assertEqual(['/file%i' % i for i in range(10)], processed)
+        self.assertEqual([7, 4], self.tracked_min_seqs())
+        self.assertEqual(self.untracked_min_seqs(), self.tracked_min_seqs())
+        self.assertEqual(6, self.store.get_min_seq('local'))
+
+    def test_empty_location(self):
+        self.add('local', 'content', target='/file')
+        self.store.start_seqs_tracking()
+        self.assertEqual(-1, self.store.get_min_seq('remote'))
+        self.store.process_changes_with_callback(lambda change: True)
+        self.assertEqual(-1, self.store.get_min_seq('local', success=True))
+
+    def test_unknown_deletions_only_lower_the_min(self):
+        for i in range(3):
+            self.add('local', 'content', target='/file%i' % i)
+        self.store.start_seqs_tracking()
+        self.store.conn.execute('DELETE FROM ajxp_changes WHERE seq_id=1')
+        self.assertEqual(1, self.store.get_min_seq('local', success=True))
+        self.store.forget_rows([1])
+        self.assertEqual(2, self.store.get_min_seq('local', success=True))
+
+    def test_filtered_rows_are_forgotten(self):
+        self.add('remote', 'content', target='/same', md5='abc', bytesize=3)
+        self.add('remote', 'content', target='/different', md5='abc', bytesize=3)
+        self.store.start_seqs_tracking()
+        local_stats = {'/same': {'size': 3, 'hash': 'abc'}, '/different': {'size': 4, 'hash': 'def'}}
+        self.store.filter_group(self.store.get_change_groups()[0], mock.Mock(), mock.Mock(), local_stats, {})
+        self.assertEqual(2, self.store.get_min_seq('remote', success=True))
+
+    def test_stop_tracking_queries_the_db(self):
+        self.add('local', 'content', target='/file')
+        self.store.start_seqs_tracking()
+        self.store.conn.execute('DELETE FROM ajxp_changes')
+        self.store.stop_seqs_tracking()
+        self.assertEqual(-1, self.store.get_min_seq('local'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+from pydio.utils.global_config import ConfigManager
+
+# -*- coding: utf-8 -*-
+
+
+CONFIGS_PATH = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(CONFIGS_PATH)
+
+
+def build_merger(tmp):
+    """
+    Merger of a job whose server is never contacted
+    """
+    from pydio.job.continous_merger import ContinuousDiffMerger
+    from pydio.job.job_config import JobConfig
+    ConfigManager.Instance(configs_path=CONFIGS_PATH, data_path=CONFIGS_PATH)
+    job_config = JobConfig()
+    job_config.server = 'http://127.0.0.1:1'
+    job_config.workspace = 'ws'
+    job_config.directory = os.path.join(tmp, 'local')
+    job_config.id = 'test'
+    os.makedirs(job_config.directory)
+    os.makedirs(os.path.join(tmp, 'data'))
+    with mock.patch('keyring.get_password', return_value=None):
+        return ContinuousDiffMerger(job_config, os.path.join(tmp, 'data'))
+
+
+class MergerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.merger = build_merger(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+class LocalEchoTest(MergerTestCase):
+
+    def setUp(self):
+        super(LocalEchoTest, self).setUp()
+        self.triggers = []
+        self.merger.trigger_sync = lambda: self.triggers.append(1)
+
+    def test_own_writes_do_not_trigger(self):
+        self.merger.expect_local_echo({'location': 'remote', 'type': 'content', 'source': 'NULL',
+                                       'target': '/folder/file'})
+        self.merger.handle_local_change_event(None, pathes=['/folder/file'])
+        self.assertEqual([], self.triggers)
+
+    def test_moves_and_children_of_written_folders_are_echoes(self):
+        self.merger.expect_local_echo({'location': 'remote', 'type': 'path', 'source': '/a', 'target': '/b'})
+        self.merger.handle_local_change_event(None, pathes=['/a', '/b'])
+        self.merger.handle_local_change_event(None, pathes=['/b/child/file'])
+        self.assertEqual([], self.triggers)
+
+    def test_user_changes_trigger(self):
+        self.merger.expect_local_echo({'location': 'remote', 'type': 'content', 'source': 'NULL', 'target': '/f'})
+        self.merger.handle_local_change_event(None, pathes=['/f', '/other'])
+        self.merger.handle_local_change_event(None, pathes=['/fa'])
+        self.merger.handle_local_change_event(None)
+        self.assertEqual(3, len(self.triggers))
+
+    def test_uploads_are_not_echoes(self):
+        self.merger.expect_local_echo({'location': 'local', 'type': 'content', 'source': 'NULL', 'target': '/f'})
+        self.merger.handle_local_change_event(None, pathes=['/f'])
+        self.assertEqual(1, len(self.triggers))
+
+    def test_echoes_expire(self):
+        self.merger.local_echo_delay = 0.01
+        self.merger.expect_local_echo({'location': 'remote', 'type': 'delete', 'source': '/f', 'target': 'NULL'})
+        time.sleep(0.02)
+        self.merger.handle_local_change_event(None, pathes=['/f'])
+        self.assertEqual(1, len(self.triggers))
+
+
+class QueueProgressTest(MergerTestCase):
+
+    def setUp(self):
+        super(QueueProgressTest, self).setUp()
+        from pydio.job.change_stores import SqliteChangeStore
+        self.store = SqliteChangeStore(os.path.join(self.tmp, 'changes.sqlite'), ['*'], [])
+        self.store.open()
+        self.merger.current_store = self.store
+        self.seq = 0
+
+    def tearDown(self):
+        self.store.close()
+        super(QueueProgressTest, self).tearDown()
+
+    def add(self, location, change_type, target, md5='md5', bytesize=10):
+        self.seq += 1
+        self.store.store(location, self.seq, {'type': change_type, 'source': 'NULL', 'target': target,
+                                              'node': {'md5': md5, 'bytesize': bytesize, 'node_path': target}})
+        self.store.flush_inserts()
+
+    def test_count_changes(self):
+        self.add('remote', 'content', '/a', bytesize=100)
+        self.add('remote', 'content', '/b', bytesize=50)
+        self.add('local', 'create', '/folder', md5='directory', bytesize=0)
+        self.assertEqual(({'remote': {'content': 2}, 'local': {'create': 1}}, 150.0), self.store.count_changes())
+
+    def test_processed_and_filtered_changes(self):
+        self.add('remote', 'content', '/a', bytesize=100)
+        self.add('remote', 'content', '/b', bytesize=50)
+        self.add('local', 'create', '/folder', md5='directory', bytesize=0)
+        self.merger.init_queue_progress()
+        progress = self.merger.global_progress
+        self.assertEqual((3, 150), (progress['queue_length'], progress['queue_bytesize']))
+
+        changes = dict((change['target'], change) for change in self.store.list_changes(0, 10))
+        # Part of /a was already reported by its transfer
+        self.merger.processing_signals['/a'] = {'total_bytes_sent': 40}
+        self.merger.global_progress['bytes_done'] = 40
+        self.merger.global_progress['queue_bytesize'] -= 40
+        self.merger.update_queue_progress(changes['/a'])
+        self.assertEqual((100, 50), (progress['bytes_done'], progress['queue_bytesize']))
+        self.assertNotIn('/a', self.merger.processing_signals)
+
+        self.merger.update_queue_progress(changes['/b'], processed=False)
+        self.assertEqual((2, 100, 0), (progress['queue_length'], progress['bytes_done'], progress['queue_bytesize']))
+        self.merger.update_queue_progress({'type': 'bulk_mkdirs', 'location': 'local', 'pathes': ['/folder']})
+        self.assertEqual({'remote': {'content': 0}, 'local': {'create': 0}}, progress['queue_counts'])
+
+    def test_current_tasks_come_from_the_processed_group(self):
+        for i in range(8):
+            self.add('remote', 'content', '/file%i' % i)
+        self.add('local', 'create', '/folder', md5='directory', bytesize=0)
+        self.merger.init_queue_progress()
+        self.store.list_changes = mock.Mock(side_effect=AssertionError('current tasks read from the store'))
+        snapshots = []
+
+        def callback(change):
+            self.merger.update_current_tasks(change)
+            snapshots.append([task['target'] for task in self.merger.get_current_tasks()['current']])
+            self.merger.update_queue_progress(change)
+            return True
+        self.merger.process_changes_pipelined(callback, filter_changes=False)
+        # Folders are created first, in bulk
+        self.assertEqual(['/folder'], snapshots[0])
+        self.assertEqual(['/file0', '/file1', '/file2', '/file3', '/file4'], snapshots[1])
+        self.assertEqual(['/file1', '/file2', '/file3', '/file4', '/file5'], snapshots[2])
+        self.assertEqual(['/file7'], snapshots[-1])
+        self.assertEqual(9, len(snapshots))
+        self.assertEqual([], self.merger.get_current_tasks()['current'])
+
+
+class PrefetchRemoteMetadataTest(MergerTestCase):
+
+    def setUp(self):
+        super(PrefetchRemoteMetadataTest, self).setUp()
+        from pydio.sdk.parallel import AsyncPydioSdk
+        from pydio.sdk.test_parallel import FakeSdk
+        self.sdk = FakeSdk()
+        self.merger.async_sdk = AsyncPydioSdk(self.sdk)
+
+    def tearDown(self):
+        self.merger.async_sdk.shutdown()
+        super(PrefetchRemoteMetadataTest, self).tearDown()
+
+    @staticmethod
+    def change(location, change_type, source='NULL', target='NULL', md5='md5', bytesize=10):
+        node_path = target if target != 'NULL' else source
+        return {'location': location, 'type': change_type, 'source': source, 'target': target, 'md5': md5,
+                'bytesize': bytesize, 'node': {'md5': md5, 'bytesize': bytesize, 'node_path': node_path}}
+
+    def test_independent_changes_are_prefetched(self):
+        group = [
+            self.change('local', 'delete', source='/del'),
+            self.change('local', 'delete', source='/folder/x'),
+            self.change('local', 'path', '/folder', '/renamed', md5='directory'),
+            self.change('local', 'create', target='/empty', bytesize=0),
+            self.change('local', 'create', target='/big'),
+            self.change('local', 'create', target='/dir', md5='directory', bytesize=0),
+            self.change('local', 'path', '/m1', '/m2'),
+            self.change('local', 'path', '/missing', '/m3'),
+            self.change('remote', 'delete', source='/r'),
+            self.change('local', 'delete', source='/same'),
+            self.change('remote', 'content', target='/same'),
+            self.change('local', 'create', target='/dir/inside', bytesize=0),
+        ]
+        self.assertEqual(4, self.merger.prefetch_remote_metadata(group))
+        self.merger.async_sdk.discard_prefetched()
+        self.assertEqual([('delete', '/del'), ('mkfile', '/empty'), ('rename', '/m1', '/m2'), ('stat', '/m1'),
+                          ('stat', '/missing')], sorted(self.sdk.calls))
+
+    def test_nothing_is_prefetched_for_download_only_jobs(self):
+        self.merger.job_config.direction = 'down'
+        self.assertEqual(0, self.merger.prefetch_remote_metadata([self.change('local', 'delete', source='/a')]))
+
+    def test_processors_use_the_prefetched_results(self):
+        from pydio.job.change_processor import ChangeProcessor
+        group = [self.change('local', 'delete', source='/del'), self.change('local', 'path', '/m1', '/m2'),
+                 self.change('local', 'create', target='/empty', bytesize=0)]
+        self.merger.prefetch_remote_metadata(group)
+        for change in group:
+            ChangeProcessor(change, mock.Mock(), self.merger.job_config, self.merger.system, self.merger.async_sdk,
+                            mock.Mock(), mock.Mock()).process_change()
+        self.assertEqual(0, self.merger.async_sdk.discard_prefetched())
+        self.assertEqual([('delete', '/del'), ('mkfile', '/empty'), ('rename', '/m1', '/m2'), ('stat', '/m1')],
+                         sorted(self.sdk.calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
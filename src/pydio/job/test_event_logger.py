@@ -0,0 +1,174 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import mock
+
+from pydio.job import EventLogger as event_logger
+from pydio.job.EventLogger import EventLogger, EventsBuffer
+from pydio.job.job_config import JobsLoader
+from pydio.job.localdb import DBCorruptedException
+
+# -*- coding: utf-8 -*-
+
+
+class EventsBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.logger = EventLogger(self.tmp)
+
+    def tearDown(self):
+        EventsBuffer.discard(self.logger.db)
+        shutil.rmtree(self.tmp)
+
+    def rows(self, event_type=None):
+        conn = sqlite3.connect(self.logger.db)
+        try:
+            if event_type:
+                return [r[0] for r in conn.execute('SELECT message FROM events WHERE type=? ORDER BY id',
+                                                   (event_type,))]
+            return [r[0] for r in conn.execute('SELECT message FROM events ORDER BY id')]
+        finally:
+            conn.close()
+
+    def test_events_are_written_in_batches(self):
+        for i in range(3):
+            self.logger.log('local', 'event %i' % i, 'upload', 'done')
+        self.assertEqual([], self.rows())
+        self.assertEqual(['event 2', 'event 1'], [e['message'] for e in self.logger.get_all(2)])
+        self.logger.flush()
+        self.assertEqual(['event 0', 'event 1', 'event 2'], self.rows())
+        self.logger.flush()
+        self.assertEqual(3, len(self.rows()))
+
+    def test_flush_on_count_and_delay(self):
+        with mock.patch.object(event_logger, 'EVENTS_FLUSH_COUNT', 2):
+            self.logger.log('local', 'first', 'upload', 'done')
+            self.logger.log('local', 'second', 'upload', 'done')
+        self.assertEqual(['first', 'second'], self.rows())
+        with mock.patch.object(event_logger, 'EVENTS_FLUSH_DELAY', 0.05):
+            self.logger.log('local', 'third', 'upload', 'done')
+        time.sleep(0.3)
+        self.assertEqual(['first', 'second', 'third'], self.rows())
+
+    def test_uniq_events_keep_the_last_value(self):
+        self.logger.log_state('indexing', 'sync')
+        self.logger.log_state('processing', 'sync')
+        self.assertEqual(['processing'], [e['message'] for e in self.logger.get_all(10, filter_type='sync')
+                                          if e['type'] == 'sync'])
+        self.logger.flush()
+        self.assertEqual(['processing'], self.rows('sync'))
+        self.logger.log_state('idle', 'success')
+        self.logger.flush()
+        self.assertEqual(['idle'], self.rows('sync'))
+
+    def test_notification_is_consumed_once(self):
+        self.logger.log_notif('2 files modified', 'success')
+        self.assertEqual('2 files modified', self.logger.consume_notification()['message'])
+        self.assertIsNone(self.logger.consume_notification())
+        self.logger.flush()
+        self.assertEqual([], self.rows('notif'))
+
+    def test_notification_of_another_process(self):
+        # Buffer of the job process, writing to the same database as the logger of the web API
+        job_buffer = EventsBuffer(self.logger.db)
+        job_logger = EventLogger(self.tmp)
+        job_logger.buffer = job_buffer
+        job_logger.log_notif('1 files modified', 'success')
+        self.assertIsNone(self.logger.consume_notification())
+        job_buffer.flush()
+        self.assertEqual('1 files modified', self.logger.consume_notification()['message'])
+        job_buffer.flush()
+        self.assertIsNone(self.logger.consume_notification())
+        job_logger.log_notif('3 files modified', 'success')
+        job_buffer.flush()
+        self.assertEqual('3 files modified', self.logger.consume_notification()['message'])
+        self.assertEqual([], self.rows('notif'))
+
+    def test_flush_errors_are_logged(self):
+        self.logger.log('local', 'lost', 'upload', 'done')
+        shutil.rmtree(self.tmp)
+        with mock.patch('logging.error') as error:
+            self.logger.flush()
+        self.assertTrue(error.called)
+        os.mkdir(self.tmp)
+
+    def test_corruption_is_raised_by_the_next_state(self):
+        conn = sqlite3.connect(self.logger.db)
+        conn.execute('DROP TABLE events')
+        conn.close()
+        self.logger.log_state('indexing', 'sync')
+        with mock.patch('logging.error'):
+            self.logger.flush()
+        # Other events do not raise, the merger catches the exception around its states
+        self.logger.log('local', 'event', 'upload', 'done')
+        self.assertRaises(DBCorruptedException, self.logger.log_state, 'indexing', 'sync')
+        self.logger.log_state('indexing', 'sync')
+
+    def test_corruption_found_when_opening(self):
+        conn = sqlite3.connect(self.logger.db)
+        conn.execute('DROP TABLE events')
+        conn.close()
+        EventsBuffer.discard(self.logger.db)
+        with mock.patch('logging.error'):
+            logger = EventLogger(self.tmp)
+        self.assertRaises(DBCorruptedException, logger.log_state, 'Checking changes since last launch...', 'sync')
+
+
+class DiscardEventsBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_discarded_buffer_ignores_events(self):
+        logger = EventLogger(self.tmp)
+        logger.log('local', 'before', 'upload', 'done')
+        self.assertIsNotNone(logger.buffer._timer)
+        EventsBuffer.discard(logger.db)
+        self.assertIsNone(logger.buffer._timer)
+        os.remove(logger.db)
+        logger.log('local', 'after', 'upload', 'done')
+        logger.flush()
+        self.assertFalse(os.path.exists(logger.db))
+        self.assertIsNot(logger.buffer, EventLogger(self.tmp).buffer)
+        EventsBuffer.discard(logger.db)
+
+    def test_clear_job_data_discards_the_buffer(self):
+        job_data_path = os.path.join(self.tmp, 'job')
+        logger = EventLogger(job_data_path)
+        logger.log('local', 'pending', 'upload', 'done')
+        JobsLoader._decorated(self.tmp).clear_job_data('job')
+        self.assertTrue(logger.buffer.discarded)
+        self.assertFalse(os.path.exists(logger.db))
+        logger.flush()
+        self.assertFalse(os.path.exists(logger.db))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import datetime
+import json
+import unittest
+
+from pydio.job.job_config import JobConfig
+
+# -*- coding: utf-8 -*-
+
+# A monday
+MONDAY = datetime.datetime(2026, 10, 19)
+
+
+def at(day, hour, minute=0):
+    return MONDAY + datetime.timedelta(days=day, hours=hour, minutes=minute)
+
+
+class BandwidthLimitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = JobConfig()
+        self.config.bandwidth = {'up': 100, 'down': 0, 'schedule': [
+            {'start': {'h': 8, 'm': 0}, 'end': {'h': 18, 'm': 30}, 'days': [0, 1, 2, 3, 4], 'up': 10, 'down': 50},
+            {'start': {'h': 22, 'm': 0}, 'end': {'h': 6, 'm': 0}, 'days': [4], 'down': 1000},
+        ]}
+
+    def test_default_limits(self):
+        self.assertEqual({'up': 100 * 1024, 'down': 0}, self.config.get_bandwidth_limits(at(5, 12)))
+
+    def test_office_hours(self):
+        self.assertEqual({'up': 10 * 1024, 'down': 50 * 1024}, self.config.get_bandwidth_limits(at(0, 8)))
+        self.assertEqual({'up': 10 * 1024, 'down': 50 * 1024}, self.config.get_bandwidth_limits(at(4, 18, 29)))
+        self.assertEqual({'up': 100 * 1024, 'down': 0}, self.config.get_bandwidth_limits(at(4, 18, 30)))
+
+    def test_range_past_midnight_belongs_to_its_start_day(self):
+        self.assertEqual({'up': 100 * 1024, 'down': 1000 * 1024}, self.config.get_bandwidth_limits(at(4, 23)))
+        self.assertEqual({'up': 100 * 1024, 'down': 1000 * 1024}, self.config.get_bandwidth_limits(at(5, 5)))
+        self.assertEqual({'up': 100 * 1024, 'down': 0}, self.config.get_bandwidth_limits(at(3, 23)))
+        self.assertEqual({'up': 100 * 1024, 'down': 0}, self.config.get_bandwidth_limits(at(4, 5)))
+
+    def test_malformed_entries_are_skipped(self):
+        self.config.bandwidth['schedule'] = [
+            {'start': {'h': 8}, 'up': 1},
+            'not an entry',
+            {'start': {'h': 'x', 'm': 0}, 'end': {'h': 18, 'm': 0}, 'up': 2},
+            {'start': {'h': 8, 'm': 0}, 'end': {'h': 18, 'm': 0}, 'up': -3},
+            {'start': {'h': 8, 'm': 0}, 'end': {'h': 18, 'm': 0}, 'up': 4},
+        ]
+        self.assertEqual({'up': 4 * 1024, 'down': 0}, self.config.get_bandwidth_limits(at(0, 12)))
+
+    def test_invalid_default_limits_mean_no_limit(self):
+        self.config.bandwidth = {'up': -5, 'down': 'fast'}
+        self.assertEqual({'up': 0, 'down': 0}, self.config.get_bandwidth_limits(at(0, 12)))
+
+
+class NormalizeBandwidthTest(unittest.TestCase):
+
+    def test_normalize(self):
+        bandwidth = JobConfig.normalize_bandwidth({'up': '20', 'down': -1, 'schedule': [
+            {'start': {'h': '8'}, 'end': {'h': 18, 'm': 0}, 'days': ['1'], 'up': 5},
+            {'start': {'h': 25, 'm': 0}, 'end': {'h': 18, 'm': 0}},
+            {'start': {'h': 8, 'm': 0}, 'end': {'h': 18, 'm': 0}, 'days': [7]},
+            {'start': {'h': 8, 'm': 0}, 'end': {'h': 18, 'm': 0}, 'down': True},
+        ]})
+        self.assertEqual({'up': 20, 'down': 0, 'schedule': [
+            {'start': {'h': 8, 'm': 0}, 'end': {'h': 18, 'm': 0}, 'days': [1], 'up': 5}
+        ]}, bandwidth)
+
+    def test_not_a_dict(self):
+        self.assertEqual({'up': 0, 'down': 0, 'schedule': []}, JobConfig.normalize_bandwidth('100'))
+        self.assertEqual([], JobConfig.normalize_bandwidth({'schedule': 'always'})['schedule'])
+
+    def test_config_file_is_normalized(self):
+        data = json.dumps({'__type__': 'JobConfig', 'id': 'job', 'server': 'http://localhost', 'workspace': 'ws',
+                           'directory': '/tmp/job', 'bandwidth': {'up': -10, 'schedule': [{'start': 8}]}})
+        job_config = json.loads(data, object_hook=JobConfig.object_decoder)
+        self.assertEqual({'up': 0, 'down': 0, 'schedule': []}, job_config.bandwidth)
+
+
+if __name__ == '__main__':
+    unittest.main()
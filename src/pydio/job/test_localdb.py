@@ -0,0 +1,64 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from pydispatch import dispatcher
+from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileMovedEvent
+
+from pydio import LOCAL_CHANGE_SIGNAL
+from pydio.job.localdb import SqlEventHandler
+
+# -*- coding: utf-8 -*-
+
+
+class SqlEventHandlerSignalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.base = os.path.join(self.tmp, 'local')
+        os.makedirs(self.base)
+        self.handler = SqlEventHandler(self.base, ['*'], [], self.tmp)
+        self.received = []
+        dispatcher.connect(self.receive, signal=LOCAL_CHANGE_SIGNAL, sender=self.handler)
+
+    def tearDown(self):
+        dispatcher.disconnect(self.receive, signal=LOCAL_CHANGE_SIGNAL, sender=self.handler)
+        shutil.rmtree(self.tmp)
+
+    def receive(self, sender, pathes=None):
+        self.received.append(pathes)
+
+    def test_indexed_changes_are_signaled_with_their_pathes(self):
+        path = os.path.join(self.base, 'file')
+        with open(path, 'wb') as fd:
+            fd.write('content')
+        self.handler.on_created(FileCreatedEvent(path))
+        os.rename(path, path + '2')
+        self.handler.on_moved(FileMovedEvent(path, path + '2'))
+        os.unlink(path + '2')
+        self.handler.on_deleted(FileDeletedEvent(path + '2'))
+        self.assertEqual([['/file'], ['/file', '/file2'], ['/file2']], self.received)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import multiprocessing
+import threading
+import unittest
+
+import mock
+from pydispatch import dispatcher
+
+from pydio import PUBLISH_SIGNAL
+from pydio.job import continous_merger, process
+from pydio.job.EventLogger import EventsBuffer
+
+# -*- coding: utf-8 -*-
+
+
+class FakeMerger(threading.Thread):
+    """
+    Runs until it is stopped, and records the commands it receives
+    """
+    instances = []
+
+    def __init__(self, job_config, job_data_path=None, resources=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.job_config = job_config
+        self.commands = []
+        self.stopped = threading.Event()
+        FakeMerger.instances.append(self)
+        dispatcher.send(signal=PUBLISH_SIGNAL, sender=self, channel='status', message='created')
+
+    def run(self):
+        self.stopped.wait(10)
+
+    def start_now(self):
+        self.commands.append(('start_now',))
+
+    def pause(self):
+        self.commands.append(('pause',))
+
+    def set_bandwidth(self, bandwidth):
+        self.commands.append(('set_bandwidth', bandwidth))
+
+    def stop(self):
+        self.commands.append(('stop',))
+        self.stopped.set()
+
+    def is_running(self):
+        return not self.stopped.is_set()
+
+    def get_global_progress(self):
+        return {'queue_done': 3}
+
+    def get_current_tasks(self):
+        return {'total': 0, 'current': []}
+
+    def get_resources_stats(self):
+        return None
+
+
+class RunJobProcessTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeMerger.instances = []
+        connect = dispatcher.connect
+        self.receivers = []
+
+        def record_connect(receiver, *args, **kwargs):
+            self.receivers.append(receiver)
+            return connect(receiver, *args, **kwargs)
+        patches = [mock.patch.object(continous_merger, 'ContinuousDiffMerger', FakeMerger),
+                   mock.patch.object(process, 'PROGRESS_SNAPSHOT_DELAY', 0.05),
+                   mock.patch.object(process, 'reset_logging_locks'),
+                   mock.patch('pydio.utils.global_config.ConfigManager.Instance'),
+                   mock.patch.object(EventsBuffer, 'flush_all'),
+                   mock.patch.object(process.dispatcher, 'connect', side_effect=record_connect)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.child = threading.Thread(target=process.run_job_process,
+                                      args=(child_conn, mock.Mock(id='job'), '/tmp/job', '/tmp', '/tmp', None))
+        self.child.daemon = True
+        self.child.start()
+
+    def tearDown(self):
+        for receiver in self.receivers:
+            dispatcher.disconnect(receiver, signal=PUBLISH_SIGNAL, sender=dispatcher.Any, weak=False)
+
+    def receive_until_exit(self):
+        messages = []
+        while self.conn.poll(5):
+            messages.append(self.conn.recv())
+            if messages[-1][0] == 'exit':
+                break
+        return messages
+
+    def test_commands_progress_and_messages_are_relayed(self):
+        self.conn.send(('set_bandwidth', {'up': 10, 'down': 0}))
+        self.conn.send(('pause',))
+        self.conn.send(('unknown',))
+        self.conn.send(('stop',))
+        messages = self.receive_until_exit()
+        self.child.join(5)
+        self.assertFalse(self.child.is_alive())
+        merger = FakeMerger.instances[0]
+        self.assertEqual([('set_bandwidth', {'up': 10, 'down': 0}), ('pause',), ('stop',)], merger.commands)
+        self.assertIn(('publish', 'status', 'created'), messages)
+        snapshots = [message[1] for message in messages if message[0] == 'progress']
+        self.assertTrue(snapshots)
+        self.assertEqual({'queue_done': 3}, snapshots[0]['global'])
+        self.assertEqual({'total': 0, 'current': []}, snapshots[0]['tasks'])
+        self.assertEqual(('exit',), messages[-1])
+        self.assertTrue(EventsBuffer.flush_all.called)
+
+    def test_child_stops_when_parent_is_gone(self):
+        self.assertEqual('publish', self.conn.recv()[0])
+        self.conn.close()
+        self.child.join(5)
+        self.assertFalse(self.child.is_alive())
+        self.assertEqual([('stop',)], FakeMerger.instances[0].commands)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import threading
+import time
+import unittest
+
+from pydio.job import resources
+from pydio.job.resources import ResourceManager
+from pydio.sdk.exceptions import InterruptException
+
+# -*- coding: utf-8 -*-
+
+
+class TransferSlotsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = ResourceManager(max_transfers=1)
+        self.job = self.manager.register_job('job')
+
+    def wait_in_thread(self, target):
+        result = []
+
+        def run():
+            try:
+                target()
+                result.append('acquired')
+            except InterruptException:
+                result.append('interrupted')
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread, result
+
+    def test_waiting_job_is_interrupted(self):
+        self.manager.acquire_transfer('other')
+        stopped = []
+        thread, result = self.wait_in_thread(
+            lambda: self.manager.acquire_transfer('job', interrupted=lambda: bool(stopped)))
+        time.sleep(0.1)
+        self.assertEqual([], result)
+        stopped.append(True)
+        thread.join(2 * resources.SLOT_WAIT_CHECK_DELAY + 1)
+        self.assertEqual(['interrupted'], result)
+        self.assertEqual(0, len(self.manager._waiting))
+
+    def test_interrupted_ticket_does_not_block_the_others(self):
+        self.manager.acquire_transfer('other')
+        stopped = []
+        first, first_result = self.wait_in_thread(
+            lambda: self.manager.acquire_transfer('job', interrupted=lambda: bool(stopped)))
+        time.sleep(0.05)
+        second, second_result = self.wait_in_thread(lambda: self.manager.acquire_transfer('third'))
+        time.sleep(0.05)
+        stopped.append(True)
+        first.join(2)
+        self.manager.release_transfer()
+        second.join(2)
+        self.assertEqual(['interrupted'], first_result)
+        self.assertEqual(['acquired'], second_result)
+        self.assertEqual(1, self.manager.active_transfers)
+
+    def test_slots_are_handed_round_robin(self):
+        self.manager.acquire_transfer('busy')
+        order = []
+        threads = []
+        for job_id in ('a', 'a', 'a', 'b'):
+            def take(job_id=job_id):
+                self.manager.acquire_transfer(job_id)
+                order.append(job_id)
+                self.manager.release_transfer()
+            threads.append(threading.Thread(target=take))
+            threads[-1].start()
+            time.sleep(0.05)
+        self.manager.release_transfer()
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual(['a', 'b', 'a', 'a'], order)
+
+    def test_transfer_slot_context(self):
+        with self.job.transfer_slot(interrupted=lambda: False):
+            self.assertEqual(1, self.manager.active_transfers)
+        self.assertEqual(0, self.manager.active_transfers)
+        self.assertEqual(1, self.job.get_stats()['transfers'])
+
+
+class JobResourcesTest(unittest.TestCase):
+
+    def test_limits_and_stats(self):
+        manager = ResourceManager()
+        job = manager.register_job('job', limits=lambda: {'up': 1000, 'down': 0})
+        stats = job.get_stats()
+        self.assertEqual((1000, 0), (stats['limit_up'], stats['limit_down']))
+        job.consume(10, 'down')
+        job.consume(20, 'down')
+        stats = job.get_stats()
+        self.assertEqual(30, stats['bytes_down'])
+        self.assertEqual(0, stats['bytes_up'])
+        self.assertTrue(stats['rate_down'] > 0)
+        self.assertEqual(stats, manager.get_job_stats('job'))
+        manager.unregister_job('job')
+        self.assertIsNone(manager.get_job_stats('job'))
+
+    def test_consume_is_interrupted(self):
+        manager = ResourceManager(global_down=64 * 1024)
+        job = manager.register_job('job', limits=lambda: {'up': 0, 'down': 0})
+        start = time.time()
+        self.assertRaises(InterruptException, job.consume, 1024 * 1024, 'down', interrupted=lambda: True)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(0, job.get_stats()['bytes_down'])
+
+    def test_sessions_are_shared_by_server(self):
+        manager = ResourceManager()
+        self.assertIs(manager.get_session('https://server/pydio'), manager.get_session('https://server/other/'))
+        self.assertIsNot(manager.get_session('https://server/'), manager.get_session('http://server/'))
+
+
+if __name__ == '__main__':
+    unittest.main()
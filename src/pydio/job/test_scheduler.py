@@ -0,0 +1,72 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from pydio.job import scheduler
+from pydio.utils.global_config import ConfigManager
+
+# -*- coding: utf-8 -*-
+
+
+class GlobalBandwidthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config_manager = ConfigManager._decorated(configs_path=self.tmp, data_path=self.tmp)
+        patch = mock.patch.object(scheduler.ConfigManager, 'Instance', return_value=self.config_manager)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build_scheduler(self):
+        jobs_loader = mock.Mock()
+        jobs_loader.get_jobs.return_value = {}
+        return scheduler.PydioScheduler._decorated(jobs_root_path=self.tmp, jobs_loader=jobs_loader)
+
+    def test_no_limit_by_default(self):
+        resources = self.build_scheduler().resources
+        self.assertEqual((0, 0), (resources.buckets['up'].rate, resources.buckets['down'].rate))
+
+    def test_limits_are_loaded_from_the_global_config(self):
+        with open(os.path.join(self.tmp, 'bandwidth.json'), 'w') as handle:
+            json.dump({'up': 100, 'down': 'fast'}, handle)
+        resources = self.build_scheduler().resources
+        self.assertEqual((100 * 1024, 0), (resources.buckets['up'].rate, resources.buckets['down'].rate))
+
+    def test_set_limits(self):
+        pydio_scheduler = self.build_scheduler()
+        self.assertEqual({'up': 0, 'down': 50 * 1024}, pydio_scheduler.set_global_bandwidth(down=50))
+        self.assertEqual({'up': 10 * 1024, 'down': 50 * 1024}, pydio_scheduler.set_global_bandwidth(up=10))
+        buckets = pydio_scheduler.resources.buckets
+        self.assertEqual((10 * 1024, 50 * 1024), (buckets['up'].rate, buckets['down'].rate))
+        reloaded = ConfigManager._decorated(configs_path=self.tmp, data_path=self.tmp)
+        self.assertEqual({'up': 10, 'down': 50}, reloaded.get_global_bandwidth())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -132,6 +132,8 @@ def main(argv=sys.argv[1:]):
     parser.add_argument('--extract_html', help='Utils for extracting HTML strings and compiling po files to json',
                         type=unicode, default=False)
     parser.add_argument('--auto-start', action='store_true')
+    parser.add_argument('--process-isolation', help='Run each synchronization job in its own process',
+                        action='store_true', default=False)
     parser.add_argument('-v', '--verbose', action='count', default=1)
     args, _ = parser.parse_known_args(argv)
 
@@ -217,7 +219,8 @@ def main(argv=sys.argv[1:]):
                                    password=args.api_password, default_port=args.api_port)
     ports_detector.create_config_file()
 
-    scheduler = PydioScheduler.Instance(jobs_root_path=jobs_root_path, jobs_loader=jobs_loader)
+    scheduler = PydioScheduler.Instance(jobs_root_path=jobs_root_path, jobs_loader=jobs_loader,
+                                        process_isolation=args.process_isolation)
     server = PydioApi(ports_detector.get_port(), ports_detector.get_username(),
         ports_detector.get_password(), external_ip=args.api_address)
     from pydio.job import manager
@@ -297,6 +300,9 @@ def setup_logging(verbosity=None, application_path=None):
 
 
 if __name__ == "__main__":
+    # Job processes of frozen Windows builds (--process-isolation)
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
     from pydio.job import manager
     manager.wait()
@@ -0,0 +1,142 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import hmac
+import logging
+import random
+import threading
+import time
+from hashlib import sha256
+from urlparse import urlparse
+
+# -*- coding: utf-8 -*-
+
+TOKEN_REFRESH_AGE = 45 * 60
+
+
+class TokenAuthProvider(object):
+
+    def __init__(self, load_tokens, generate_tokens, store_tokens, refresh_age=TOKEN_REFRESH_AGE):
+        """
+        Keep the key/pair tokens of a PydioSdk, sign the requests with them and renew them. All the threads using
+        the same sdk share one provider: a renewal is performed only once even if many requests fail at the same
+        time, and tokens older than refresh_age are renewed in background before the server revokes them.
+
+        :param load_tokens: callable returning the tokens stored in the keychain (or None)
+        :param generate_tokens: callable asking fresh tokens to the server (basic-http authentication)
+        :param store_tokens: callable saving tokens in the keychain
+        :param refresh_age: age in seconds after which tokens are proactively renewed
+        :return:
+        """
+        self.load_tokens = load_tokens
+        self.generate_tokens = generate_tokens
+        self.store_tokens = store_tokens
+        self.refresh_age = refresh_age
+        self.tokens = None
+        self.tokens_time = 0
+        self._lock = threading.Lock()
+        self._background_refresh = None
+        self._hmac = {}
+        self._random = random.Random()
+
+    def get_tokens(self):
+        """
+        Current tokens, loaded from keychain or generated if necessary. If they are getting old, a background
+        renewal is triggered but the current ones are returned immediately.
+        :return: dict() {'t': token, 'p': private}
+        """
+        tokens = self.tokens
+        if not tokens:
+            with self._lock:
+                if not self.tokens:
+                    stored = self.load_tokens()
+                    if stored:
+                        self.set_tokens(stored)
+            if not self.tokens:
+                return self.refresh()
+            return self.tokens
+        if time.time() - self.tokens_time > self.refresh_age:
+            self.refresh_in_background()
+        return tokens
+
+    def set_tokens(self, tokens):
+        """
+        Use the given tokens. Tokens without a known issue time (stored by a previous version) are considered
+        as old: they are used but renewed in background on the next request.
+        :param tokens: dict() {'t': token, 'p': private, 'i': issue timestamp}
+        """
+        self.tokens = tokens
+        try:
+            self.tokens_time = float(tokens.get('i', 0))
+        except (TypeError, ValueError):
+            self.tokens_time = 0
+        self._hmac = {}
+
+    def refresh(self, failed_tokens=None):
+        """
+        Get new tokens from the server. Concurrent callers wait for the same renewal instead of each asking the
+        server: if the tokens that failed were already replaced in the meantime, the new ones are simply returned.
+        :param failed_tokens: dict() the tokens that were refused by the server, None if there were no tokens
+        :return: dict() new tokens
+        """
+        with self._lock:
+            if self.tokens is not None and self.tokens is not failed_tokens:
+                return self.tokens
+            tokens = self.generate_tokens()
+            tokens['i'] = time.time()
+            self.set_tokens(tokens)
+        self.store_tokens(tokens)
+        return tokens
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._background_refresh and self._background_refresh.is_alive():
+                return
+            current = self.tokens
+
+            def background_refresh():
+                try:
+                    self.refresh(failed_tokens=current)
+                except Exception as e:
+                    # Will be retried by the next request
+                    logging.warning('Background tokens renewal failed: %s' % e)
+
+            self._background_refresh = threading.Thread(target=background_refresh, name='PydioTokensRefresh')
+            self._background_refresh.daemon = True
+            self._background_refresh.start()
+
+    def sign(self, token, private, url):
+        """
+        Compute the auth_hash parameter for a given url. The hmac key schedule is computed once per token and
+        copied for each request, and the nonce does not need a sha1 of a random float.
+        :param token: str the token
+        :param private: str private key associated to token
+        :param url: str url to query
+        :return: str nonce:hash
+        """
+        nonce = '%040x' % self._random.getrandbits(160)
+        uri = urlparse(url).path.rstrip('/')
+        token = str(token)
+        base = self._hmac.get(token)
+        if base is None:
+            base = hmac.new(token, digestmod=sha256)
+            self._hmac[token] = base
+        the_hash = base.copy()
+        the_hash.update(str(uri + ':' + nonce + ':' + private))
+        return nonce + ':' + the_hash.hexdigest()
@@ -0,0 +1,162 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import logging
+import threading
+
+# -*- coding: utf-8 -*-
+
+REMOTE_CACHE_MAX_ENTRIES = 100000
+
+
+class RemotePathCache(object):
+
+    def __init__(self, max_entries=REMOTE_CACHE_MAX_ENTRIES):
+        """
+        What a PydioSdk already knows about remote nodes during a sync cycle: folders known to exist (created by
+        mkdir, seen in listings, changes or stats) and the stat results already received. It is cleared at each
+        cycle, and nodes are forgotten as soon as they are deleted, renamed or written by the sdk.
+        Entries are not added anymore once max_entries is reached.
+        :param max_entries: int maximum number of folders + stats kept
+        :return:
+        """
+        self.max_entries = max_entries
+        self._dirs = set()
+        self._stats = dict()
+        # parent path => set of known children, for folders and for the ancestors of the known nodes
+        self._children = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _full(self):
+        return len(self._dirs) + len(self._stats) >= self.max_entries
+
+    @staticmethod
+    def _key(path):
+        return path.rstrip('/') or '/'
+
+    def _link(self, path):
+        """
+        Register path in the children of its parent, and the parent in its own parent up to the first ancestor
+        already registered, so that invalidating any ancestor reaches it.
+        :param path: node path
+        :return:
+        """
+        child = path
+        key = self._key(path)
+        while key != '/' and '/' in key:
+            parent = key.rsplit('/', 1)[0] or '/'
+            siblings = self._children.get(parent)
+            if siblings is not None:
+                siblings.add(child)
+                return
+            self._children[parent] = set([child])
+            child = key = parent
+
+    def add_dir(self, path):
+        with self._lock:
+            if not self._full():
+                self._dirs.add(path)
+                self._link(path)
+
+    def add_dirs(self, pathes):
+        with self._lock:
+            for path in pathes:
+                if self._full():
+                    break
+                self._dirs.add(path)
+                self._link(path)
+
+    def add_stat(self, path, stat_result):
+        """
+        :param path: node path, relative to the sdk remote folder
+        :param stat_result: dict() as returned by PydioSdk.stat()
+        :return:
+        """
+        with self._lock:
+            if not self._full():
+                self._stats[path] = stat_result
+                self._link(path)
+
+    def has_dir(self, path):
+        with self._lock:
+            if path in self._dirs:
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def get_stat(self, path, with_hash=False):
+        """
+        :param path: node path
+        :param with_hash: bool only return a stat containing the node hash
+        :return: dict() copy of the known stat, or None
+        """
+        with self._lock:
+            stat_result = self._stats.get(path)
+            if stat_result is None or (with_hash and 'hash' not in stat_result):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(stat_result)
+
+    def invalidate(self, path):
+        """
+        Forget a node and, if it has known children, all its subtree. The cost is the size of the subtree, a
+        single lookup for a file.
+        :param path: node path
+        :return:
+        """
+        key = self._key(path)
+        with self._lock:
+            self._dirs.discard(path)
+            self._stats.pop(path, None)
+            if key != '/' and '/' in key:
+                siblings = self._children.get(key.rsplit('/', 1)[0] or '/')
+                if siblings is not None:
+                    siblings.discard(path)
+            stack = [key]
+            while stack:
+                children = self._children.pop(stack.pop(), None)
+                if not children:
+                    continue
+                for child in children:
+                    self._dirs.discard(child)
+                    self._stats.pop(child, None)
+                    stack.append(self._key(child))
+
+    def clear(self):
+        with self._lock:
+            self._dirs = set()
+            self._stats = dict()
+            self._children = dict()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        """
+        Hit-rate counters since last clear()
+        :return: dict() {hits, misses, hit_rate, entries}
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': (float(self.hits) / total) if total else 0.0,
+                    'entries': len(self._dirs) + len(self._stats)}
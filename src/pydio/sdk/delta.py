@@ -0,0 +1,451 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import hashlib
+import struct
+
+# -*- coding: utf-8 -*-
+
+# librsync file formats
+RS_MD4_SIG_MAGIC = 0x72730136
+RS_BLAKE2_SIG_MAGIC = 0x72730137
+RS_DELTA_MAGIC = 0x72730236
+RS_DEFAULT_BLOCK_LEN = 2048
+RS_MD4_SUM_LENGTH = 16
+RS_BLAKE2_SUM_LENGTH = 32
+RS_DEFAULT_STRONG_LEN = 8
+
+RS_OP_END = 0x00
+RS_OP_LITERAL_64 = 0x40
+RS_OP_LITERAL_N1 = 0x41
+RS_OP_COPY_N1_N1 = 0x45
+RS_OP_COPY_N8_N8 = 0x54
+
+ROLLSUM_CHAR_OFFSET = 31
+DELTA_READ_SIZE = 1024 * 1024
+DELTA_MAX_LITERAL = 1024 * 1024
+
+_INT_WIDTHS = (1, 2, 4, 8)
+_INT_FORMATS = {1: '>B', 2: '>H', 4: '>I', 8: '>Q'}
+
+
+class DeltaException(Exception):
+    pass
+
+
+class MD4(object):
+
+    def __init__(self, data=''):
+        """
+        Pure python MD4, only used when the ssl library of the system does not provide it anymore.
+        """
+        self._h = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476]
+        self._buffer = ''
+        self._count = 0
+        if data:
+            self.update(data)
+
+    @staticmethod
+    def _rotate(x, n):
+        x &= 0xffffffff
+        return ((x << n) | (x >> (32 - n))) & 0xffffffff
+
+    def _compress(self, block):
+        x = struct.unpack('<16I', block)
+        a, b, c, d = self._h
+        r = self._rotate
+        for i in (0, 4, 8, 12):
+            a = r(a + ((b & c) | (~b & d)) + x[i], 3)
+            d = r(d + ((a & b) | (~a & c)) + x[i + 1], 7)
+            c = r(c + ((d & a) | (~d & b)) + x[i + 2], 11)
+            b = r(b + ((c & d) | (~c & a)) + x[i + 3], 19)
+        for i in (0, 1, 2, 3):
+            a = r(a + ((b & c) | (b & d) | (c & d)) + x[i] + 0x5a827999, 3)
+            d = r(d + ((a & b) | (a & c) | (b & c)) + x[i + 4] + 0x5a827999, 5)
+            c = r(c + ((d & a) | (d & b) | (a & b)) + x[i + 8] + 0x5a827999, 9)
+            b = r(b + ((c & d) | (c & a) | (d & a)) + x[i + 12] + 0x5a827999, 13)
+        for i in (0, 2, 1, 3):
+            a = r(a + (b ^ c ^ d) + x[i] + 0x6ed9eba1, 3)
+            d = r(d + (a ^ b ^ c) + x[i + 8] + 0x6ed9eba1, 9)
+            c = r(c + (d ^ a ^ b) + x[i + 4] + 0x6ed9eba1, 11)
+            b = r(b + (c ^ d ^ a) + x[i + 12] + 0x6ed9eba1, 15)
+        self._h = [(v + n) & 0xffffffff for v, n in zip(self._h, (a, b, c, d))]
+
+    def update(self, data):
+        data = self._buffer + bytes(data)
+        self._count += len(data) - len(self._buffer)
+        end = len(data) - len(data) % 64
+        for i in xrange(0, end, 64):
+            self._compress(data[i:i + 64])
+        self._buffer = data[end:]
+
+    def copy(self):
+        other = MD4()
+        other._h = list(self._h)
+        other._buffer = self._buffer
+        other._count = self._count
+        return other
+
+    def digest(self):
+        final = self.copy()
+        padding = '\x80' + '\x00' * ((55 - self._count) % 64)
+        final.update(padding + struct.pack('<Q', (self._count * 8) & 0xffffffffffffffff))
+        return struct.pack('<4I', *final._h)
+
+    def hexdigest(self):
+        return self.digest().encode('hex')
+
+
+def new_md4():
+    try:
+        return hashlib.new('md4')
+    except ValueError:
+        return MD4()
+
+
+def new_blake2():
+    try:
+        return hashlib.blake2b(digest_size=RS_BLAKE2_SUM_LENGTH)
+    except AttributeError:
+        pass
+    try:
+        import pyblake2
+        return pyblake2.blake2b(digest_size=RS_BLAKE2_SUM_LENGTH)
+    except ImportError:
+        raise DeltaException('BLAKE2 signatures require python 3 or the pyblake2 module')
+
+
+def weak_sum(data, start=0, length=None):
+    """
+    librsync rolling checksum of a block
+    :param data: bytearray
+    :return: tuple (s1, s2), 16 bits each
+    """
+    if length is None:
+        length = len(data) - start
+    block = data[start:start + length]
+    s1 = sum(block)
+    s2 = sum(map(int.__mul__, xrange(length, 0, -1), block))
+    s1 += length * ROLLSUM_CHAR_OFFSET
+    s2 += length * (length + 1) // 2 * ROLLSUM_CHAR_OFFSET
+    return s1 & 0xffff, s2 & 0xffff
+
+
+def read_exactly(stream, size):
+    """
+    Read size bytes from a file-like object, whose read() may return less (sockets, decoded http responses)
+    :return: str, shorter only at the end of the stream
+    """
+    data = stream.read(size)
+    if data is None:
+        return ''
+    if len(data) == size or not data:
+        return data
+    parts = [data]
+    missing = size - len(data)
+    while missing > 0:
+        data = stream.read(missing)
+        if not data:
+            break
+        parts.append(data)
+        missing -= len(data)
+    return ''.join(parts)
+
+
+class Signature(object):
+
+    def __init__(self, block_len, strong_len, magic=RS_MD4_SIG_MAGIC):
+        """
+        Weak and strong sums of the blocks of a basis file, indexed by weak sum.
+        :param block_len: int
+        :param strong_len: int number of bytes kept from the strong sum
+        :param magic: int RS_MD4_SIG_MAGIC or RS_BLAKE2_SIG_MAGIC
+        :return:
+        """
+        if magic == RS_MD4_SIG_MAGIC:
+            self.new_strong = new_md4
+        elif magic == RS_BLAKE2_SIG_MAGIC:
+            new_blake2()
+            self.new_strong = new_blake2
+        else:
+            raise DeltaException('Unsupported signature format %#x' % magic)
+        self.magic = magic
+        self.block_len = block_len
+        self.strong_len = strong_len
+        self.blocks = dict()
+
+    def strong_sum(self, data):
+        h = self.new_strong()
+        h.update(data)
+        return h.digest()[:self.strong_len]
+
+    def add_block(self, index, weak, strong):
+        self.blocks.setdefault(weak, []).append((index, strong))
+
+
+def signature(basis_fd, sig_fd, block_len=RS_DEFAULT_BLOCK_LEN, strong_len=RS_DEFAULT_STRONG_LEN):
+    """
+    Write the librsync (MD4) signature of a file, same as `rdiff signature`
+    :param basis_fd: file-like object to read
+    :param sig_fd: file-like object to write the signature to
+    :return:
+    """
+    sig_fd.write(struct.pack('>III', RS_MD4_SIG_MAGIC, block_len, strong_len))
+    read_size = max(DELTA_READ_SIZE // block_len, 1) * block_len
+    new_strong = new_md4
+    while True:
+        data = read_exactly(basis_fd, read_size)
+        if not data:
+            break
+        buf = bytearray(data)
+        out = []
+        for start in xrange(0, len(buf), block_len):
+            length = min(block_len, len(buf) - start)
+            s1, s2 = weak_sum(buf, start, length)
+            h = new_strong()
+            h.update(data[start:start + length])
+            out.append(struct.pack('>I', (s2 << 16) | s1) + h.digest()[:strong_len])
+        sig_fd.write(''.join(out))
+        if len(data) < read_size:
+            break
+
+
+def load_signature(sig_fd):
+    """
+    Read a librsync signature (MD4, or BLAKE2 when available)
+    :param sig_fd: file-like object
+    :return: Signature
+    """
+    header = read_exactly(sig_fd, 12)
+    if len(header) < 12:
+        raise DeltaException('Truncated signature header')
+    magic, block_len, strong_len = struct.unpack('>III', header)
+    sig = Signature(block_len, strong_len, magic)
+    entry_len = 4 + strong_len
+    index = 0
+    while True:
+        data = read_exactly(sig_fd, entry_len * 4096)
+        for start in xrange(0, len(data) - entry_len + 1, entry_len):
+            weak = struct.unpack('>I', data[start:start + 4])[0]
+            sig.add_block(index, weak, data[start + 4:start + entry_len])
+            index += 1
+        if len(data) < entry_len * 4096:
+            break
+    return sig
+
+
+class DeltaWriter(object):
+
+    def __init__(self, delta_fd):
+        """
+        Encode librsync delta commands, merging contiguous copies and buffering literals
+        :param delta_fd: file-like object
+        """
+        self.fd = delta_fd
+        self.fd.write(struct.pack('>I', RS_DELTA_MAGIC))
+        self.copy_offset = 0
+        self.copy_len = 0
+        self.literal = []
+        self.literal_len = 0
+
+    @staticmethod
+    def _width(value):
+        for width in _INT_WIDTHS:
+            if value < (1 << (8 * width)):
+                return width
+        raise DeltaException('Value too large for a delta command')
+
+    def copy(self, offset, length):
+        self.flush_literal()
+        if self.copy_len and self.copy_offset + self.copy_len == offset:
+            self.copy_len += length
+            return
+        self.flush_copy()
+        self.copy_offset = offset
+        self.copy_len = length
+
+    def add_literal(self, data):
+        if not data:
+            return
+        self.flush_copy()
+        self.literal.append(bytes(data))
+        self.literal_len += len(data)
+        if self.literal_len >= DELTA_MAX_LITERAL:
+            self.flush_literal()
+
+    def flush_copy(self):
+        if not self.copy_len:
+            return
+        offset_width = self._width(self.copy_offset)
+        len_width = self._width(self.copy_len)
+        op = RS_OP_COPY_N1_N1 + 4 * _INT_WIDTHS.index(offset_width) + _INT_WIDTHS.index(len_width)
+        self.fd.write(struct.pack('>B', op) + struct.pack(_INT_FORMATS[offset_width], self.copy_offset)
+                      + struct.pack(_INT_FORMATS[len_width], self.copy_len))
+        self.copy_len = 0
+
+    def flush_literal(self):
+        if not self.literal_len:
+            return
+        if self.literal_len <= RS_OP_LITERAL_64:
+            self.fd.write(struct.pack('>B', self.literal_len))
+        else:
+            width = self._width(self.literal_len)
+            self.fd.write(struct.pack('>B', RS_OP_LITERAL_N1 + _INT_WIDTHS.index(width))
+                          + struct.pack(_INT_FORMATS[width], self.literal_len))
+        for data in self.literal:
+            self.fd.write(data)
+        self.literal = []
+        self.literal_len = 0
+
+    def close(self):
+        self.flush_literal()
+        self.flush_copy()
+        self.fd.write(struct.pack('>B', RS_OP_END))
+
+
+def delta(sig, new_fd, delta_fd):
+    """
+    Write the librsync delta turning the file described by sig into the content of new_fd, same as `rdiff delta`.
+    The new file is read by large buffers; the weak sum rolls byte per byte only where blocks do not match.
+    :param sig: Signature
+    :param new_fd: file-like object to read
+    :param delta_fd: file-like object to write the delta to
+    :return:
+    """
+    out = DeltaWriter(delta_fd)
+    block_len = sig.block_len
+    blocks = sig.blocks
+    strong_sum = sig.strong_sum
+    buf = bytearray()
+    pos = 0
+    literal_start = 0
+    eof = False
+    s1 = s2 = None
+    while True:
+        if not eof and len(buf) - pos < block_len:
+            # Keep the current window and the pending literal, read more
+            out.add_literal(buf[literal_start:pos])
+            data = read_exactly(new_fd, DELTA_READ_SIZE)
+            eof = len(data) < DELTA_READ_SIZE
+            buf = buf[pos:] + bytearray(data)
+            pos = literal_start = 0
+        end = len(buf)
+        window = min(block_len, end - pos)
+        if window <= 0:
+            break
+        if s1 is None:
+            s1, s2 = weak_sum(buf, pos, window)
+        if window < block_len:
+            # Tail of the file: it can only match the (short) last block of the basis
+            candidates = blocks.get((s2 << 16) | s1)
+            if candidates:
+                strong = strong_sum(buf[pos:end])
+                for index, block_strong in candidates:
+                    if block_strong == strong:
+                        out.add_literal(buf[literal_start:pos])
+                        out.copy(index * block_len, window)
+                        literal_start = pos = end
+                        break
+            break
+        matched = False
+        limit = end - block_len
+        while True:
+            candidates = blocks.get((s2 << 16) | s1)
+            if candidates:
+                strong = strong_sum(buf[pos:pos + block_len])
+                for index, block_strong in candidates:
+                    if block_strong == strong:
+                        matched = True
+                        break
+                if matched:
+                    break
+            if pos >= limit:
+                break
+            o = buf[pos]
+            s1 = (s1 - o + buf[pos + block_len]) & 0xffff
+            s2 = (s2 - block_len * (o + ROLLSUM_CHAR_OFFSET) + s1) & 0xffff
+            pos += 1
+        if matched:
+            out.add_literal(buf[literal_start:pos])
+            out.copy(index * block_len, block_len)
+            pos += block_len
+            literal_start = pos
+            s1 = None
+        elif eof:
+            # No more data to roll in: the window becomes the tail
+            pos += 1
+            s1 = None
+        else:
+            # Roll out of the buffer: keep the window for the next read
+            pos += 1
+            s1 = None
+    out.add_literal(buf[literal_start:len(buf)])
+    out.close()
+
+
+def patch(basis_fd, delta_fd, out_fd):
+    """
+    Apply a librsync delta to a basis file, same as `rdiff patch`. The delta is read as a stream, so that it can
+    be applied while it is downloaded.
+    :param basis_fd: seekable file-like object
+    :param delta_fd: file-like object with read()
+    :param out_fd: file-like object to write the result to
+    :return: int number of bytes written
+    """
+    magic = read_exactly(delta_fd, 4)
+    if len(magic) < 4 or struct.unpack('>I', magic)[0] != RS_DELTA_MAGIC:
+        raise DeltaException('Not a librsync delta')
+    written = 0
+
+    def read_int(width):
+        data = read_exactly(delta_fd, width)
+        if len(data) < width:
+            raise DeltaException('Truncated delta')
+        return struct.unpack(_INT_FORMATS[width], data)[0]
+
+    while True:
+        op = read_exactly(delta_fd, 1)
+        if not op:
+            raise DeltaException('Truncated delta')
+        op = ord(op)
+        if op == RS_OP_END:
+            return written
+        if op <= RS_OP_LITERAL_64 or op < RS_OP_COPY_N1_N1:
+            length = op if op <= RS_OP_LITERAL_64 else read_int(_INT_WIDTHS[op - RS_OP_LITERAL_N1])
+            while length > 0:
+                data = read_exactly(delta_fd, min(length, DELTA_READ_SIZE))
+                if not data:
+                    raise DeltaException('Truncated delta')
+                out_fd.write(data)
+                length -= len(data)
+                written += len(data)
+        elif op <= RS_OP_COPY_N8_N8:
+            k = op - RS_OP_COPY_N1_N1
+            offset = read_int(_INT_WIDTHS[k // 4])
+            length = read_int(_INT_WIDTHS[k % 4])
+            basis_fd.seek(offset)
+            while length > 0:
+                data = basis_fd.read(min(length, DELTA_READ_SIZE))
+                if not data:
+                    raise DeltaException('Copy beyond the end of the basis file')
+                out_fd.write(data)
+                length -= len(data)
+                written += len(data)
+        else:
+            raise DeltaException('Unknown delta command %#x' % op)
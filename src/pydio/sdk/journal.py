@@ -0,0 +1,86 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import sqlite3
+import logging
+
+# -*- coding: utf-8 -*-
+
+
+class UploadJournal(object):
+
+    def __init__(self, db_file):
+        """
+        Keep track of the parts of chunked uploads acknowledged by the server, so that an interrupted upload can
+        be resumed from its last part without hashing the local file nor the .dlpart, even after a restart.
+        Entries are only valid for the exact local file (size and mtime) and part size they were recorded with.
+        A connection is opened per call, as uploads run in various threads.
+        :param db_file: str path to the sqlite file, in the job data folder
+        :return:
+        """
+        self.db = db_file
+        conn = sqlite3.connect(self.db)
+        conn.execute('CREATE TABLE IF NOT EXISTS upload_parts (path TEXT, local_size INTEGER, local_mtime REAL, '
+                     'part_size INTEGER, part INTEGER, offset INTEGER, size INTEGER, md5 TEXT, '
+                     'PRIMARY KEY (path, part))')
+        conn.commit()
+        conn.close()
+
+    def get_parts(self, path, local_size, local_mtime, part_size):
+        """
+        Parts already stored on the server for this upload. Entries recorded for another version of the file are
+        dropped.
+        :param path: str path of the .dlpart on the server
+        :param local_size: int size of the local file
+        :param local_mtime: float mtime of the local file
+        :param part_size: int size of the parts
+        :return: list of dict() {part, offset, size, md5}, contiguous from the first part
+        """
+        conn = sqlite3.connect(self.db)
+        rows = conn.execute('SELECT local_size, local_mtime, part_size, part, offset, size, md5 FROM upload_parts '
+                            'WHERE path=? ORDER BY part', (path,)).fetchall()
+        conn.close()
+        parts = []
+        for row in rows:
+            if row[0:3] != (local_size, local_mtime, part_size) or row[3] != len(parts):
+                logging.info('Upload journal of %s does not match the local file anymore' % path)
+                self.clear(path)
+                return []
+            parts.append({'part': row[3], 'offset': row[4], 'size': row[5], 'md5': row[6]})
+        return parts
+
+    def add_part(self, path, local_size, local_mtime, part_size, part, offset, size, md5):
+        conn = sqlite3.connect(self.db)
+        conn.execute('INSERT OR REPLACE INTO upload_parts (path, local_size, local_mtime, part_size, part, offset, '
+                     'size, md5) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     (path, local_size, local_mtime, part_size, part, offset, size, md5))
+        conn.commit()
+        conn.close()
+
+    def has_parts(self, path):
+        conn = sqlite3.connect(self.db)
+        row = conn.execute('SELECT COUNT(*) FROM upload_parts WHERE path=?', (path,)).fetchone()
+        conn.close()
+        return row[0] > 0
+
+    def clear(self, path):
+        conn = sqlite3.connect(self.db)
+        conn.execute('DELETE FROM upload_parts WHERE path=?', (path,))
+        conn.commit()
+        conn.close()
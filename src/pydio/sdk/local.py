@@ -24,7 +24,10 @@ import stat
 from exceptions import SystemSdkException
 from pydio.utils.functions import hashfile
 from pydio.utils.global_config import ConfigManager
+from pydio.sdk import delta
 import shutil
+import platform
+import time
 from pydio.utils import i18n
 _ = i18n.language.ugettext
 
@@ -42,6 +45,10 @@ class SystemSdk(object):
         self.path_extension = '.sync_patched'
         self.basepath = basepath
         self.rdiff_path = ConfigManager.Instance().get_rdiff_path()
+        # Files up to this size use the in-process delta engine, bigger ones the rdiff binary (if any)
+        self.builtin_delta_max_size = 64 * 1024 * 1024
+        # Bytes/s processed when computing a signature or a delta, refined after each computation
+        self.delta_rates = {'builtin': 2 * 1024 * 1024, 'rdiff': 40 * 1024 * 1024}
 
     def check_basepath(self):
         """
@@ -105,17 +112,97 @@ class SystemSdk(object):
         except OSError as e:
             raise SystemSdkException('delete', path, _('Cannot remove local folder'))
 
+    def is_delta_supported(self, file_path):
+        """
+        Whether a delta transfer can be attempted for this file, with the in-process engine or with rdiff
+        :param file_path: absolute path of the local file
+        :return: bool
+        """
+        return bool(self.rdiff_path) or self.use_builtin_delta(file_path)
+
+    def use_builtin_delta(self, file_path):
+        """
+        The in-process engine avoids spawning rdiff and the temporary delta file, but is written in python:
+        the rdiff binary is faster on big files.
+        :param file_path: absolute path of the local file
+        :return: bool
+        """
+        try:
+            size = os.path.getsize(os.path.join(self.basepath, file_path.strip("\\")))
+        except OSError:
+            return False
+        return size <= self.builtin_delta_max_size or not self.rdiff_path
+
+    def delta_rate(self, file_path):
+        """
+        Expected speed of the signature or delta computation for this file
+        :param file_path: absolute path of the local file
+        :return: float bytes per second
+        """
+        return self.delta_rates['builtin' if self.use_builtin_delta(file_path) else 'rdiff']
+
+    def record_delta_rate(self, engine, file_path, start):
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return
+        duration = time.time() - start
+        if size < 1024 * 1024 or duration <= 0:
+            return
+        self.delta_rates[engine] = 0.5 * self.delta_rates[engine] + 0.5 * size / duration
+
     def rsync_signature(self, file_path, signature_path):
+        file_path = os.path.join(self.basepath, file_path.strip("\\"))
+        signature_path = os.path.join(self.basepath, signature_path.strip("\\"))
+        if self.use_builtin_delta(file_path):
+            with open(signature_path, 'wb') as sig:
+                self.rsync_signature_stream(file_path, sig)
+            return
+        start = time.time()
         if not self.rdiff_path:
             return
-        subprocess.check_call([self.rdiff_path, 'signature', os.path.join(self.basepath, file_path.strip("\\")), os.path.join(self.basepath, signature_path.strip("\\"))])
+        subprocess.check_call([self.rdiff_path, 'signature', file_path, signature_path])
+        self.record_delta_rate('rdiff', file_path, start)
+
+    def rsync_signature_stream(self, file_path, sig_fd):
+        """
+        Compute the signature of a local file with the in-process engine, into a file-like object
+        :param file_path: absolute path of the local file
+        :param sig_fd: file-like object with write()
+        :return:
+        """
+        start = time.time()
+        with open(file_path, 'rb') as basis:
+            delta.signature(basis, sig_fd)
+        self.record_delta_rate('builtin', file_path, start)
 
     def rsync_delta(self, file_path, signature_path, delta_path):
+        if self.use_builtin_delta(file_path):
+            with open(signature_path, 'rb') as sig, open(delta_path, 'wb') as delta_fd:
+                self.rsync_delta_from_signature(file_path, delta.load_signature(sig), delta_fd)
+            return
         if not self.rdiff_path:
             return
         subprocess.check_call([self.rdiff_path, 'delta', signature_path, file_path, delta_path])
 
+    def rsync_delta_from_signature(self, file_path, signature, delta_fd):
+        """
+        Compute the delta of a local file against an already loaded signature (see PydioSdk.rsync_signature_stream)
+        :param file_path: absolute path of the local file
+        :param signature: pydio.sdk.delta.Signature
+        :param delta_fd: file-like object with write(), receiving the delta
+        :return:
+        """
+        start = time.time()
+        with open(file_path, 'rb') as new:
+            delta.delta(signature, new, delta_fd)
+        self.record_delta_rate('builtin', file_path, start)
+
     def rsync_patch(self, file_path, delta_path, output_path=''):
+        if self.use_builtin_delta(file_path):
+            with open(delta_path, 'rb') as delta_stream:
+                self.rsync_patch_stream(file_path, delta_stream)
+            return
         if not self.rdiff_path:
             return
         if not output_path:
@@ -123,4 +210,24 @@ class SystemSdk(object):
         subprocess.check_call([self.rdiff_path, 'patch', file_path, delta_path, output_path])
         if os.path.exists(output_path) and os.path.getsize(output_path):
             os.unlink(file_path)
-            os.rename(output_path, file_path)
\ No newline at end of file
+            os.rename(output_path, file_path)
+
+    def rsync_patch_stream(self, file_path, delta_stream):
+        """
+        Apply a delta to a local file while it is read (e.g. from the server response), without a delta file.
+        The result is written next to the file under a hidden name and replaces it once complete.
+        :param file_path: absolute path of the local file
+        :param delta_stream: file-like object with read()
+        :return:
+        """
+        output_path = os.path.join(os.path.dirname(file_path), '.' + os.path.basename(file_path) + '.patched')
+        try:
+            with open(file_path, 'rb') as basis, open(output_path, 'wb') as out:
+                delta.patch(basis, delta_stream, out)
+        except Exception:
+            if os.path.exists(output_path):
+                os.unlink(output_path)
+            raise
+        if platform.system().lower().startswith('win') and os.path.exists(file_path):
+            os.unlink(file_path)
+        os.rename(output_path, file_path)
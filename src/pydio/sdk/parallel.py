@@ -0,0 +1,188 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import logging
+import sys
+import threading
+import Queue
+
+# -*- coding: utf-8 -*-
+
+ASYNC_SDK_MAX_WORKERS = 4
+
+
+class SdkTask(object):
+
+    def __init__(self, method, args, kwargs):
+        """
+        A call to a PydioSdk method, executed by an AsyncPydioSdk worker.
+        :param method: str name of the PydioSdk method
+        :param args: tuple positional arguments
+        :param kwargs: dict keyword arguments
+        :return:
+        """
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def run(self, sdk):
+        try:
+            self._result = getattr(sdk, self.method)(*self.args, **self.kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        """
+        Wait for the call to finish and return its result. Exceptions raised by the sdk are raised again here.
+        :param timeout: float max seconds to wait, None to wait forever
+        :return: result of the sdk method
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('Task %s still running' % self.method)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class AsyncPydioSdk(object):
+
+    METADATA_OPERATIONS = ('stat', 'mkdir', 'mkfile', 'delete', 'rename')
+
+    def __init__(self, sdk, max_workers=ASYNC_SDK_MAX_WORKERS):
+        """
+        Run PydioSdk metadata operations with a bounded number of requests in flight. Workers all use the same
+        PydioSdk, hence the same keep-alive connection pool and tokens.
+
+        The async API (stat_async, mkdir_async, ... or submit) returns SdkTask objects. The blocking metadata
+        operations (stat, mkdir, ...) return the result of a call started beforehand with prefetch(), if any, and
+        call the sdk otherwise. Any other attribute is delegated to the wrapped sdk, so an AsyncPydioSdk can be
+        passed wherever a blocking PydioSdk is expected (e.g. ChangeProcessor): the caller prefetches a batch of
+        calls, which then run concurrently while the processing code keeps its sequential logic. run_all() gives a
+        blocking facade over a batch of calls.
+
+        :param sdk: pydio.sdk.remote.PydioSdk
+        :param max_workers: int number of concurrent requests
+        :return:
+        """
+        self.sdk = sdk
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        # (method, args) => SdkTask started by prefetch()
+        self._prefetched = {}
+
+    def __getattr__(self, name):
+        if name.endswith('_async') and name[:-len('_async')] in self.METADATA_OPERATIONS:
+            method = name[:-len('_async')]
+            return lambda *args, **kwargs: self.submit(method, *args, **kwargs)
+        if name in self.METADATA_OPERATIONS:
+            return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+        return getattr(self.sdk, name)
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work, name='PydioSdkWorker-%i' % len(self._workers))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            task.run(self.sdk)
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Queue a call to a sdk method
+        :param method: str name of the PydioSdk method
+        :return: SdkTask
+        """
+        if not self._workers:
+            self._start_workers()
+        task = SdkTask(method, args, kwargs)
+        self._queue.put(task)
+        return task
+
+    def prefetch(self, method, *args):
+        """
+        Start a call now: the next blocking call of the same method with the same arguments waits for it and returns
+        its result (or raises its exception) instead of sending a new request.
+        :param method: str name of the PydioSdk method, one of METADATA_OPERATIONS
+        :return: SdkTask
+        """
+        task = self.submit(method, *args)
+        with self._lock:
+            self._prefetched[(method, args)] = task
+        return task
+
+    def call(self, method, *args, **kwargs):
+        """
+        Blocking call of a sdk method, answered by a prefetched task if there is one
+        :param method: str name of the PydioSdk method
+        :return: result of the sdk method
+        """
+        task = None
+        if not kwargs:
+            with self._lock:
+                task = self._prefetched.pop((method, args), None)
+        if task:
+            return task.result()
+        return getattr(self.sdk, method)(*args, **kwargs)
+
+    def discard_prefetched(self):
+        """
+        Forget the prefetched calls that were not used, once they are finished
+        :return: int number of calls discarded
+        """
+        with self._lock:
+            tasks, self._prefetched = self._prefetched.values(), {}
+        for task in tasks:
+            task.wait()
+        return len(tasks)
+
+    def run_all(self, method, args_list):
+        """
+        Blocking facade: run the same operation on many arguments concurrently and wait for all results.
+        :param method: str name of the PydioSdk method
+        :param args_list: list of tuples of positional arguments
+        :return: list of results, in the same order as args_list. First exception encountered is raised.
+        """
+        tasks = [self.submit(method, *args) for args in args_list]
+        return [task.result() for task in tasks]
+
+    def shutdown(self):
+        with self._lock:
+            for worker in self._workers:
+                self._queue.put(None)
+            self._workers = []
+        logging.debug('AsyncPydioSdk workers stopped')
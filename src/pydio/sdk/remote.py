@@ -20,24 +20,30 @@
 
 import urllib
 import json
-import hmac
-import random
+try:
+    from ujson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 import unicodedata
 import platform
+import stat
 from pydio.utils.functions import hashfile
-from hashlib import sha256
-from hashlib import sha1
-from urlparse import urlparse
 
 
-from requests.exceptions import ConnectionError, RequestException
+from collections import deque
+from contextlib import contextmanager
+from requests.exceptions import ConnectionError, RequestException, Timeout
 import keyring
 from keyring.errors import PasswordSetError
 import xml.etree.ElementTree as ET
 
 from exceptions import PydioSdkException, PydioSdkBasicAuthException, PydioSdkTokenAuthException, \
-    PydioSdkQuotaException, PydioSdkPermissionException, PydioSdkTokenAuthNotSupportedException
+    PydioSdkQuotaException, PydioSdkPermissionException, PydioSdkTokenAuthNotSupportedException, InterruptException
 from .utils import *
+from .auth import TokenAuthProvider
+from .parallel import AsyncPydioSdk
+from .cache import RemotePathCache
+from .delta import load_signature
 from pydio import TRANSFER_RATE_SIGNAL, TRANSFER_CALLBACK_SIGNAL
 from pydio.utils import i18n
 _ = i18n.language.ugettext
@@ -45,12 +51,22 @@ _ = i18n.language.ugettext
 # -*- coding: utf-8 -*-
 
 PYDIO_SDK_MAX_UPLOAD_PIECES = 40 * 1024 * 1024
+PYDIO_SDK_POOL_SIZE = 10
+# Bulk stat slices: bounds of the number of nodes per POST, and target duration of one POST (seconds)
+STAT_SLICE_MIN = 10
+STAT_SLICE_MAX = 2000
+STAT_SLICE_FAST = 2
+STAT_SLICE_SLOW = 8
+PYDIO_SDK_SEGMENTED_DOWNLOAD_MIN = 32 * 1024 * 1024
+PYDIO_SDK_DOWNLOAD_SEGMENTS = 4
+# Number of recent requests whose fastest answer gives the round trip time
+RTT_SAMPLES = 20
 
 
 class PydioSdk():
 
     def __init__(self, url='', ws_id='', remote_folder='', user_id='', auth=(), device_id='python_client',
-                 skip_ssl_verify=False, proxies=None):
+                 skip_ssl_verify=False, proxies=None, pool_size=PYDIO_SDK_POOL_SIZE, session=None):
         self.ws_id = ws_id
         self.device_id = device_id
         self.verify_ssl = not skip_ssl_verify
@@ -66,14 +82,87 @@ class PydioSdk():
         self.upload_max_size = PYDIO_SDK_MAX_UPLOAD_PIECES
         self.rsync_server_support = False
         self.stat_slice_number = 200
+        self.stat_slice_workers = 4
+        self._stat_workers = None
         self.stick_to_basic = False
+        self.download_segments = PYDIO_SDK_DOWNLOAD_SEGMENTS
+        self.segmented_download_min = PYDIO_SDK_SEGMENTED_DOWNLOAD_MIN
+        self.download_verify_hash = True
+        self.range_download_support = True
+        self.io_chunk_size = PYDIO_SDK_IO_CHUNK_SIZE
+        self.progress_delay = PROGRESS_SIGNAL_DELAY
+        self.upload_part_retries = 3
+        self.upload_prefetch = True
+        self.upload_journal = None
+        # Trust the stats given by the callers and the upload responses instead of stating again
+        self.verified_transfers = True
+        # Remote folders and stats already known, reset at each sync cycle
+        self.remote_cache = RemotePathCache()
+        # Requests round trip time, in seconds (-1 until measured), see record_rtt()
+        self.rtt = -1
+        self._rtt_samples = deque(maxlen=RTT_SAMPLES)
         if user_id:
             self.auth = (user_id, keyring.get_password(url, user_id))
         else:
             self.auth = auth
-        self.tokens = None
+        self.auth_provider = TokenAuthProvider(self.load_tokens, self.basic_authenticate, self.set_tokens)
         self.rsync_supported = False
         self.proxies = proxies
+        # One keep-alive connection pool shared by all the requests (and threads) of this sdk, or by all the sdks
+        # connected to the same server when a session is given (see pydio.job.resources.ResourceManager)
+        self.session = session if session is not None else build_pooled_session(pool_size)
+        # Optional bandwidth budget, object with a consume(nbytes, direction, interrupted) method (see JobResources)
+        self.resources = None
+        # Set to True to log and accumulate wire vs. decoded bytes of changes, listings and stats responses
+        self.measure_transfers = False
+        self.transfer_stats = dict()
+
+    def throttle(self, nbytes, direction):
+        """
+        Apply the bandwidth budget, if any, to a block of transferred data. The waiting is aborted with an
+        InterruptException when the tasks are interrupted.
+        :param nbytes: int size of the block
+        :param direction: 'up' or 'down'
+        :return:
+        """
+        if self.resources:
+            self.resources.consume(nbytes, direction, interrupted=lambda: self.interrupt_tasks)
+
+    def throttle_upload(self, nbytes):
+        self.throttle(nbytes, 'up')
+
+    def get_cache_stats(self):
+        """
+        Hit-rate of the remote path cache during the current cycle
+        :return: dict() {hits, misses, hit_rate, entries}
+        """
+        return self.remote_cache.get_stats()
+
+    def get_connection_stats(self):
+        """
+        Compare the number of http requests issued with the number of connections really opened.
+        :return: dict() {'requests': int, 'connections': int}
+        """
+        return self.session.get_adapter(self.base_url).get_stats()
+
+    def record_transfer(self, operation, resp, decoded_bytes):
+        """
+        In measure_transfers mode, compare the bytes received on the wire (possibly gzip/deflate compressed)
+        with the size of the decoded content.
+        :param operation: str name of the sdk operation
+        :param resp: requests.Response, its content must have been fully read
+        :param decoded_bytes: int size of the decoded content
+        :return:
+        """
+        if not self.measure_transfers:
+            return
+        wire_bytes = resp.raw.tell()
+        logging.info('[%s] %i bytes received (%s) for %i decoded bytes' % (
+            operation, wire_bytes, resp.headers.get('content-encoding', 'identity'), decoded_bytes))
+        stats = self.transfer_stats.setdefault(operation, {'calls': 0, 'wire_bytes': 0, 'decoded_bytes': 0})
+        stats['calls'] += 1
+        stats['wire_bytes'] += wire_bytes
+        stats['decoded_bytes'] += decoded_bytes
 
     def set_server_configs(self, configs):
         """
@@ -132,28 +221,33 @@ class PydioSdk():
             return unicode_path
 
     def set_tokens(self, tokens):
-        self.tokens = tokens
         try:
-            keyring.set_password(self.url, self.user_id + '-token', tokens['t'] + ':' + tokens['p'])
+            keyring.set_password(self.url, self.user_id + '-token',
+                                 tokens['t'] + ':' + tokens['p'] + ':' + str(int(tokens.get('i', 0))))
         except PasswordSetError:
             logging.error(_("Cannot store tokens in keychain, there might be an OS permission issue!"))
 
+    def load_tokens(self):
+        k_tok = keyring.get_password(self.url, self.user_id + '-token')
+        if k_tok:
+            parts = k_tok.split(':')
+            tokens = {'t': parts[0], 'p': parts[1]}
+            if len(parts) > 2:
+                tokens['i'] = parts[2]
+            return tokens
+        return None
+
     def get_tokens(self):
-        if not self.tokens:
-            k_tok = keyring.get_password(self.url, self.user_id + '-token')
-            if k_tok:
-                parts = k_tok.split(':')
-                self.tokens = {'t': parts[0], 'p': parts[1]}
-        return self.tokens
+        return self.auth_provider.get_tokens()
 
     def basic_authenticate(self):
         """
         Use basic-http authenticate to get a key/pair token instead of passing the
-        users credentials at each requests
+        users credentials at each requests. Tokens are stored by the auth_provider.
         :return:dict()
         """
         url = self.base_url + 'pydio/keystore_generate_auth_token/' + self.device_id
-        resp = requests.get(url=url, auth=self.auth, verify=self.verify_ssl, proxies=self.proxies)
+        resp = self.session.get(url=url, auth=self.auth, verify=self.verify_ssl, proxies=self.proxies)
         if resp.status_code == 401:
             raise PydioSdkBasicAuthException(_('Authentication Error'))
 
@@ -168,7 +262,6 @@ class PydioSdk():
             raise PydioSdkException("basic_auth", "", "Cannot parse JSON result: " + resp.content + "")
             #return False
 
-        self.set_tokens(tokens)
         return tokens
 
     def perform_basic(self, url, request_type='get', data=None, files=None, headers=None, stream=False, with_progress=False):
@@ -184,8 +277,8 @@ class PydioSdk():
         """
         if request_type == 'get':
             try:
-                resp = requests.get(url=url, stream=stream, timeout=20, verify=self.verify_ssl, headers=headers,
-                                    auth=self.auth, proxies=self.proxies)
+                resp = self.session.get(url=url, stream=stream, timeout=20, verify=self.verify_ssl, headers=headers,
+                                        auth=self.auth, proxies=self.proxies)
             except ConnectionError as e:
                 raise
 
@@ -196,7 +289,7 @@ class PydioSdk():
                 resp = self.upload_file_with_progress(url, dict(**data), files, stream, with_progress,
                                                       max_size=self.upload_max_size, auth=self.auth)
             else:
-                resp = requests.post(
+                resp = self.session.post(
                     url=url,
                     data=data,
                     stream=stream,
@@ -208,11 +301,28 @@ class PydioSdk():
         else:
             raise PydioSdkTokenAuthException(_("Unsupported HTTP method"))
 
+        if not files:
+            self.record_rtt(resp)
         if resp.status_code == 401:
             raise PydioSdkTokenAuthException(_("Authentication Exception"))
         return resp
 
 
+    def record_rtt(self, resp):
+        """
+        Estimate the cost of one round trip to the server (latency + server processing) from the time needed to get
+        the response headers of requests without upload. Heavy requests (bulk stats with hashes, changes feed) take
+        much longer than a round trip, so the minimum of the last RTT_SAMPLES requests is kept instead of an average.
+        :param resp: Http response
+        :return:
+        """
+        try:
+            elapsed = resp.elapsed.total_seconds()
+        except AttributeError:
+            return
+        self._rtt_samples.append(elapsed)
+        self.rtt = min(self._rtt_samples)
+
     def perform_with_tokens(self, token, private, url, request_type='get', data=None, files=None, headers=None, stream=False,
                             with_progress=False):
         """
@@ -228,11 +338,7 @@ class PydioSdk():
         :param with_progress: dict an object that can be updated with various progress data
         :return: Http response
         """
-        nonce = sha1(str(random.random())).hexdigest()
-        uri = urlparse(url).path.rstrip('/')
-        msg = uri + ':' + nonce + ':' + private
-        the_hash = hmac.new(str(token), str(msg), sha256)
-        auth_hash = nonce + ':' + the_hash.hexdigest()
+        auth_hash = self.auth_provider.sign(token, private, url)
 
         if request_type == 'get':
             auth_string = 'auth_token=' + token + '&auth_hash=' + auth_hash
@@ -241,8 +347,8 @@ class PydioSdk():
             else:
                 url += '?' + auth_string
             try:
-                resp = requests.get(url=url, stream=stream, timeout=20, verify=self.verify_ssl,
-                                    headers=headers, proxies=self.proxies)
+                resp = self.session.get(url=url, stream=stream, timeout=20, verify=self.verify_ssl,
+                                        headers=headers, proxies=self.proxies)
             except ConnectionError as e:
                 raise
 
@@ -255,7 +361,7 @@ class PydioSdk():
                 resp = self.upload_file_with_progress(url, dict(**data), files, stream, with_progress,
                                                  max_size=self.upload_max_size)
             else:
-                resp = requests.post(
+                resp = self.session.post(
                     url=url,
                     data=data,
                     stream=stream,
@@ -266,6 +372,8 @@ class PydioSdk():
         else:
             raise PydioSdkTokenAuthException(_("Unsupported HTTP method"))
 
+        if not files:
+            self.record_rtt(resp)
         if resp.status_code == 401:
             raise PydioSdkTokenAuthException(_("Authentication Exception"))
         return resp
@@ -291,43 +399,36 @@ class PydioSdk():
             return self.perform_basic(url, request_type=type, data=data, files=files, headers=headers, stream=stream,
                                           with_progress=with_progress)
 
-        tokens = self.get_tokens()
-        if not tokens:
+        try:
+            tokens = self.get_tokens()
+        except PydioSdkTokenAuthNotSupportedException:
+            logging.info('Switching to permanent basic auth, as tokens were not correctly received. This is not '
+                         'good for performances, but might be necessary for session credential based setups.')
+            self.stick_to_basic = True
+            return self.perform_basic(url, request_type=type, data=data, files=files, headers=headers, stream=stream,
+                                      with_progress=with_progress)
+        try:
+            return self.perform_with_tokens(tokens['t'], tokens['p'], url, type, data, files, headers=headers,
+                                            stream=stream, with_progress=with_progress)
+        except requests.exceptions.ConnectionError:
+            raise
+        except PydioSdkTokenAuthException as pTok:
+            # Tokens may be revoked? Retry with new ones, possibly already renewed by another request
             try:
-                tokens = self.basic_authenticate()
-            except PydioSdkTokenAuthNotSupportedException as pne:
+                tokens = self.auth_provider.refresh(failed_tokens=tokens)
+            except PydioSdkTokenAuthNotSupportedException:
+                self.stick_to_basic = True
                 logging.info('Switching to permanent basic auth, as tokens were not correctly received. This is not '
                              'good for performances, but might be necessary for session credential based setups.')
-                self.stick_to_basic = True
                 return self.perform_basic(url, request_type=type, data=data, files=files, headers=headers, stream=stream,
                                           with_progress=with_progress)
 
-            return self.perform_with_tokens(tokens['t'], tokens['p'], url, type, data, files,
-                                            headers=headers, stream=stream)
-        else:
             try:
-                resp = self.perform_with_tokens(tokens['t'], tokens['p'], url, type, data, files, headers=headers,
-                                                stream=stream, with_progress=with_progress)
-                return resp
-            except requests.exceptions.ConnectionError:
-                raise
-            except PydioSdkTokenAuthException as pTok:
-                # Tokens may be revoked? Retry
-                try:
-                    tokens = self.basic_authenticate()
-                except PydioSdkTokenAuthNotSupportedException:
-                    self.stick_to_basic = True
-                    logging.info('Switching to permanent basic auth, as tokens were not correctly received. This is not '
-                                 'good for performances, but might be necessary for session credential based setups.')
-                    return self.perform_basic(url, request_type=type, data=data, files=files, headers=headers, stream=stream,
-                                              with_progress=with_progress)
-
-                try:
-                    return self.perform_with_tokens(tokens['t'], tokens['p'], url, type, data, files,
-                                                    headers=headers, stream=stream, with_progress=with_progress)
-                except PydioSdkTokenAuthException as secTok:
-                    logging.error('Second Auth Error, what is wrong?')
-                    raise secTok
+                return self.perform_with_tokens(tokens['t'], tokens['p'], url, type, data, files,
+                                                headers=headers, stream=stream, with_progress=with_progress)
+            except PydioSdkTokenAuthException as secTok:
+                logging.error('Second Auth Error, what is wrong?')
+                raise secTok
 
     def changes(self, last_seq):
         """
@@ -348,15 +449,69 @@ class PydioSdk():
         except ValueError as v:
             raise Exception(_("Invalid JSON value received while getting remote changes. Is the server correctly configured?"))
 
-    def changes_stream(self, last_seq, callback):
+    def cache_stat(self, path, stat_result):
+        """
+        Remember a stat result received from the server, and the folder if it is one
+        :param path: node path
+        :param stat_result: dict()
+        :return:
+        """
+        self.remote_cache.add_stat(path, stat_result)
+        if 'mode' in stat_result:
+            try:
+                if stat.S_ISDIR(int(stat_result['mode'])):
+                    self.remote_cache.add_dir(path)
+            except (TypeError, ValueError):
+                pass
+
+    def cache_change(self, change):
+        """
+        Keep the remote cache consistent with a change received from the server
+        :param change: dict() node merged with the change keys (type, source, target, md5...)
+        :return:
+        """
+        if change.get('source') and change['source'] != 'NULL':
+            self.remote_cache.invalidate(change['source'])
+        if change.get('target') and change['target'] != 'NULL':
+            if change.get('md5') == 'directory':
+                self.remote_cache.add_dir(change['target'])
+            else:
+                self.remote_cache.invalidate(change['target'])
+
+    def peek_changes(self, last_seq):
+        """
+        Cheap check of the remote changes: only the first line of the changes stream is read.
+        :param last_seq: int sequence of the last changes loaded
+        :return: int the last remote sequence if there is no change since last_seq, None if there are changes
+        """
+        url = self.url + '/changes/' + str(last_seq) + '/?stream=true'
+        if self.remote_folder:
+            url += '&filter=' + self.remote_folder
+        url += '&flatten=false'
+        resp = self.perform_request(url=url, stream=True)
+        try:
+            for line in iter_stream_lines(resp):
+                if not line:
+                    continue
+                if line.startswith('LAST_SEQ'):
+                    return int(line.split(':')[1])
+                return None
+        finally:
+            resp.close()
+        return None
+
+    def changes_stream(self, last_seq, callback, flatten=None):
         """
         Get the list of changes detected on server since a given sequence number
 
         :param last_seq:int
         :change_store: AbstractChangeStore
+        :param flatten: bool ask server to flatten changes, by default only when starting from 0
         :return:list a list of changes
         """
-        if last_seq == 0:
+        if flatten is None:
+            flatten = (last_seq == 0)
+        if flatten:
             perform_flattening = "true"
         else:
             perform_flattening = "false"
@@ -368,18 +523,22 @@ class PydioSdk():
         resp = self.perform_request(url=url, stream=True)
         info = dict()
         info['max_seq'] = last_seq
-        for line in resp.iter_lines(chunk_size=512):
+        read_stats = dict()
+        for line in iter_stream_lines(resp, stats=read_stats):
             if line:
-                if str(line).startswith('LAST_SEQ'):
+                if line.startswith('LAST_SEQ'):
                     #call the merge function with NULL row
                     callback('remote', None, info)
+                    self.record_transfer('changes_stream', resp, read_stats.get('decoded_bytes', 0))
                     return int(line.split(':')[1])
                 else:
                     try:
-                        one_change = json.loads(line)
+                        one_change = json_loads(line)
+                        # Merge change keys into the node dict instead of copying both
                         node = one_change.pop('node')
-                        one_change = dict(node.items() + one_change.items())
-                        callback('remote', one_change, info)
+                        node.update(one_change)
+                        self.cache_change(node)
+                        callback('remote', node, info)
 
                     except ValueError as v:
                         logging.error('Invalid JSON Response, line was ' + line)
@@ -412,6 +571,11 @@ class PydioSdk():
         if self.interrupt_tasks:
             raise PydioSdkException("stat", path=path, detail=_('Task interrupted by user'))
 
+        if not partial_hash:
+            cached = self.remote_cache.get_stat(path, with_hash)
+            if cached:
+                return cached
+        node_path = path
         path = self.remote_folder + path
         action = '/stat_hash' if with_hash else '/stat'
         try:
@@ -430,6 +594,8 @@ class PydioSdk():
             if not data:
                 return False
             if len(data) > 0 and 'size' in data:
+                if not partial_hash:
+                    self.cache_stat(node_path, data)
                 return data
             else:
                 return False
@@ -442,8 +608,9 @@ class PydioSdk():
     def bulk_stat(self, pathes, result=None, with_hash=False):
         """
         Perform a stat operation (see self.stat()) but on a set of nodes. Very important to use that method instead
-        of sending tons of small stat requests to server. To keep POST content reasonable, pathes will be sent 200 by
-        200.
+        of sending tons of small stat requests to server. To keep POST content reasonable, pathes are sent by slices
+        of stat_slice_number nodes, stat_slice_workers slices at a time. The slice size grows or shrinks depending
+        on the time the server takes to answer.
 
         :param pathes: list() of node pathes
         :param result: dict() an accumulator for the results
@@ -453,26 +620,81 @@ class PydioSdk():
         if self.interrupt_tasks:
             raise PydioSdkException("stat", path=pathes[0], detail=_('Task interrupted by user'))
 
-        from requests.exceptions import Timeout
         # NORMALIZE PATHES FROM START
-        pathes = map(lambda p: self.normalize(p), pathes)
+        remaining = deque(filter(lambda x: x != '', map(lambda p: self.normalize(p), pathes)))
+        if result:
+            replaced = result
+        else:
+            replaced = dict()
+        if not self._stat_workers:
+            self._stat_workers = AsyncPydioSdk(self, max_workers=self.stat_slice_workers)
+
+        while len(remaining):
+            if self.interrupt_tasks:
+                raise PydioSdkException("stat", path=remaining[0], detail=_('Task interrupted by user'))
+            slice_size = self.stat_slice_number
+            slices = []
+            while len(remaining) and len(slices) < self.stat_slice_workers:
+                slices.append([remaining.popleft() for i in range(min(slice_size, len(remaining)))])
+            tasks = [self._stat_workers.submit('bulk_stat_slice', s, with_hash) for s in slices]
+
+            for (slice_pathes, task) in zip(slices, tasks):
+                try:
+                    data, duration = task.result()
+                except Timeout:
+                    if self.stat_slice_number < 20:
+                        raise
+                    if self.stat_slice_number == slice_size:
+                        self.stat_slice_number = int(math.floor(slice_size / 2))
+                        logging.info('Reduce bulk stat slice number to %d', self.stat_slice_number)
+                    remaining.extendleft(reversed(slice_pathes))
+                    continue
+                self.adapt_stat_slice_number(slice_size, len(slice_pathes), duration)
+
+                left = self.match_bulk_stat_results(slice_pathes, data, replaced)
+                if len(left) == len(slice_pathes) and len(left) > 1:
+                    # Nothing matched, stat them one by one
+                    self.bulk_stat_one_by_one(left, replaced, with_hash)
+                else:
+                    remaining.extendleft(reversed(left))
+        return replaced
 
+    def bulk_stat_one_by_one(self, pathes, replaced, with_hash=False):
+        """
+        Stat pathes with one request each, when the server did not send back any of them in a bulk response. As
+        in stat(), a node the server does not know is mapped to False instead of being silently dropped.
+        :param pathes: list() of normalized node pathes
+        :param replaced: dict() results accumulator
+        :param with_hash: bool whether to ask for files hash or not (md5)
+        :return:
+        """
+        for p in pathes:
+            if self.interrupt_tasks:
+                raise PydioSdkException("stat", path=p, detail=_('Task interrupted by user'))
+            data = self.bulk_stat_slice([p], with_hash)[0]
+            stat_result = data.get(self.remote_folder + p)
+            if not isinstance(stat_result, dict) or 'size' not in stat_result:
+                logging.info('bulk_stat: no stat returned by the server for %s' % repr(p))
+                replaced[p] = False
+                continue
+            self.match_bulk_stat_results([p], data, replaced)
+
+    def bulk_stat_slice(self, pathes, with_hash=False):
+        """
+        Send one bulk stat POST
+        :param pathes: list() of normalized node pathes
+        :param with_hash: bool whether to ask for files hash or not (md5)
+        :return: (dict() server response indexed by remote path, float request duration)
+        """
         action = '/stat_hash' if with_hash else '/stat'
+        clean_pathes = map(lambda t: self.remote_folder + t.replace('\\', '/'), pathes)
         data = dict()
-        maxlen = min(len(pathes), self.stat_slice_number)
-        clean_pathes = map(lambda t: self.remote_folder + t.replace('\\', '/'),
-                           filter(lambda x: x != '', pathes[:maxlen]))
         data['nodes[]'] = map(lambda p: self.normalize(p), clean_pathes)
         url = self.url + action + self.urlencode_normalized(clean_pathes[0])
-        try:
-            resp = self.perform_request(url, type='post', data=data)
-        except Timeout:
-            if self.stat_slice_number < 20:
-                raise
-            self.stat_slice_number = int(math.floor(self.stat_slice_number / 2))
-            logging.info('Reduce bulk stat slice number to %d', self.stat_slice_number)
-            return self.bulk_stat(pathes, result=result, with_hash=with_hash)
-
+        before = time.time()
+        resp = self.perform_request(url, type='post', data=data)
+        duration = time.time() - before
+        self.record_transfer('bulk_stat', resp, len(resp.content))
         try:
             data = json.loads(resp.content)
         except ValueError:
@@ -484,38 +706,54 @@ class PydioSdk():
             englob = dict()
             englob[self.remote_folder + pathes[0]] = data
             data = englob
-        if result:
-            replaced = result
-        else:
-            replaced = dict()
+        return data, duration
+
+    def adapt_stat_slice_number(self, slice_size, sent, duration):
+        """
+        Grow the bulk stat slices when the server answers quickly to full slices, shrink them when it is slow.
+        :param slice_size: int slice size used for this request
+        :param sent: int number of nodes really sent
+        :param duration: float duration of the request
+        :return:
+        """
+        if self.stat_slice_number != slice_size:
+            # Already adapted by another slice of the same round
+            return
+        if duration < STAT_SLICE_FAST and sent == slice_size and slice_size < STAT_SLICE_MAX:
+            self.stat_slice_number = min(STAT_SLICE_MAX, int(slice_size * 1.5))
+            logging.debug('Increase bulk stat slice number to %d', self.stat_slice_number)
+        elif duration > STAT_SLICE_SLOW and slice_size > STAT_SLICE_MIN:
+            self.stat_slice_number = max(STAT_SLICE_MIN, slice_size // 2)
+            logging.info('Reduce bulk stat slice number to %d', self.stat_slice_number)
+
+    def match_bulk_stat_results(self, pathes, data, replaced):
+        """
+        Store the stats returned by the server under the path that was asked. Depending on the platforms, the
+        server may send back the path with another normalization, so four variants are looked up.
+        :param pathes: list() of pathes sent
+        :param data: dict() server response
+        :param replaced: dict() results accumulator
+        :return: list() pathes that were not found in the response
+        """
+        pending = set(pathes)
         for (p, stat) in data.items():
             if self.remote_folder:
                 p = p[len(self.remote_folder):]
-                #replaced[os.path.normpath(p)] = stat
             p1 = os.path.normpath(p)
             p2 = os.path.normpath(self.normalize_reverse(p))
             p3 = p
             p4 = self.normalize_reverse(p)
-            if p2 in pathes:
-                replaced[p2] = stat
-                pathes.remove(p2)
-            elif p1 in pathes:
-                replaced[p1] = stat
-                pathes.remove(p1)
-            elif p3 in pathes:
-                replaced[p3] = stat
-                pathes.remove(p3)
-            elif p4 in pathes:
-                replaced[p4] = stat
-                pathes.remove(p4)
+            for variant in (p2, p1, p3, p4):
+                if variant in pending:
+                    replaced[variant] = stat
+                    pending.remove(variant)
+                    self.cache_stat(variant, stat)
+                    break
             else:
-                #pass
                 logging.info('Fatal charset error, cannot find files (%s, %s, %s, %s) in %s' % (repr(p1), repr(p2), repr(p3), repr(p4), repr(pathes),))
                 raise PydioSdkException('bulk_stat', p1, "Encoding problem, failed emptying bulk_stat, "
                                                          "exiting to avoid infinite loop")
-        if len(pathes):
-            self.bulk_stat(pathes, result=replaced, with_hash=with_hash)
-        return replaced
+        return [p for p in pathes if p in pending]
 
     def mkdir(self, path):
         """
@@ -526,6 +764,7 @@ class PydioSdk():
         url = self.url + '/mkdir' + self.urlencode_normalized((self.remote_folder + path))
         resp = self.perform_request(url=url)
         self.is_pydio_error_response(resp)
+        self.remote_cache.add_dir(path)
         return resp.content
 
     def bulk_mkdir(self, pathes):
@@ -540,6 +779,7 @@ class PydioSdk():
         url = self.url + '/mkdir' + self.urlencode_normalized(self.remote_folder + pathes[0])
         resp = self.perform_request(url=url, type='post', data=data)
         self.is_pydio_error_response(resp)
+        self.remote_cache.add_dirs(pathes)
         return resp.content
 
     def mkfile(self, path):
@@ -549,6 +789,7 @@ class PydioSdk():
         :return: result of the server query
         """
         url = self.url + '/mkfile' + self.urlencode_normalized((self.remote_folder + path)) + '?force=true'
+        self.remote_cache.invalidate(path)
         resp = self.perform_request(url=url)
         self.is_pydio_error_response(resp)
         return resp.content
@@ -569,6 +810,8 @@ class PydioSdk():
             data = dict(
                 file=(self.normalize(self.remote_folder + source)).encode('utf-8'),
                 dest=os.path.dirname((self.normalize(self.remote_folder + target).encode('utf-8'))))
+        self.remote_cache.invalidate(source)
+        self.remote_cache.invalidate(target)
         resp = self.perform_request(url=url, type='post', data=data)
         self.is_pydio_error_response(resp)
         return resp.content
@@ -588,6 +831,9 @@ class PydioSdk():
             data['to'] = self.normalize(self.remote_folder + target).encode('utf-8')
         if copy:
             data['copy'] = 'true'
+        for path in (source, target):
+            if path:
+                self.remote_cache.invalidate(path)
         resp = self.perform_request(url=url, type='post', data=data)
         self.is_pydio_error_response(resp)
         return resp.content
@@ -600,6 +846,7 @@ class PydioSdk():
         """
         url = self.url + '/delete' + self.urlencode_normalized((self.remote_folder + path))
         data = dict(file=self.normalize(self.remote_folder + path).encode('utf-8'))
+        self.remote_cache.invalidate(path)
         resp = self.perform_request(url=url, type='post', data=data)
         self.is_pydio_error_response(resp)
         return resp.content
@@ -658,26 +905,34 @@ class PydioSdk():
         existing_part = False
         if (self.upload_max_size - 4096) < local_stat['size']:
             self.has_disk_space_for_upload(path, local_stat['size'])
-            existing_part = self.stat(path+'.dlpart', True)
+            # With a journal of the acknowledged parts, the size of the .dlpart is enough to resume
+            with_hash = not (self.upload_journal and self.upload_journal.has_parts(path + '.dlpart'))
+            existing_part = self.stat(path+'.dlpart', with_hash)
 
         dirpath = os.path.dirname(path)
-        if dirpath and dirpath != '/':
+        if dirpath and dirpath != '/' and not (self.verified_transfers and self.remote_cache.has_dir(dirpath)):
             folder = self.stat(dirpath)
             if not folder:
                 self.mkdir(os.path.dirname(path))
+            else:
+                self.remote_cache.add_dir(dirpath)
         url = self.url + '/upload/put' + self.urlencode_normalized((self.remote_folder + os.path.dirname(path)))
+        self.remote_cache.invalidate(path)
+        self.remote_cache.invalidate(path + '.dlpart')
         files = {
             'userfile_0': local
         }
         if existing_part:
             files['existing_dlpart'] = existing_part
+        if (self.upload_max_size - 4096) < local_stat['size']:
+            files['dlpart_path'] = path + '.dlpart'
         data = {
             'force_post': 'true',
             'xhr_uploader': 'true',
             'urlencoded_filename': self.urlencode_normalized(os.path.basename(path))
         }
         try:
-            self.perform_request(url=url, type='post', data=data, files=files, with_progress=callback_dict)
+            resp = self.perform_request(url=url, type='post', data=data, files=files, with_progress=callback_dict)
         except PydioSdkDefaultException as e:
             if e.message == '507':
                 usage, total = self.quota_usage()
@@ -689,22 +944,62 @@ class PydioSdk():
         except RequestException as ce:
             raise PydioSdkException("upload", path, 'RequestException: ' + ce.message)
 
-        new = self.stat(path)
-        if not new or not (new['size'] == local_stat['size']):
-            raise PydioSdkException('upload', path, _('File is incorrect after upload'))
+        if not (self.verified_transfers and self.uploaded_node_size(resp, path) == local_stat['size']):
+            new = self.stat(path)
+            if not new or not (new['size'] == local_stat['size']):
+                raise PydioSdkException('upload', path, _('File is incorrect after upload'))
+        if self.upload_journal and 'dlpart_path' in files:
+            self.upload_journal.clear(files['dlpart_path'])
         return True
 
-    def download(self, path, local, callback_dict=None):
+    def uploaded_node_size(self, resp, path):
+        """
+        Size of the uploaded file, as reported by the nodes diff of the upload response
+        :param resp: response of the (last) upload request
+        :param path: node path on the server
+        :return: int size, or None if the response does not describe the node
+        """
+        if resp is None or not resp.content:
+            return None
+        try:
+            root = ET.fromstring(resp.content)
+        except ET.ParseError:
+            return None
+        target = self.normalize(self.remote_folder + path)
+        for node in root.iter('tree'):
+            if node.get('filename') and self.normalize(node.get('filename')) == target and node.get('bytesize'):
+                try:
+                    return int(node.get('bytesize'))
+                except ValueError:
+                    return None
+        return None
+
+    def download(self, path, local, callback_dict=None, remote_stat=None):
         """
         Download the content of a server file to a local file.
         :param path: node path on the server
         :param local: local path on filesystem
         :param callback_dict: a dict() than can be updated by with progress data
+        :param remote_stat: dict() {size, mtime, hash} of the node already known by the caller (e.g. from the
+        changes), used instead of a stat request when verified_transfers is set. It may be stale: the node is stated
+        again before a segmented download, and when the downloaded size does not match.
         :return: Server response
         """
-        orig = self.stat(path)
+        trusted_stat = self.verified_transfers and remote_stat and remote_stat.get('size') is not None
+        if trusted_stat:
+            orig = remote_stat
+        else:
+            orig = self.stat(path)
         if not orig:
             raise PydioSdkException('download', path, _('Original file was not found on server'))
+        if trusted_stat and self.range_download_support and self.download_segments > 1 \
+                and orig['size'] >= self.segmented_download_min:
+            # Segments are computed from the size, it must be the current one
+            self.remote_cache.invalidate(path)
+            orig = self.stat(path)
+            trusted_stat = False
+            if not orig:
+                raise PydioSdkException('download', path, _('Original file was not found on server'))
 
         url = self.url + '/download' + self.urlencode_normalized((self.remote_folder + path))
         local_tmp = local + '.pydio_dl'
@@ -713,7 +1008,18 @@ class PydioSdk():
         dl = 0
         if not os.path.exists(os.path.dirname(local)):
             os.makedirs(os.path.dirname(local))
-        elif os.path.exists(local_tmp):
+
+        if self.range_download_support and self.download_segments > 1 \
+                and orig['size'] >= self.segmented_download_min:
+            try:
+                return self.download_segmented(path, local, url, orig, callback_dict=callback_dict)
+            except PydioSdkException as pe:
+                if pe.operation != 'range':
+                    raise pe
+                logging.info('Server does not support range requests, switching to single stream downloads')
+                self.range_download_support = False
+
+        if os.path.exists(local_tmp):
             # A .pydio_dl already exists, maybe it's a chunk of the original?
             # Try to get an md5 of the corresponding chunk
             current_size = os.path.getsize(local_tmp)
@@ -728,42 +1034,50 @@ class PydioSdk():
                     callback_dict['total_bytes_sent'] = float(current_size)
                     callback_dict['total_size'] = float(chunk_remote_stat['size'])
                     callback_dict['transfer_rate'] = 0
-                    dispatcher.send(signal=TRANSFER_CALLBACK_SIGNAL, send=self, change=callback_dict)
+                    dispatcher.send(signal=TRANSFER_CALLBACK_SIGNAL, sender=self, change=callback_dict)
 
             else:
                 os.unlink(local_tmp)
 
         try:
             with open(local_tmp, write_mode) as fd:
-                start = time.clock()
+                start = last_progress = time.time()
+                initial = previous_dl = dl
                 r = self.perform_request(url=url, stream=True, headers=headers)
                 total_length = r.headers.get('content-length')
                 if total_length is None: # no content length header
                     fd.write(r.content)
                 else:
-                    previous_done = 0
-                    for chunk in r.iter_content(1024 * 8):
+                    total_size = float(dl + int(total_length))
+                    for chunk in r.iter_content(self.io_chunk_size):
                         if self.interrupt_tasks:
                             raise PydioSdkException("interrupt", path=path, detail=_('Task interrupted by user'))
+                        self.throttle(len(chunk), 'down')
                         dl += len(chunk)
                         fd.write(chunk)
-                        done = int(50 * dl / int(total_length))
-                        if done != previous_done:
-                            transfer_rate = dl // (time.clock() - start)
-                            logging.debug("\r[%s%s] %s bps" % ('=' * done, ' ' * (50 - done), transfer_rate))
-                            dispatcher.send(signal=TRANSFER_RATE_SIGNAL, send=self, transfer_rate=transfer_rate)
-                            if callback_dict:
-                                callback_dict['bytes_sent'] = float(len(chunk))
-                                callback_dict['total_bytes_sent'] = float(dl)
-                                callback_dict['total_size'] = float(total_length)
-                                callback_dict['transfer_rate'] = transfer_rate
-                                dispatcher.send(signal=TRANSFER_CALLBACK_SIGNAL, send=self, change=callback_dict)
-
-                        previous_done = done
+                        now = time.time()
+                        if now - last_progress < self.progress_delay and dl < total_size:
+                            continue
+                        transfer_rate = (dl - initial) // max(now - start, 0.001)
+                        done = int(50 * dl / total_size)
+                        logging.debug("\r[%s%s] %s bps" % ('=' * done, ' ' * (50 - done), transfer_rate))
+                        dispatcher.send(signal=TRANSFER_RATE_SIGNAL, sender=self, transfer_rate=transfer_rate)
+                        if callback_dict:
+                            callback_dict['bytes_sent'] = float(dl - previous_dl)
+                            callback_dict['total_bytes_sent'] = float(dl)
+                            callback_dict['total_size'] = total_size
+                            callback_dict['transfer_rate'] = transfer_rate
+                            dispatcher.send(signal=TRANSFER_CALLBACK_SIGNAL, sender=self, change=callback_dict)
+                        last_progress = now
+                        previous_dl = dl
             if not os.path.exists(local_tmp):
                 raise PydioSdkException('download', local, _('File not found after download'))
             else:
                 stat_result = os.stat(local_tmp)
+                if not orig['size'] == stat_result.st_size and trusted_stat:
+                    # The node may have changed since the change was recorded
+                    self.remote_cache.invalidate(path)
+                    orig = self.stat(path) or orig
                 if not orig['size'] == stat_result.st_size:
                     os.unlink(local_tmp)
                     raise PydioSdkException('download', path, _('File is not correct after download'))
@@ -782,11 +1096,171 @@ class PydioSdk():
                     os.unlink(local_tmp)
                 raise pe
 
+        except InterruptException:
+            # Interrupted while waiting for the bandwidth budget, keep the partial file like above
+            raise
+
         except Exception as e:
             if os.path.exists(local_tmp):
                 os.unlink(local_tmp)
             raise PydioSdkException('download', path, _('Error while downloading file: %s') % e.message)
 
+    def download_journal_path(self, local):
+        """
+        Hidden file storing the progress of each segment of a segmented download. Its name ends with .pydio_dl, like
+        the temporary file itself, so that it is ignored by the local watcher.
+        :param local: local path on filesystem
+        :return: str
+        """
+        return os.path.join(os.path.dirname(local), '.' + os.path.basename(local) + '.pydio_dl')
+
+    def load_download_journal(self, journal, local_tmp, orig):
+        """
+        Read the segments of a previously interrupted download, if they still apply to the remote file.
+        :param journal: str path of the journal
+        :param local_tmp: str path of the preallocated .pydio_dl file
+        :param orig: dict stat of the remote file
+        :return: list of [start, end, position] or None
+        """
+        if not os.path.exists(journal) or not os.path.exists(local_tmp):
+            return None
+        try:
+            with open(journal, 'rb') as fd:
+                data = json.load(fd)
+        except (IOError, ValueError):
+            return None
+        if data.get('size') != orig['size'] or data.get('mtime') != orig.get('mtime') \
+                or os.path.getsize(local_tmp) != orig['size']:
+            return None
+        return data['segments']
+
+    def save_download_journal(self, journal, orig, segments):
+        with open(journal, 'wb') as fd:
+            json.dump({'size': orig['size'], 'mtime': orig.get('mtime'), 'segments': segments}, fd)
+
+    def download_segment(self, path, url, local_tmp, segment):
+        """
+        Fetch one segment of a segmented download with a Range request and write it at its offset. The position
+        of the segment is updated after each write, so that the caller can follow progress and save it.
+        :param path: node path on the server
+        :param url: str download url
+        :param local_tmp: str path of the preallocated .pydio_dl file
+        :param segment: list [start, end, position], end excluded
+        :return:
+        """
+        start, end, position = segment
+        if position >= end:
+            return
+        r = self.perform_request(url=url, stream=True, headers={'range': 'bytes=%i-%i' % (position, end - 1)})
+        if r.status_code != 206:
+            r.close()
+            raise PydioSdkException('range', path, _('Range requests are not supported'))
+        # Unbuffered: the journal must never claim bytes that are still in a python buffer
+        with open(local_tmp, 'r+b', 0) as fd:
+            fd.seek(position)
+            for chunk in r.iter_content(self.io_chunk_size):
+                if self.interrupt_tasks:
+                    r.close()
+                    raise PydioSdkException("interrupt", path=path, detail=_('Task interrupted by user'))
+                chunk = chunk[:end - position]
+                try:
+                    self.throttle(len(chunk), 'down')
+                except InterruptException:
+                    r.close()
+                    raise
+                fd.write(chunk)
+                position += len(chunk)
+                segment[2] = position
+                if position >= end:
+                    break
+        r.close()
+        if position < end:
+            raise PydioSdkException('download', path, _('Connection closed before the end of the segment'))
+
+    def download_segmented(self, path, local, url, orig, callback_dict=None):
+        """
+        Download a large file with several concurrent Range requests, to get past the throughput of a single TCP
+        stream on high latency links. Each segment is written at its offset in a preallocated .pydio_dl file, and
+        the progress of the segments is saved in a journal so that an interrupted download only fetches what is
+        missing. The result is checked against the remote size, and against the remote md5 if download_verify_hash.
+        :param path: node path on the server
+        :param local: local path on filesystem
+        :param url: str download url
+        :param orig: dict stat of the remote file
+        :param callback_dict: a dict() than can be updated by with progress data
+        :return: True
+        """
+        local_tmp = local + '.pydio_dl'
+        journal = self.download_journal_path(local)
+        size = orig['size']
+        segments = self.load_download_journal(journal, local_tmp, orig)
+        if segments is None:
+            bounds = [size * i // self.download_segments for i in range(self.download_segments + 1)]
+            segments = [[bounds[i], bounds[i + 1], bounds[i]] for i in range(self.download_segments)]
+            with open(local_tmp, 'wb') as fd:
+                fd.truncate(size)
+        else:
+            logging.info('Resuming segmented download of %s' % path)
+
+        def downloaded():
+            return sum(segment[2] - segment[0] for segment in segments)
+
+        workers = AsyncPydioSdk(self, max_workers=len(segments))
+        tasks = [workers.submit('download_segment', path, url, local_tmp, segment) for segment in segments]
+        start = time.time()
+        initial = previous = downloaded()
+        try:
+            while not all(task.done() for task in tasks):
+                time.sleep(self.progress_delay)
+                self.save_download_journal(journal, orig, segments)
+                dl = downloaded()
+                transfer_rate = (dl - initial) // max(time.time() - start, 0.001)
+                dispatcher.send(signal=TRANSFER_RATE_SIGNAL, sender=self, transfer_rate=transfer_rate)
+                if callback_dict:
+                    callback_dict['bytes_sent'] = float(dl - previous)
+                    callback_dict['total_bytes_sent'] = float(dl)
+                    callback_dict['total_size'] = float(size)
+                    callback_dict['transfer_rate'] = transfer_rate
+                    dispatcher.send(signal=TRANSFER_CALLBACK_SIGNAL, sender=self, change=callback_dict)
+                previous = dl
+        finally:
+            workers.shutdown()
+            self.save_download_journal(journal, orig, segments)
+
+        try:
+            for task in tasks:
+                task.result()
+        except PydioSdkException as pe:
+            if pe.operation == 'range':
+                os.unlink(local_tmp)
+                os.unlink(journal)
+            raise pe
+        except InterruptException:
+            raise
+        except Exception as e:
+            # Keep the segments for the next attempt
+            raise PydioSdkException('download', path, _('Error while downloading file: %s') % e.message)
+
+        error = None
+        if downloaded() != size or os.path.getsize(local_tmp) != size:
+            error = _('File is not correct after download')
+        elif self.download_verify_hash:
+            remote = orig if orig.get('hash') else self.stat(path, with_hash=True)
+            if remote and remote.get('hash') and remote['hash'] != hashfile(open(local_tmp, 'rb'), hashlib.md5(),
+                                                                         blocksize=self.io_chunk_size):
+                error = _('File hash is not correct after download')
+        os.unlink(journal)
+        if error:
+            os.unlink(local_tmp)
+            raise PydioSdkException('download', path, error)
+
+        logging.debug('Segmented download of %s: %i bytes in %.2fs' % (path, size - initial, time.time() - start))
+        is_system_windows = platform.system().lower().startswith('win')
+        if is_system_windows and os.path.exists(local):
+            os.unlink(local)
+        os.rename(local_tmp, local)
+        return True
+
     def list(self, dir=None, nodes=list(), options='al', recursive=False, max_depth=1, remote_order='', order_column='', order_direction='', max_nodes=0, call_back=None):
         url = self.url + '/ls' + self.urlencode_normalized(self.remote_folder)
         data = dict()
@@ -810,6 +1284,7 @@ class PydioSdk():
 
         resp = self.perform_request(url=url, type='post', data=data)
         self.is_pydio_error_response(resp)
+        self.record_transfer('list', resp, len(resp.content))
         queue = [ET.ElementTree(ET.fromstring(resp.content)).getroot()]
         snapshot = dict()
         while len(queue):
@@ -820,6 +1295,9 @@ class PydioSdk():
             path = tree.get('filename')
             bytesize = tree.get('bytesize')
             dict_tree = dict(tree.items())
+            if path and tree.get('ajxp_mime') == 'ajxp_folder':
+                self.remote_cache.add_dir(path[len(self.remote_folder):] if self.remote_folder and
+                                          path.startswith(self.remote_folder) else path)
             if path:
                 if call_back:
                     call_back(dict_tree)
@@ -833,9 +1311,10 @@ class PydioSdk():
             url += '&filter=' + self.urlencode_normalized(self.remote_folder)
         resp = self.perform_request(url=url, stream=True)
         files = dict()
-        for line in resp.iter_lines(chunk_size=512):
-            if not str(line).startswith('LAST_SEQ'):
-                element = json.loads(line)
+        read_stats = dict()
+        for line in iter_stream_lines(resp, stats=read_stats):
+            if line and not line.startswith('LAST_SEQ'):
+                element = json_loads(line)
                 if call_back:
                     call_back(element)
                 else:
@@ -843,6 +1322,7 @@ class PydioSdk():
                     bytesize = element['node']['bytesize']
                     if path != 'NULL':
                         files[path] = bytesize
+        self.record_transfer('snapshot_from_changes', resp, read_stats.get('decoded_bytes', 0))
         return files if not call_back else None
 
     def apply_check_hook(self, hook_name='', hook_arg='', file='/'):
@@ -874,12 +1354,24 @@ class PydioSdk():
         if error:
             raise PydioSdkDefaultException(message)
 
+    def throttled_stream(self, stream, direction):
+        """
+        Apply the bandwidth budget, if any, to the data read from a file-like object
+        :param stream: file-like object with read(), e.g. a response body
+        :param direction: 'up' or 'down'
+        :return: file-like object
+        """
+        if not self.resources:
+            return stream
+        return ThrottledStream(stream, lambda nbytes: self.throttle(nbytes, direction))
+
     def rsync_delta(self, path, signature, delta_path):
         url = self.url + ('/filehasher_delta' + self.urlencode_normalized(self.remote_folder + path.replace("\\", "/")))
         resp = self.perform_request(url=url, type='post', files={'userfile_0': signature}, stream=True,
                                     with_progress=False)
         fd = open(delta_path, 'wb')
         for chunk in resp.iter_content(8192):
+            self.throttle(len(chunk), 'down')
             fd.write(chunk)
         fd.close()
 
@@ -888,18 +1380,103 @@ class PydioSdk():
         resp = self.perform_request(url=url, type='post', stream=True, with_progress=False)
         fd = open(signature, 'wb')
         for chunk in resp.iter_content(8192):
+            self.throttle(len(chunk), 'down')
             fd.write(chunk)
         fd.close()
 
-    def rsync_patch(self, path, delta_path):
+    def rsync_signature_stream(self, path):
+        """
+        Load the signature of a remote file directly from the response, without writing it to a temporary file
+        :param path: str path of the remote file
+        :return: pydio.sdk.delta.Signature
+        """
+        url = self.url + ('/filehasher_signature'+ self.urlencode_normalized(self.remote_folder + path.replace("\\", "/")))
+        resp = self.perform_request(url=url, type='post', stream=True, with_progress=False)
+        resp.raw.decode_content = True
+        try:
+            return load_signature(self.throttled_stream(resp.raw, 'down'))
+        finally:
+            resp.close()
+
+    @contextmanager
+    def rsync_delta_stream(self, path, signature):
+        """
+        Ask the delta between a local signature and the remote file. The response body is not read in advance: the
+        context gives it as a stream, so that it can be applied (see SystemSdk.rsync_patch_stream) while it is
+        downloaded. The response is closed, and its connection given back to the pool, when the context exits.
+        :param path: str path of the remote file
+        :param signature: str path of the local signature, or file-like object holding it
+        :return: context manager giving a file-like object
+        """
+        url = self.url + ('/filehasher_delta' + self.urlencode_normalized(self.remote_folder + path.replace("\\", "/")))
+        resp = self.perform_request(url=url, type='post', files={'userfile_0': signature}, stream=True,
+                                    with_progress=False)
+        try:
+            resp.raw.decode_content = True
+            yield self.throttled_stream(resp.raw, 'down')
+        finally:
+            resp.close()
+
+    def rsync_patch(self, path, delta):
+        """
+        Apply a delta to the remote file
+        :param path: str path of the remote file
+        :param delta: str path of the local delta, or file-like object holding it
+        """
         url = self.url + ('/filehasher_patch'+ self.urlencode_normalized(self.remote_folder + path.replace("\\", "/")))
-        resp = self.perform_request(url=url, type='post', files={'userfile_0': delta_path}, with_progress=False)
+        self.remote_cache.invalidate(path)
+        resp = self.perform_request(url=url, type='post', files={'userfile_0': delta}, with_progress=False)
         self.is_pydio_error_response(resp)
 
     def is_rsync_supported(self):
         return self.rsync_supported
 
 
+    def check_upload_part(self, dlpart_path, offset, size):
+        """
+        After a failed part of a chunked upload, look at the .dlpart on the server to know whether the part can
+        simply be sent again.
+        :param dlpart_path: str path of the .dlpart on the server, None if unknown
+        :param offset: int offset of the failed part
+        :param size: int size of the failed part
+        :return: False if the part can be sent again, True if it was stored anyway, None if the upload must restart
+        """
+        if not dlpart_path or size <= 0:
+            return None
+        self.remote_cache.invalidate(dlpart_path)
+        try:
+            part = self.stat(dlpart_path)
+        except (PydioSdkException, RequestException):
+            return None
+        current = part['size'] if part else 0
+        if current == offset:
+            return False
+        if current == offset + size:
+            return True
+        return None
+
+    def check_journal_part(self, local, part):
+        """
+        Make sure the last acknowledged part of a journaled upload still matches the local file. Only this part
+        is read, instead of the whole prefix of the file.
+        :param local: str path of the local file
+        :param part: dict() {part, offset, size, md5} from the UploadJournal
+        :return: bool
+        """
+        if not part['md5']:
+            return True
+        md5 = hashlib.md5()
+        with open(local, 'rb') as fd:
+            fd.seek(part['offset'])
+            remaining = part['size']
+            while remaining > 0:
+                data = fd.read(min(self.io_chunk_size, remaining))
+                if not data:
+                    return False
+                md5.update(data)
+                remaining -= len(data)
+        return md5.hexdigest() == part['md5']
+
     def upload_file_with_progress(self, url, fields, files, stream, with_progress, max_size=0, auth=None):
         """
         Upload a file with progress, file chunking if necessary, and stream content directly from file.
@@ -922,7 +1499,9 @@ class PydioSdk():
                 logging.debug('Current transfer rate ' + str(rate))
 
         def parse_upload_rep(http_response):
-            if http_response.headers.get('content-type') != 'application/octet-stream':
+            # A binary body (e.g. a streamed delta) is left to the caller, unless the status reports an error
+            content_type = http_response.headers.get('content-type', '').split(';')[0].strip()
+            if content_type != 'application/octet-stream' or http_response.status_code >= 400:
                 if unicode(http_response.text).count('message type="ERROR"'):
 
                     if unicode(http_response.text).lower().count("(507)"):
@@ -947,10 +1526,69 @@ class PydioSdk():
 
 
 
-        filesize = os.stat(files['userfile_0']).st_size
+        def post_part(part, header_body, close_body, content_type, timeout=None, prefetched=None):
+            """
+            Post one part of the file. When it fails on a transport error, a timeout or a 5xx status, it is sent
+            again (up to upload_part_retries times) if the .dlpart on the server shows that the previous parts are
+            intact. Errors reported by the server (quota, precondition, ...) are raised immediately.
+            :return: response, or None if the server had stored the part despite the error
+            """
+            attempt = 0
+            while True:
+                hasher = hashlib.md5() if journal_key else None
+                body = BytesIOWithFile(header_body, close_body, files['userfile_0'], callback=cb, chunk_size=max_size,
+                                       file_part=part, signal_sender=self, read_size=self.io_chunk_size,
+                                       progress_delay=self.progress_delay, prefetched=prefetched, hasher=hasher,
+                                       throttle=self.throttle_upload if self.resources else None)
+                try:
+                    http_response = self.session.post(
+                        url,
+                        data=body,
+                        headers={'Content-Type': content_type},
+                        stream=True,
+                        timeout=timeout,
+                        verify=self.verify_ssl,
+                        auth=auth,
+                        proxies=self.proxies
+                    )
+                    if http_response.status_code >= 500 and http_response.status_code != 507:
+                        # Server side failure (HTTPError is a RequestException)
+                        http_response.raise_for_status()
+                except RequestException as e:
+                    attempt += 1
+                    appended = None
+                    if max_size and filesize > max_size:
+                        appended = self.check_upload_part(files.get('dlpart_path'), part * max_size,
+                                                          min(max_size, filesize - part * max_size))
+                    if appended is None or attempt > self.upload_part_retries:
+                        raise
+                    if appended:
+                        logging.info('Part %i of %s was stored despite error %s' % (part, files['userfile_0'], e))
+                        if journal_key:
+                            journal_part(part, None)
+                        return None
+                    logging.info('Retrying part %i of %s after error %s' % (part, files['userfile_0'], e))
+                    continue
+                parse_upload_rep(http_response)
+                if journal_key and http_response.status_code != 401:
+                    journal_part(part, hasher.hexdigest())
+                return http_response
+
+        def journal_part(part, md5):
+            self.upload_journal.add_part(journal_key, filesize, local_mtime, max_size, part, part * max_size,
+                                         min(max_size, filesize - part * max_size), md5)
+
+        # The content is read from a local file, or from a file-like object (e.g. a delta built in memory)
+        in_memory = hasattr(files['userfile_0'], 'read')
+        filesize = get_file_size(files['userfile_0'])
+        local_mtime = None if in_memory else os.stat(files['userfile_0']).st_mtime
+        prefetch = self.upload_prefetch and not in_memory
         if max_size:
             # Reduce max size to leave some room for data header
             max_size -= 4096
+        journal_key = None
+        if self.upload_journal and max_size and filesize > max_size and 'dlpart_path' in files:
+            journal_key = files['dlpart_path']
 
         existing_pieces_number = 0
 
@@ -962,13 +1600,34 @@ class PydioSdk():
             if 'existing_dlpart' in files:
                 existing_dlpart = files['existing_dlpart']
                 existing_dlpart_size = existing_dlpart['size']
-                if filesize > existing_dlpart_size and \
+                parts = self.upload_journal.get_parts(journal_key, filesize, local_mtime, max_size) \
+                    if journal_key else []
+                if parts and existing_dlpart_size == sum(part['size'] for part in parts) \
+                        and self.check_journal_part(files['userfile_0'], parts[-1]):
+                    logging.info('Resuming upload of %s after %i acknowledged parts' % (files['userfile_0'],
+                                                                                        len(parts)))
+                    existing_pieces_number = len(parts)
+                    cb(filesize, existing_dlpart_size, existing_dlpart_size, 0)
+                elif filesize > existing_dlpart_size and 'hash' in existing_dlpart and \
                         file_start_hash_match(files['userfile_0'], existing_dlpart_size, existing_dlpart['hash']):
                     logging.info('Found the beggining of this file on the other file, skipping the first pieces')
                     existing_pieces_number = existing_dlpart_size / max_size
+                    if journal_key:
+                        self.upload_journal.clear(journal_key)
+                        for part in range(existing_pieces_number):
+                            journal_part(part, None)
                     cb(filesize, existing_dlpart_size, existing_dlpart_size, 0)
 
+        # While a part is in flight, the next one is read from disk
+        reader = None
+        if prefetch and max_size and filesize > max_size:
+            reader = FilePartReader(files['userfile_0'], max(existing_pieces_number, 1) * max_size, max_size)
+            reader.start()
+
+        resp = None
         if not existing_pieces_number:
+            if journal_key:
+                self.upload_journal.clear(journal_key)
 
             # try:
             #     import http.client as http_client
@@ -983,48 +1642,35 @@ class PydioSdk():
             # requests_log.propagate = True
 
             (header_body, close_body, content_type) = encode_multiparts(fields)
-            body = BytesIOWithFile(header_body, close_body, files['userfile_0'], callback=cb, chunk_size=max_size,
-                                   file_part=0, signal_sender=self)
-            resp = requests.post(
-                url,
-                data=body,
-                headers={'Content-Type': content_type},
-                stream=True,
-                timeout=20,
-                verify=self.verify_ssl,
-                auth=auth,
-                proxies=self.proxies
-            )
+            resp = post_part(0, header_body, close_body, content_type, timeout=20)
 
             existing_pieces_number = 1
-            parse_upload_rep(resp)
-            if resp.status_code == 401:
+            if resp is not None and resp.status_code == 401:
                 return resp
 
         if max_size and filesize > max_size:
             fields['appendto_urlencoded_part'] = fields['urlencoded_filename']
             del fields['urlencoded_filename']
             (header_body, close_body, content_type) = encode_multiparts(fields)
-            for i in range(existing_pieces_number, int(math.ceil(filesize / max_size)) + 1):
+            last_part = int(math.ceil(filesize / max_size))
+            for i in range(existing_pieces_number, last_part + 1):
 
                 if self.interrupt_tasks:
-                    raise PydioSdkException("upload", path=os.path.basename(files['userfile_0']), detail=_('Task interrupted by user'))
+                    raise PydioSdkException("upload", path='' if in_memory else os.path.basename(files['userfile_0']),
+                                            detail=_('Task interrupted by user'))
+
+                prefetched = reader.get() if reader else None
+                reader = None
+                if prefetch and i < last_part:
+                    reader = FilePartReader(files['userfile_0'], (i + 1) * max_size, max_size)
+                    reader.start()
 
                 before = time.time()
-                body = BytesIOWithFile(header_body, close_body, files['userfile_0'],
-                                       callback=cb, chunk_size=max_size, file_part=i, signal_sender=self)
-                resp = requests.post(
-                    url,
-                    data=body,
-                    headers={'Content-Type': content_type},
-                    stream=True,
-                    verify=self.verify_ssl,
-                    auth=auth,
-                    proxies=self.proxies
-                )
-                parse_upload_rep(resp)
-                if resp.status_code == 401:
-                    return resp
+                part_resp = post_part(i, header_body, close_body, content_type, prefetched=prefetched)
+                if part_resp is not None:
+                    resp = part_resp
+                    if resp.status_code == 401:
+                        return resp
 
                 duration = time.time() - before
                 logging.info('Uploaded '+str(max_size)+' bytes of data in about %'+str(duration)+' s')
@@ -0,0 +1,84 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import time
+import unittest
+
+from pydio.sdk.auth import TokenAuthProvider
+
+# -*- coding: utf-8 -*-
+
+
+class TokenAuthProviderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stored = None
+        self.generated = 0
+
+    def generate(self):
+        self.generated += 1
+        return {'t': 'token%d' % self.generated, 'p': 'private'}
+
+    def store(self, tokens):
+        self.stored = dict(tokens)
+
+    def provider(self, stored=None):
+        return TokenAuthProvider(lambda: stored, self.generate, self.store, refresh_age=60)
+
+    def test_generated_tokens_are_stored_with_issue_time(self):
+        provider = self.provider()
+        before = time.time()
+        tokens = provider.get_tokens()
+        self.assertEqual('token1', tokens['t'])
+        self.assertTrue(self.stored['i'] >= before)
+        self.assertEqual(self.stored['i'], provider.tokens_time)
+
+    def test_reloaded_tokens_keep_their_age(self):
+        issued = time.time() - 3600
+        provider = self.provider({'t': 'old', 'p': 'private', 'i': str(int(issued))})
+        provider.refresh_in_background = lambda: setattr(self, 'renewing', True)
+        self.renewing = False
+        self.assertEqual('old', provider.get_tokens()['t'])
+        self.assertEqual(int(issued), provider.tokens_time)
+        provider.get_tokens()
+        self.assertTrue(self.renewing)
+
+    def test_recent_tokens_are_not_renewed(self):
+        provider = self.provider({'t': 'recent', 'p': 'private', 'i': str(int(time.time()))})
+        provider.refresh_in_background = lambda: self.fail('recent tokens should not be renewed')
+        provider.get_tokens()
+        provider.get_tokens()
+        self.assertEqual(0, self.generated)
+
+    def test_tokens_without_issue_time_are_considered_old(self):
+        provider = self.provider({'t': 'legacy', 'p': 'private'})
+        provider.get_tokens()
+        self.assertEqual(0, provider.tokens_time)
+
+    def test_refresh_replaces_failed_tokens_once(self):
+        provider = self.provider()
+        first = provider.get_tokens()
+        second = provider.refresh(failed_tokens=first)
+        self.assertEqual('token2', second['t'])
+        self.assertIs(second, provider.refresh(failed_tokens=first))
+        self.assertEqual(2, self.generated)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import unittest
+
+from pydio.sdk.cache import RemotePathCache
+
+# -*- coding: utf-8 -*-
+
+
+class RemotePathCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = RemotePathCache()
+        self.cache.add_dirs(['/a', '/a/b', '/c'])
+        self.cache.add_stat('/a/b/file', {'size': 1})
+        self.cache.add_stat('/a/b/deep/er/file', {'size': 2})
+        self.cache.add_stat('/ab', {'size': 3})
+        self.cache.add_stat('/c/file', {'size': 4})
+
+    def test_invalidate_file(self):
+        self.cache.invalidate('/a/b/file')
+        self.assertIsNone(self.cache.get_stat('/a/b/file'))
+        self.assertTrue(self.cache.has_dir('/a/b'))
+        self.assertEqual(2, self.cache.get_stat('/a/b/deep/er/file')['size'])
+
+    def test_invalidate_folder_removes_subtree_only(self):
+        self.cache.invalidate('/a')
+        self.assertFalse(self.cache.has_dir('/a'))
+        self.assertFalse(self.cache.has_dir('/a/b'))
+        self.assertIsNone(self.cache.get_stat('/a/b/file'))
+        self.assertIsNone(self.cache.get_stat('/a/b/deep/er/file'))
+        self.assertEqual(3, self.cache.get_stat('/ab')['size'])
+        self.assertTrue(self.cache.has_dir('/c'))
+        self.assertEqual(4, self.cache.get_stat('/c/file')['size'])
+
+    def test_invalidate_folder_never_seen_as_folder(self):
+        # '/a/b/deep' was only known as an ancestor of a stat
+        self.cache.invalidate('/a/b/deep/')
+        self.assertIsNone(self.cache.get_stat('/a/b/deep/er/file'))
+        self.assertEqual(1, self.cache.get_stat('/a/b/file')['size'])
+
+    def test_nodes_added_again_after_invalidation(self):
+        self.cache.invalidate('/a')
+        self.cache.add_stat('/a/b/new', {'size': 5})
+        self.cache.invalidate('/a')
+        self.assertIsNone(self.cache.get_stat('/a/b/new'))
+
+    def test_invalidate_root(self):
+        self.cache.invalidate('/')
+        self.assertEqual(0, self.cache.get_stats()['entries'])
+
+    def test_invalidate_cost_on_100k_entries(self):
+        cache = RemotePathCache()
+        for i in range(100):
+            cache.add_dir('/folder%i' % i)
+            for j in range(999):
+                cache.add_stat('/folder%i/file%i' % (i, j), {'size': j})
+        self.assertEqual(100000, cache.get_stats()['entries'])
+        cache._stats = VisitCountingDict(cache._stats)
+        cache._dirs = VisitCountingSet(cache._dirs)
+
+        for j in range(999):
+            cache.invalidate('/folder0/file%i' % j)
+        # One lookup per invalidated file
+        self.assertEqual(999, cache._stats.visits)
+        self.assertEqual(999, cache._dirs.visits)
+
+        cache._stats.visits = cache._dirs.visits = 0
+        cache.invalidate('/folder1')
+        # The folder and its 999 files, nothing else
+        self.assertEqual(1000, cache._stats.visits)
+        self.assertEqual(1000, cache._dirs.visits)
+
+        self.assertEqual(100000 - 999 - 1000, cache.get_stats()['entries'])
+        self.assertEqual(7, cache.get_stat('/folder2/file7')['size'])
+
+
+class VisitCountingDict(dict):
+    """
+    Stats of a RemotePathCache, counting the entries removed and failing on scans
+    """
+    visits = 0
+
+    def pop(self, key, *default):
+        self.visits += 1
+        return dict.pop(self, key, *default)
+
+    def __iter__(self):
+        raise AssertionError('stats scanned')
+    keys = items = values = iterkeys = iteritems = itervalues = __iter__
+
+
+class VisitCountingSet(set):
+    """
+    Folders of a RemotePathCache, counting the entries removed and failing on scans
+    """
+    visits = 0
+
+    def discard(self, key):
+        self.visits += 1
+        return set.discard(self, key)
+
+    def __iter__(self):
+        raise AssertionError('folders scanned')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+from distutils.spawn import find_executable
+from io import BytesIO
+
+from pydio.sdk import delta
+
+# -*- coding: utf-8 -*-
+
+BLOCK_LEN = 64
+
+
+class ShortReads(object):
+    """
+    Stream returning at most 7 bytes per read, like a decoded http response
+    """
+    def __init__(self, data):
+        self.fd = BytesIO(data)
+
+    def read(self, size=-1):
+        return self.fd.read(min(size, 7) if size >= 0 else 7)
+
+
+def random_bytes(rnd, size):
+    if not size:
+        return ''
+    return ('%0*x' % (size * 2, rnd.getrandbits(size * 8))).decode('hex')
+
+
+class DeltaRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rnd = random.Random(42)
+
+    def round_trip(self, basis, new, block_len=BLOCK_LEN):
+        sig_fd = BytesIO()
+        delta.signature(BytesIO(basis), sig_fd, block_len=block_len)
+        sig = delta.load_signature(ShortReads(sig_fd.getvalue()))
+        delta_fd = BytesIO()
+        delta.delta(sig, BytesIO(new), delta_fd)
+        out = BytesIO()
+        written = delta.patch(BytesIO(basis), ShortReads(delta_fd.getvalue()), out)
+        self.assertEqual(new, out.getvalue())
+        self.assertEqual(len(new), written)
+        return delta_fd.getvalue()
+
+    def test_empty_files(self):
+        self.round_trip('', '')
+        self.round_trip('', random_bytes(self.rnd, 100))
+        self.round_trip(random_bytes(self.rnd, 100), '')
+
+    def test_sizes_not_multiple_of_block_size(self):
+        for size in (1, BLOCK_LEN - 1, BLOCK_LEN + 1, 10 * BLOCK_LEN + 17):
+            basis = random_bytes(self.rnd, size)
+            self.round_trip(basis, basis[:size // 2] + 'inserted' + basis[size // 2:])
+            self.round_trip(basis, basis + 'appended')
+            self.round_trip(basis, basis[:-1])
+
+    def test_identical_file_is_only_copies(self):
+        basis = random_bytes(self.rnd, 100 * BLOCK_LEN + 5)
+        patch = self.round_trip(basis, basis)
+        # magic, a single merged copy command, end
+        self.assertLess(len(patch), 20)
+
+    def test_fully_changed_file(self):
+        basis = random_bytes(self.rnd, 20 * BLOCK_LEN + 3)
+        new = random_bytes(self.rnd, 30 * BLOCK_LEN + 9)
+        patch = self.round_trip(basis, new)
+        self.assertGreater(len(patch), len(new))
+
+    def test_reordered_blocks_across_read_buffers(self):
+        basis = random_bytes(self.rnd, 3 * delta.DELTA_READ_SIZE // 2)
+        half = len(basis) // 2
+        self.round_trip(basis, basis[half:] + 'x' + basis[:half], block_len=delta.RS_DEFAULT_BLOCK_LEN)
+
+    def test_corrupted_delta(self):
+        self.assertRaises(delta.DeltaException, delta.patch, BytesIO(''), BytesIO('nope'), BytesIO())
+        sig_fd = BytesIO()
+        delta.signature(BytesIO('abc'), sig_fd)
+        delta_fd = BytesIO()
+        delta.delta(delta.load_signature(BytesIO(sig_fd.getvalue())), BytesIO('abcdef'), delta_fd)
+        self.assertRaises(delta.DeltaException, delta.patch, BytesIO('abc'), BytesIO(delta_fd.getvalue()[:-2]),
+                          BytesIO())
+
+
+@unittest.skipUnless(find_executable('rdiff'), 'rdiff is not installed')
+class RdiffCompatibilityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        rnd = random.Random(7)
+        self.basis = random_bytes(rnd, 50000)
+        self.new = self.basis[:20000] + random_bytes(rnd, 3000) + self.basis[25000:]
+        self.write('basis', self.basis)
+        self.write('new', self.new)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def write(self, name, data):
+        with open(self.path(name), 'wb') as fd:
+            fd.write(data)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as fd:
+            return fd.read()
+
+    def rdiff(self, *args):
+        subprocess.check_call(['rdiff'] + [self.path(a) if a in ('basis', 'new', 'sig', 'delta', 'out') else a
+                                           for a in args])
+
+    def test_rdiff_patches_our_delta(self):
+        self.rdiff('signature', 'basis', 'sig')
+        with open(self.path('sig'), 'rb') as sig_fd:
+            sig = delta.load_signature(sig_fd)
+        with open(self.path('new'), 'rb') as new_fd, open(self.path('delta'), 'wb') as delta_fd:
+            delta.delta(sig, new_fd, delta_fd)
+        self.rdiff('patch', 'basis', 'delta', 'out')
+        self.assertEqual(self.new, self.read('out'))
+
+    def test_we_patch_rdiff_delta_from_our_signature(self):
+        with open(self.path('basis'), 'rb') as basis_fd, open(self.path('sig'), 'wb') as sig_fd:
+            delta.signature(basis_fd, sig_fd)
+        self.rdiff('delta', 'sig', 'new', 'delta')
+        out = BytesIO()
+        with open(self.path('basis'), 'rb') as basis_fd, open(self.path('delta'), 'rb') as delta_fd:
+            delta.patch(basis_fd, delta_fd, out)
+        self.assertEqual(self.new, out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
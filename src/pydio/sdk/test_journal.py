@@ -0,0 +1,160 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from requests.exceptions import ConnectionError
+
+from pydio.sdk.journal import UploadJournal
+from pydio.sdk.remote import PydioSdk
+from pydio.sdk.test_remote import FakeSession, response
+
+# -*- coding: utf-8 -*-
+
+
+class ReadingSession(FakeSession):
+    """
+    Session sending the whole body, so that the parts are hashed
+    """
+    def post(self, url, **kwargs):
+        while kwargs['data'].read(8192):
+            pass
+        return super(ReadingSession, self).post(url, **kwargs)
+
+
+class UploadJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmp, 'uploads.sqlite')
+        self.journal = UploadJournal(self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def add_parts(self, count, path='/file.dlpart', local_mtime=1.5):
+        for part in range(count):
+            self.journal.add_part(path, 10000, local_mtime, 4000, part, part * 4000, 4000, 'md5-%i' % part)
+
+    def test_parts_are_kept_across_instances(self):
+        self.add_parts(2)
+        self.assertTrue(self.journal.has_parts('/file.dlpart'))
+        self.assertFalse(self.journal.has_parts('/other.dlpart'))
+        parts = UploadJournal(self.db).get_parts('/file.dlpart', 10000, 1.5, 4000)
+        self.assertEqual([{'part': 0, 'offset': 0, 'size': 4000, 'md5': 'md5-0'},
+                          {'part': 1, 'offset': 4000, 'size': 4000, 'md5': 'md5-1'}], parts)
+
+    def test_part_recorded_twice_is_replaced(self):
+        self.add_parts(1)
+        self.journal.add_part('/file.dlpart', 10000, 1.5, 4000, 0, 0, 4000, 'new')
+        self.assertEqual(['new'], [p['md5'] for p in self.journal.get_parts('/file.dlpart', 10000, 1.5, 4000)])
+
+    def test_other_version_of_the_file_is_dropped(self):
+        for args in ((10001, 1.5, 4000), (10000, 2.5, 4000), (10000, 1.5, 2000)):
+            self.add_parts(2)
+            self.assertEqual([], self.journal.get_parts('/file.dlpart', *args))
+            self.assertFalse(self.journal.has_parts('/file.dlpart'))
+
+    def test_missing_part_drops_the_journal(self):
+        self.journal.add_part('/file.dlpart', 10000, 1.5, 4000, 1, 4000, 4000, 'md5-1')
+        self.assertEqual([], self.journal.get_parts('/file.dlpart', 10000, 1.5, 4000))
+        self.assertFalse(self.journal.has_parts('/file.dlpart'))
+
+    def test_clear_only_touches_one_upload(self):
+        self.add_parts(2)
+        self.add_parts(1, path='/other.dlpart')
+        self.journal.clear('/file.dlpart')
+        self.assertFalse(self.journal.has_parts('/file.dlpart'))
+        self.assertTrue(self.journal.has_parts('/other.dlpart'))
+
+
+class JournaledUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.sdk = PydioSdk('http://localhost', 'ws', auth=('user', 'password'))
+        self.sdk.upload_prefetch = False
+        self.sdk.upload_part_retries = 0
+        self.sdk.upload_journal = UploadJournal(os.path.join(self.tmp, 'uploads.sqlite'))
+        self.sdk.check_upload_part = lambda dlpart, offset, size: False
+        self.local = os.path.join(self.tmp, 'file')
+        with open(self.local, 'wb') as fd:
+            fd.write(os.urandom(10000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def upload(self, answers, existing_dlpart=None):
+        self.sdk.session = ReadingSession(answers)
+        files = {'userfile_0': self.local, 'dlpart_path': '/file.dlpart'}
+        if existing_dlpart:
+            files['existing_dlpart'] = existing_dlpart
+        fields = {'force_post': 'true', 'urlencoded_filename': 'file'}
+        return self.sdk.upload_file_with_progress('http://localhost/api/ws/upload/put', fields, files, True, None,
+                                                  max_size=4096 + 4000)
+
+    def interrupt_after_two_parts(self):
+        self.assertRaises(ConnectionError, self.upload, [response(), response(), ConnectionError('reset')])
+        self.assertEqual(2, len(self.sdk.upload_journal.get_parts('/file.dlpart', 10000,
+                                                                  os.stat(self.local).st_mtime, 4000)))
+
+    def test_upload_resumes_after_acknowledged_parts(self):
+        self.interrupt_after_two_parts()
+        resp = self.upload([response()], existing_dlpart={'size': 8000})
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(1, self.sdk.session.posts)
+
+    def test_journal_of_a_modified_file_is_ignored(self):
+        self.interrupt_after_two_parts()
+        with open(self.local, 'r+b') as fd:
+            fd.seek(5000)
+            fd.write('changed')
+        stat = os.stat(self.local)
+        os.utime(self.local, (stat.st_atime, stat.st_mtime + 10))
+        self.upload([response(), response(), response()], existing_dlpart={'size': 8000})
+        self.assertEqual(3, self.sdk.session.posts)
+
+    def test_content_change_with_same_mtime_is_detected(self):
+        self.interrupt_after_two_parts()
+        stat = os.stat(self.local)
+        with open(self.local, 'r+b') as fd:
+            fd.seek(5000)
+            fd.write('changed')
+        os.utime(self.local, (stat.st_atime, stat.st_mtime))
+        self.upload([response(), response(), response()], existing_dlpart={'size': 8000})
+        self.assertEqual(3, self.sdk.session.posts)
+
+    def test_dlpart_of_another_size_is_not_resumed(self):
+        self.interrupt_after_two_parts()
+        self.upload([response(), response(), response()], existing_dlpart={'size': 4000})
+        self.assertEqual(3, self.sdk.session.posts)
+
+    def test_restarted_upload_replaces_the_journal(self):
+        self.interrupt_after_two_parts()
+        self.assertRaises(ConnectionError, self.upload, [response(), ConnectionError('reset')])
+        mtime = os.stat(self.local).st_mtime
+        self.assertEqual([0], [p['part'] for p in self.sdk.upload_journal.get_parts('/file.dlpart', 10000, mtime,
+                                                                                    4000)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import sys
+import threading
+import time
+import traceback
+import unittest
+
+from pydio.sdk.parallel import AsyncPydioSdk, SdkTask
+
+# -*- coding: utf-8 -*-
+
+
+class FakeSdk(object):
+    """
+    Records the calls, optionally slowed down, and tracks how many run at the same time
+    """
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+        self.rtt = 0.5
+
+    def _call(self, name, *args):
+        with self.lock:
+            self.calls.append((name,) + args)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            if args and args[0] == '/missing':
+                raise IOError('%s not found' % args[0])
+            return name + ':' + ','.join(args)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def stat(self, path):
+        return self._call('stat', path)
+
+    def delete(self, path):
+        return self._call('delete', path)
+
+    def rename(self, source, target):
+        return self._call('rename', source, target)
+
+    def mkfile(self, path):
+        return self._call('mkfile', path)
+
+    def upload(self, local, remote):
+        return self._call('upload', local, remote)
+
+
+class SdkTaskTest(unittest.TestCase):
+
+    def test_result(self):
+        task = SdkTask('stat', ('/a',), {})
+        self.assertFalse(task.done())
+        self.assertRaises(RuntimeError, task.result, 0.01)
+        task.run(FakeSdk())
+        self.assertTrue(task.done())
+        self.assertEqual('stat:/a', task.result())
+
+    def test_exception_is_raised_again_with_its_traceback(self):
+        task = SdkTask('delete', ('/missing',), {})
+        task.run(FakeSdk())
+        try:
+            task.result()
+            self.fail('IOError expected')
+        except IOError as e:
+            self.assertEqual('/missing not found', str(e))
+            self.assertEqual('_call', traceback.extract_tb(sys.exc_info()[2])[-1][2])
+
+
+class AsyncPydioSdkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sdk = FakeSdk(delay=0.05)
+        self.async_sdk = AsyncPydioSdk(self.sdk, max_workers=4)
+
+    def tearDown(self):
+        self.async_sdk.shutdown()
+
+    def test_run_all_keeps_the_order_and_bounds_concurrency(self):
+        pathes = [('/file%i' % i,) for i in range(12)]
+        results = self.async_sdk.run_all('stat', pathes)
+        self.assertEqual(['stat:/file%i' % i for i in range(12)], results)
+        self.assertTrue(1 < self.sdk.max_running <= 4)
+
+    def test_run_all_raises_the_first_error(self):
+        self.assertRaises(IOError, self.async_sdk.run_all, 'stat', [('/a',), ('/missing',), ('/b',)])
+
+    def test_async_methods_return_tasks(self):
+        task = self.async_sdk.rename_async('/a', '/b')
+        self.assertIsInstance(task, SdkTask)
+        self.assertEqual('rename:/a,/b', task.result())
+
+    def test_other_attributes_are_delegated(self):
+        self.assertEqual(0.5, self.async_sdk.rtt)
+        self.assertEqual('upload:/local,/remote', self.async_sdk.upload('/local', '/remote'))
+        self.assertEqual('stat:/a', self.async_sdk.stat('/a'))
+        self.assertEqual([('upload', '/local', '/remote'), ('stat', '/a')], self.sdk.calls)
+
+    def test_prefetched_calls_are_answered_once(self):
+        self.async_sdk.prefetch('delete', '/a')
+        self.async_sdk.prefetch('delete', '/missing')
+        self.assertEqual('delete:/a', self.async_sdk.delete('/a'))
+        self.assertRaises(IOError, self.async_sdk.delete, '/missing')
+        self.assertEqual(2, len(self.sdk.calls))
+        # Not prefetched anymore: a new request
+        self.assertEqual('delete:/a', self.async_sdk.delete('/a'))
+        self.assertEqual(3, len(self.sdk.calls))
+
+    def test_discard_prefetched(self):
+        self.async_sdk.prefetch('stat', '/a')
+        self.async_sdk.prefetch('stat', '/b')
+        self.async_sdk.stat('/a')
+        self.assertEqual(1, self.async_sdk.discard_prefetched())
+        self.assertEqual(2, len(self.sdk.calls))
+        self.async_sdk.stat('/b')
+        self.assertEqual(3, len(self.sdk.calls))
+
+    def test_shutdown_stops_the_workers(self):
+        self.async_sdk.run_all('stat', [('/a',), ('/b',)])
+        workers = list(self.async_sdk._workers)
+        self.async_sdk.shutdown()
+        for worker in workers:
+            worker.join(1)
+            self.assertFalse(worker.is_alive())
+        # Workers are started again on demand
+        self.assertEqual(['stat:/c'], self.async_sdk.run_all('stat', [('/c',)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,301 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from io import BytesIO
+
+from requests import Response
+from requests.exceptions import ConnectionError
+from requests.packages.urllib3.response import HTTPResponse
+
+from pydio.job.resources import ResourceManager
+from pydio.sdk.exceptions import PydioSdkDefaultException, InterruptException
+from pydio.sdk.remote import PydioSdk, RTT_SAMPLES
+
+# -*- coding: utf-8 -*-
+
+
+class BulkStatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sdk = PydioSdk('http://localhost', 'ws', auth=('user', 'password'))
+        self.sdk.stat_slice_workers = 1
+        self.known = {'/a': {'size': 1, 'mode': 33188}, '/b': {'size': 2, 'mode': 33188}}
+        self.sent = []
+
+        def bulk_stat_slice(pathes, with_hash=False):
+            self.sent.append(list(pathes))
+            if len(pathes) == 1:
+                return {pathes[0]: self.known.get(pathes[0], {})}, 0.1
+            # Server not answering anything for the whole slice
+            return {}, 0.1
+        self.sdk.bulk_stat_slice = bulk_stat_slice
+
+    def tearDown(self):
+        if self.sdk._stat_workers:
+            self.sdk._stat_workers.shutdown()
+
+    def test_one_by_one_fallback_maps_missing_pathes_to_false(self):
+        result = self.sdk.bulk_stat(['/a', '/b', '/missing'])
+        self.assertEqual(1, result['/a']['size'])
+        self.assertEqual(2, result['/b']['size'])
+        self.assertIs(False, result['/missing'])
+        self.assertEqual(4, len(self.sent))
+
+    def test_matched_results_are_cached(self):
+        self.sdk.bulk_stat_slice = lambda pathes, with_hash=False: (dict((p, self.known[p]) for p in pathes), 0.1)
+        result = self.sdk.bulk_stat(['/a', '/b'])
+        self.assertEqual(['/a', '/b'], sorted(result.keys()))
+        self.assertEqual(2, self.sdk.remote_cache.get_stat('/b', False)['size'])
+
+
+def response(status_code=200, text=''):
+    resp = Response()
+    resp.status_code = status_code
+    resp._content = text
+    resp._content_consumed = True
+    resp.headers['content-type'] = 'text/xml'
+    resp.url = 'http://localhost/api/ws/upload/put'
+    return resp
+
+
+class FakeSession(object):
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.posts = 0
+
+    def post(self, url, **kwargs):
+        self.posts += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+class UploadPartRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sdk = PydioSdk('http://localhost', 'ws', auth=('user', 'password'))
+        self.sdk.upload_prefetch = False
+        self.checked = []
+        self.sdk.check_upload_part = lambda dlpart, offset, size: self.checked.append(offset) or False
+        fd, self.local = tempfile.mkstemp()
+        os.write(fd, 'x' * 10000)
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.local)
+
+    def upload(self, answers):
+        self.sdk.session = FakeSession(answers)
+        files = {'userfile_0': self.local, 'dlpart_path': '/file.dlpart'}
+        fields = {'force_post': 'true', 'urlencoded_filename': 'file'}
+        return self.sdk.upload_file_with_progress('http://localhost/api/ws/upload/put', fields, files, True, None,
+                                                  max_size=4096 + 4000)
+
+    def test_transport_errors_and_5xx_are_retried(self):
+        resp = self.upload([response(), ConnectionError('reset'), response(503), response(), response()])
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(5, self.sdk.session.posts)
+        self.assertEqual([4000, 4000], self.checked)
+
+    def test_retries_are_limited(self):
+        self.sdk.upload_part_retries = 1
+        self.assertRaises(ConnectionError, self.upload, [ConnectionError('reset'), ConnectionError('reset')])
+        self.assertEqual(2, self.sdk.session.posts)
+
+    def test_quota_and_precondition_errors_are_not_retried(self):
+        for code in ('507', '412'):
+            self.checked = []
+            with self.assertRaises(PydioSdkDefaultException) as context:
+                self.upload([response(), response(200, '<message type="ERROR">Error (%s)</message>' % code)])
+            self.assertEqual(code, context.exception.message)
+            self.assertEqual(2, self.sdk.session.posts)
+            self.assertEqual([], self.checked)
+
+    def test_507_status_is_not_retried(self):
+        self.assertRaises(PydioSdkDefaultException, self.upload, [response(507, 'Error (507)')])
+        self.assertEqual(1, self.sdk.session.posts)
+
+
+class DownloadRemoteStatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sdk = PydioSdk('http://localhost', 'ws', auth=('user', 'password'))
+        self.tmp = tempfile.mkdtemp()
+        self.local = os.path.join(self.tmp, 'file')
+        self.content = 'new content'
+        self.stats = 0
+
+        def stat(path, with_hash=False, partial_hash=None):
+            self.stats += 1
+            return {'size': len(self.content), 'mtime': 2}
+        self.sdk.stat = stat
+
+        def perform_request(url, type='get', data=None, files=None, headers=None, stream=False, with_progress=False):
+            resp = response(200, self.content)
+            resp.headers['content-length'] = str(len(self.content))
+            return resp
+        self.sdk.perform_request = perform_request
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_given_stat_avoids_stat_request(self):
+        self.sdk.download('/file', self.local, remote_stat={'size': len(self.content), 'mtime': 2})
+        self.assertEqual(0, self.stats)
+        self.assertEqual(self.content, open(self.local).read())
+
+    def test_stale_size_is_checked_again(self):
+        self.sdk.download('/file', self.local, remote_stat={'size': 3, 'mtime': 1})
+        self.assertEqual(1, self.stats)
+        self.assertEqual(self.content, open(self.local).read())
+
+    def test_segmented_download_does_not_use_given_stat(self):
+        self.sdk.segmented_download_min = 1
+        segmented = []
+        self.sdk.download_segmented = lambda path, local, url, orig, callback_dict=None: segmented.append(orig)
+        self.sdk.download('/file', self.local, remote_stat={'size': 3, 'mtime': 1})
+        self.assertEqual(1, self.stats)
+        self.assertEqual(len(self.content), segmented[0]['size'])
+
+
+class RttTest(unittest.TestCase):
+
+    def record(self, sdk, seconds):
+        resp = response()
+        resp.elapsed = timedelta(seconds=seconds)
+        sdk.record_rtt(resp)
+
+    def test_heavy_requests_do_not_inflate_rtt(self):
+        sdk = PydioSdk('http://localhost', 'ws', auth=('user', 'password'))
+        self.assertEqual(-1, sdk.rtt)
+        self.record(sdk, 0.05)
+        for i in range(5):
+            self.record(sdk, 3)
+        self.assertEqual(0.05, sdk.rtt)
+
+    def test_rtt_follows_recent_requests(self):
+        sdk = PydioSdk('http://localhost', 'ws', auth=('user', 'password'))
+        self.record(sdk, 0.01)
+        for i in range(RTT_SAMPLES):
+            self.record(sdk, 0.2)
+        self.assertEqual(0.2, sdk.rtt)
+
+
+class DeltaStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sdk = PydioSdk('http://localhost', 'ws', auth=('user', 'password'))
+        self.resp = Response()
+        self.resp.status_code = 200
+        self.resp.raw = HTTPResponse(body=BytesIO(b'delta' * 10), preload_content=False)
+        self.closed = []
+        self.resp.close = lambda: self.closed.append(True)
+        self.sdk.perform_request = lambda **kwargs: self.resp
+
+    def test_stream_is_closed_on_exit(self):
+        with self.sdk.rsync_delta_stream('/file', '/tmp/signature') as stream:
+            self.assertEqual(b'delta', stream.read(5))
+        self.assertEqual([True], self.closed)
+
+    def test_stream_is_closed_on_error(self):
+        try:
+            with self.sdk.rsync_delta_stream('/file', '/tmp/signature'):
+                raise IOError('patch failed')
+        except IOError:
+            pass
+        self.assertEqual([True], self.closed)
+
+    def test_stream_is_throttled(self):
+        consumed = []
+
+        class Resources(object):
+            def consume(self, nbytes, direction, interrupted=None):
+                consumed.append((nbytes, direction))
+        self.sdk.resources = Resources()
+        with self.sdk.rsync_delta_stream('/file', '/tmp/signature') as stream:
+            stream.read(20)
+            stream.read()
+        self.assertEqual([(20, 'down'), (30, 'down')], consumed)
+
+    def test_throttling_is_interrupted(self):
+        self.sdk.resources = ResourceManager(global_down=1).register_job('job')
+        self.sdk.set_interrupt()
+        with self.sdk.rsync_delta_stream('/file', '/tmp/signature') as stream:
+            self.assertRaises(InterruptException, stream.read, 20)
+
+
+class DeltaUploadPathTest(unittest.TestCase):
+    """
+    The signature is posted, and the delta received, through the real upload path
+    """
+
+    def setUp(self):
+        self.sdk = PydioSdk('http://localhost', 'ws', auth=('user', 'password'))
+        self.sdk.stick_to_basic = True
+        self.bodies = []
+        sdk_test = self
+
+        class PostingSession(object):
+            def __init__(self, resp):
+                self.resp = resp
+
+            def post(self, url, **kwargs):
+                body = []
+                chunk = kwargs['data'].read(8192)
+                while chunk:
+                    body.append(bytes(bytearray(chunk)))
+                    chunk = kwargs['data'].read(8192)
+                sdk_test.bodies.append(b''.join(body))
+                return self.resp
+        self.session_class = PostingSession
+
+    def delta_response(self, status_code=200, body=b'delta' * 10):
+        resp = Response()
+        resp.status_code = status_code
+        resp.headers['content-type'] = 'application/octet-stream; charset=binary'
+        resp.raw = HTTPResponse(body=BytesIO(body), preload_content=False)
+        resp.url = 'http://localhost/api/ws/filehasher_delta/file'
+        return resp
+
+    def test_streamed_delta_is_not_consumed(self):
+        self.sdk.session = self.session_class(self.delta_response())
+        signature = BytesIO(b'in-memory signature')
+        with self.sdk.rsync_delta_stream('/file', signature) as stream:
+            self.assertEqual(b'delta' * 10, stream.read())
+        self.assertEqual(1, len(self.bodies))
+        self.assertIn(b'in-memory signature', self.bodies[0])
+
+    def test_error_response_is_parsed(self):
+        self.sdk.session = self.session_class(self.delta_response(412, b'<message type="ERROR">(412)</message>'))
+
+        def delta():
+            with self.sdk.rsync_delta_stream('/file', BytesIO(b'signature')):
+                pass
+        self.assertRaises(PydioSdkDefaultException, delta)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import gzip
+import tempfile
+import time
+import unittest
+from io import BytesIO
+
+from requests.packages.urllib3.response import HTTPResponse
+
+from pydio.sdk.exceptions import InterruptException
+from pydio.sdk.utils import iter_stream_lines, BytesIOWithFile, ThrottledStream, TokenBucket
+
+# -*- coding: utf-8 -*-
+
+
+class NeverClosedFile(BytesIO):
+    """
+    File object that never reports being closed, like a connection kept open after the end of a response
+    """
+    @property
+    def closed(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class StreamResponse(object):
+
+    def __init__(self, body, encoding=None, fp_class=BytesIO):
+        headers = {'content-encoding': encoding} if encoding else {}
+        self.raw = HTTPResponse(body=fp_class(body), headers=headers, preload_content=False)
+
+
+def gzipped(data):
+    out = BytesIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb')
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+
+class IterStreamLinesTest(unittest.TestCase):
+
+    lines = ['{"seq": %i, "node": {"path": "/folder/file-%i"}}' % (i, i) for i in range(5000)]
+
+    def test_plain_stream(self):
+        body = '\r\n'.join(self.lines) + '\r\n'
+        self.assertEqual(self.lines, list(iter_stream_lines(StreamResponse(body), chunk_size=16)))
+
+    def test_last_line_without_line_ending(self):
+        body = 'first\nsecond'
+        self.assertEqual(['first', 'second'], list(iter_stream_lines(StreamResponse(body))))
+
+    def test_gzip_stream_and_decoded_stats(self):
+        body = '\n'.join(self.lines)
+        stats = {}
+        result = list(iter_stream_lines(StreamResponse(gzipped(body), 'gzip'), chunk_size=16, stats=stats))
+        self.assertEqual(self.lines, result)
+        self.assertEqual(len(body), stats['decoded_bytes'])
+
+    def test_stream_end_on_a_connection_not_closed(self):
+        # Would loop forever if empty reads were retried until the raw stream is closed
+        body = gzipped('\n'.join(self.lines))
+        response = StreamResponse(body, 'gzip', fp_class=NeverClosedFile)
+        self.assertEqual(self.lines, list(iter_stream_lines(response, chunk_size=16)))
+        response = StreamResponse('a\nb', fp_class=NeverClosedFile)
+        self.assertEqual(['a', 'b'], list(iter_stream_lines(response)))
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_no_rate_never_waits(self):
+        bucket = TokenBucket()
+        self.assertEqual(0, bucket.consume(10 * 1024 * 1024))
+
+    def test_consume_within_burst_does_not_wait(self):
+        bucket = TokenBucket(rate=1000, burst=1.0)
+        bucket.last -= 1
+        self.assertEqual(0, bucket.consume(500))
+
+    def test_consume_beyond_rate_waits(self):
+        bucket = TokenBucket(rate=1000, burst=1.0)
+        start = time.time()
+        waited = bucket.consume(200)
+        self.assertAlmostEqual(0.2, waited, delta=0.05)
+        self.assertTrue(time.time() - start >= waited)
+        # the debt of a previous caller is paid before the next one
+        self.assertAlmostEqual(0.1, bucket.consume(100), delta=0.05)
+
+    def test_idle_time_is_capped_by_burst(self):
+        bucket = TokenBucket(rate=1000, burst=0.1)
+        bucket.last -= 10
+        self.assertAlmostEqual(0.1, bucket.consume(200), delta=0.05)
+
+    def test_set_rate_resets_tokens(self):
+        bucket = TokenBucket(rate=1000)
+        bucket.last -= 1
+        bucket.set_rate(0)
+        self.assertEqual(0, bucket.consume(1000000))
+
+    def test_big_block_is_consumed_in_slices(self):
+        bucket = TokenBucket(rate=1000, burst=0)
+        checks = []
+        bucket.consume(300, interrupted=lambda: checks.append(True) or False)
+        self.assertEqual(3, len(checks))
+
+    def test_interrupted_while_waiting(self):
+        bucket = TokenBucket(rate=64 * 1024, burst=0)
+        stopped = []
+        start = time.time()
+        # A 1MB block would otherwise sleep 16 seconds at once
+        self.assertRaises(InterruptException, bucket.consume, 1024 * 1024,
+                          interrupted=lambda: bool(stopped) or bool(stopped.append(True)))
+        self.assertTrue(time.time() - start < 1)
+
+    def test_rate_change_applies_to_the_rest_of_the_block(self):
+        bucket = TokenBucket(rate=1000, burst=0)
+
+        def interrupted():
+            bucket.rate = 0
+            return False
+        self.assertEqual(0, bucket.consume(10 * 1024 * 1024, interrupted=interrupted))
+
+
+class ThrottledStreamTest(unittest.TestCase):
+
+    def test_read_reports_sizes(self):
+        consumed = []
+        stream = ThrottledStream(BytesIO(b'x' * 25), consumed.append)
+        self.assertEqual(b'x' * 10, stream.read(10))
+        self.assertEqual(b'x' * 15, stream.read())
+        self.assertEqual(b'', stream.read(10))
+        self.assertEqual([10, 15], consumed)
+
+
+
+class BytesIOWithFileTest(unittest.TestCase):
+
+    def read_all(self, body):
+        data = []
+        chunk = body.read(8192)
+        while chunk:
+            data.append(bytes(bytearray(chunk)))
+            chunk = body.read(8192)
+        return b''.join(data)
+
+    def test_file_like_content(self):
+        content = tempfile.SpooledTemporaryFile()
+        content.write(b'x' * 100)
+        body = BytesIOWithFile(b'header', b'footer', content, read_size=16)
+        self.assertEqual(112, body.length)
+        self.assertEqual(b'header' + b'x' * 100 + b'footer', self.read_all(body))
+
+    def test_file_like_content_part(self):
+        content = BytesIO(b'a' * 50 + b'b' * 30)
+        body = BytesIOWithFile(b'header', b'footer', content, chunk_size=50, file_part=1, read_size=16)
+        self.assertEqual(b'header' + b'b' * 30 + b'footer', self.read_all(body))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,6 +20,7 @@
 
 import logging
 import requests
+import threading
 import time
 import os
 import sys
@@ -27,17 +28,25 @@ import math
 import hashlib
 
 from io import BytesIO, FileIO
+from cookielib import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
 from pydispatch import dispatcher
 from pydio import TRANSFER_RATE_SIGNAL, TRANSFER_CALLBACK_SIGNAL
 from six import b
 # -*- coding: utf-8 -*-
-from pydio.sdk.exceptions import PydioSdkDefaultException
+from pydio.sdk.exceptions import PydioSdkDefaultException, InterruptException
+
+PYDIO_SDK_IO_CHUNK_SIZE = 1024 * 1024
+PROGRESS_SIGNAL_DELAY = 0.5
+# Seconds of transfer taken at once from a TokenBucket, between two checks of the interruption
+TOKEN_SLICE_DELAY = 0.1
 
 
 class BytesIOWithFile(BytesIO):
 
     def __init__(self, data_buffer, closing_boundary, filename, callback=None, chunk_size=0, file_part=0,
-                 signal_sender=None):
+                 signal_sender=None, read_size=PYDIO_SDK_IO_CHUNK_SIZE, progress_delay=PROGRESS_SIGNAL_DELAY,
+                 prefetched=None, hasher=None, throttle=None):
         """
         Class extending the standard BytesIO to read data directly from file instead of loading all file content
         in memory. It's initially started with all the necessary data to build the full body of the POST request,
@@ -47,10 +56,16 @@ class BytesIOWithFile(BytesIO):
 
         :param data_buffer: All the beginning of the multipart data, until the opening of the file content field
         :param closing_boundary: Last data to add after the file content has been sent.
-        :param filename: Path of the file on the filesystem
+        :param filename: Path of the file on the filesystem, or file-like object with seek() (e.g. a delta built in
+        memory), read from its start
         :param callback: dict() that can be updated with progress data
         :param chunk_size: maximum size that can be posted at once
         :param file_part: if file is bigger that chunk_size, can be 1, 2, 3, etc...
+        :param read_size: minimum size of the file reads, whatever the caller asks (httplib asks 8KB)
+        :param progress_delay: minimum delay in seconds between two progress callbacks / signals
+        :param prefetched: bytearray content of this file part, already read by a FilePartReader
+        :param hasher: hashlib object updated with the file content that is sent
+        :param throttle: function(nbytes) called before each block of file content is sent (bandwidth limit)
         :return:
         """
 
@@ -59,19 +74,39 @@ class BytesIOWithFile(BytesIO):
         self.start = time.time()
         self.closing_boundary = closing_boundary
         self.data_buffer_length = len(data_buffer)
-        self.file_length = os.stat(filename).st_size
+        self.file_length = get_file_size(filename)
         self.full_length = self.length = self.data_buffer_length + self.file_length + len(closing_boundary)
 
         self.chunk_size=chunk_size
         self.file_part=file_part
         self._seek = 0
         self._signal_sender=signal_sender
+        self.progress_delay = progress_delay
+        self._last_progress = self.start
+        self._last_progress_cursor = 0
+        self.read_size = read_size
+        self.hasher = hasher
+        self.throttle = throttle
+        if prefetched is not None:
+            self._prefetched = memoryview(prefetched)
+        else:
+            self._prefetched = None
+            # File content is read in this buffer, reused by every read()
+            self._buffer = bytearray(read_size)
+            self._view = memoryview(self._buffer)
 
-        self.fd = open(filename, 'rb')
+        if prefetched is not None:
+            self.fd = None
+        elif hasattr(filename, 'read'):
+            self.fd = filename
+            self.fd.seek(0)
+        else:
+            self.fd = open(filename, 'rb')
         if chunk_size and self.file_length > chunk_size:
             seek = file_part * chunk_size
             self._seek = seek
-            self.fd.seek(seek)
+            if self.fd:
+                self.fd.seek(seek)
             # recompute chunk_size
             if self.file_length - seek < chunk_size:
                 self.chunk_size = self.file_length - seek
@@ -91,11 +126,12 @@ class BytesIOWithFile(BytesIO):
 
     def read(self, n=-1):
         """
-        Override parent method to send the body in correct order
+        Override parent method to send the body in correct order. File content is returned by blocks of at least
+        read_size bytes, as a view on a reused buffer: it must be consumed before the next call (httplib sends each
+        block before reading the next one).
         :param n:int
         :return:data
         """
-        #before = time.time()
         if self.cursor >= self.length:
             # EOF
             return
@@ -104,16 +140,30 @@ class BytesIOWithFile(BytesIO):
             chunk = self.closing_boundary
         elif self.cursor >= self.data_buffer_length:
             # FILE CONTENT
-            if (self.length - len(self.closing_boundary)) - self.cursor <= n:
-                n = (self.length - len(self.closing_boundary)) - self.cursor
-            chunk = self.fd.read(n)
+            remaining = (self.length - len(self.closing_boundary)) - self.cursor
+            n = min(max(n, self.read_size), remaining, self.read_size)
+            if self._prefetched is not None:
+                position = self.cursor - self.data_buffer_length
+                chunk = self._prefetched[position:position + n]
+            elif hasattr(self.fd, 'readinto'):
+                chunk = self._view[:self.fd.readinto(self._view[:n])]
+            else:
+                chunk = self.fd.read(n)
+            if self.hasher:
+                self.hasher.update(chunk)
+            if self.throttle:
+                self.throttle(len(chunk))
         else:
             # ENCODED PARAMETERS
             chunk = BytesIO.read(self, n)
 
         self.cursor += int(len(chunk))
 
-        time_delta = (time.time() - self.start)
+        now = time.time()
+        if now - self._last_progress < self.progress_delay and self.cursor < self.length:
+            return chunk
+
+        time_delta = (now - self.start)
         if time_delta > 0:
             transfer_rate = self.cursor//time_delta
         else:
@@ -121,16 +171,241 @@ class BytesIOWithFile(BytesIO):
 
         if self.callback:
             try:
-                self.callback(self.full_length, self.cursor + (self.file_part)*self.chunk_size, len(chunk), transfer_rate)
+                self.callback(self.full_length, self.cursor + (self.file_part)*self.chunk_size,
+                              self.cursor - self._last_progress_cursor, transfer_rate)
             except Exception as e:
                 logging.warning('Buffered reader callback error')
         dispatcher.send(signal=TRANSFER_RATE_SIGNAL, transfer_rate=transfer_rate, sender=self._signal_sender)
-        #duration = time.time() - before
-        #if duration > 0 :
-            #logging.info('Read 8kb of data in %'+str(duration))
+        self._last_progress = now
+        self._last_progress_cursor = self.cursor
         return chunk
 
 
+def get_file_size(local):
+    """
+    :param local: str path of a file, or file-like object with seek() and tell()
+    :return: int size in bytes
+    """
+    if hasattr(local, 'read'):
+        local.seek(0, os.SEEK_END)
+        return local.tell()
+    return os.stat(local).st_size
+
+
+class FilePartReader(threading.Thread):
+
+    def __init__(self, filename, offset, size):
+        """
+        Read a part of a file in background, so that the next part of a chunked upload is ready in memory when the
+        current one has been sent.
+        :param filename: Path of the file on the filesystem
+        :param offset: int start of the part
+        :param size: int maximum size of the part
+        :return:
+        """
+        super(FilePartReader, self).__init__(name='FilePartReader')
+        self.daemon = True
+        self.filename = filename
+        self.offset = offset
+        self.size = size
+        self.data = None
+        self.error = None
+
+    def run(self):
+        try:
+            size = max(min(self.size, os.stat(self.filename).st_size - self.offset), 0)
+            data = bytearray(size)
+            view = memoryview(data)
+            read = 0
+            with open(self.filename, 'rb') as fd:
+                fd.seek(self.offset)
+                while read < size:
+                    n = fd.readinto(view[read:])
+                    if not n:
+                        break
+                    read += n
+            self.data = data[:read] if read < size else data
+        except IOError as e:
+            self.error = e
+
+    def get(self):
+        """
+        Wait for the part to be read
+        :return: bytearray, or None if the file could not be read (caller falls back to reading the file itself)
+        """
+        self.join()
+        if self.error:
+            logging.warning('Could not prefetch %s at %i: %s' % (self.filename, self.offset, self.error))
+        return self.data
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate=0, burst=1.0):
+        """
+        Bandwidth limiter shared by any number of threads. Callers consume tokens (bytes) before sending or after
+        receiving data, and sleep when they go beyond the rate.
+        :param rate: int bytes per second, 0 for no limit
+        :param burst: float seconds of transfer that can be accumulated while the bucket is not used
+        :return:
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = 0.0
+        self.last = time.time()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+            self.tokens = 0.0
+            self.last = time.time()
+
+    def consume(self, nbytes, interrupted=None):
+        """
+        Take nbytes tokens, waiting if there are not enough. Concurrent callers queue behind each other: the bucket
+        can go in debt, and each caller waits until the debt it added is paid.
+        Big blocks are taken in slices of TOKEN_SLICE_DELAY seconds of transfer, so that a slow rate does not mean
+        one long sleep: the interruption is checked and the rate read again between two slices.
+        :param nbytes: int
+        :param interrupted: callable returning True when the waiting must be aborted (InterruptException is raised)
+        :return: float seconds waited
+        """
+        waited = 0
+        while nbytes > 0:
+            if interrupted and interrupted():
+                raise InterruptException()
+            with self._lock:
+                rate = self.rate
+                if not rate:
+                    return waited
+                size = min(nbytes, max(int(rate * TOKEN_SLICE_DELAY), 1))
+                now = time.time()
+                self.tokens = min(self.tokens + (now - self.last) * rate, rate * self.burst)
+                self.last = now
+                self.tokens -= size
+                wait = -self.tokens / rate
+            nbytes -= size
+            if wait > 0:
+                time.sleep(wait)
+                waited += wait
+        return waited
+
+
+class ThrottledStream(object):
+
+    def __init__(self, stream, throttle):
+        """
+        File-like wrapper passing the size of the data read to a bandwidth limiter
+        :param stream: file-like object with read()
+        :param throttle: callable(nbytes), e.g. TokenBucket.consume
+        :return:
+        """
+        self.stream = stream
+        self.throttle = throttle
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if data:
+            self.throttle(len(data))
+        return data
+
+
+class PydioHTTPAdapter(HTTPAdapter):
+
+    def __init__(self, *args, **kwargs):
+        """
+        HTTPAdapter keeping track of the requests it sends and of the connection pools it uses, so that we can
+        check how many connections were really opened (keep-alive efficiency).
+        Parameters are the ones of requests.adapters.HTTPAdapter (pool_connections, pool_maxsize, ...)
+        """
+        self._stats_lock = threading.Lock()
+        self._used_pools = set()
+        self.requests_count = 0
+        super(PydioHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def get_connection(self, url, proxies=None):
+        """
+        Override parent method to remember the urllib3 pool used
+        :return: urllib3 ConnectionPool
+        """
+        pool = super(PydioHTTPAdapter, self).get_connection(url, proxies=proxies)
+        with self._stats_lock:
+            self._used_pools.add(pool)
+        return pool
+
+    def send(self, request, **kwargs):
+        """
+        Override parent method to count the requests
+        :return: requests.Response
+        """
+        with self._stats_lock:
+            self.requests_count += 1
+        return super(PydioHTTPAdapter, self).send(request, **kwargs)
+
+    def get_stats(self):
+        """
+        Number of requests sent vs. number of TCP connections opened by the pools
+        :return: dict()
+        """
+        with self._stats_lock:
+            connections = sum([pool.num_connections for pool in self._used_pools])
+            return {'requests': self.requests_count, 'connections': connections}
+
+
+def build_pooled_session(pool_size=10):
+    """
+    Create a requests.Session that keeps connections alive and can be shared by parallel workers.
+    Cookies are never stored, so that each request is authenticated exactly as with the module-level
+    requests.get/post, and the session holds no mutable state between threads.
+    :param pool_size: number of connections kept alive per host
+    :return: requests.Session
+    """
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    # Changes feeds and listings are large JSON/XML texts, always ask for compressed responses
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    adapter = PydioHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def iter_stream_lines(response, chunk_size=8192, max_chunk_size=256 * 1024, stats=None):
+    """
+    Split a streamed http response into lines. Reads start small so that short answers are handled immediately,
+    and the read size doubles (up to max_chunk_size) as long as the server keeps filling the buffer.
+    Gzip/deflate encoded responses are decoded on the fly.
+    :param response: requests.Response obtained with stream=True
+    :param chunk_size: int initial read size
+    :param max_chunk_size: int maximum read size
+    :param stats: dict() if passed, 'decoded_bytes' is increased with the size of the decoded data
+    :return: generator of str lines, without line endings
+    """
+    pending = ''
+    while not response.raw.closed:
+        wire_bytes = response.raw.tell()
+        chunk = response.raw.read(chunk_size, decode_content=True)
+        if not chunk:
+            if response.raw.tell() == wire_bytes:
+                # End of stream: nothing left on the wire, and the decoder was flushed by this read
+                break
+            # Compressed bytes consumed without decoded output yet (e.g. gzip header)
+            continue
+        if stats is not None:
+            stats['decoded_bytes'] = stats.get('decoded_bytes', 0) + len(chunk)
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            if line[-1:] == '\r':
+                line = line[:-1]
+            yield line
+        if len(chunk) >= chunk_size and chunk_size < max_chunk_size:
+            chunk_size *= 2
+    if pending:
+        yield pending
+
+
 def encode_multiparts(fields, basic_auth=None):
     """
     Breaks up the multipart_encoded content into first and last part, to be able to "insert" the file content
@@ -161,7 +436,7 @@ def encode_multiparts(fields, basic_auth=None):
 
 def file_start_hash_match(local_file, size, remote_hash):
     md5 = hashlib.md5()
-    block_size = 8192
+    block_size = PYDIO_SDK_IO_CHUNK_SIZE
     cursor = 0
     with open(local_file,'rb') as f:
         while cursor < size:
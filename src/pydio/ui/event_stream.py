@@ -0,0 +1,179 @@
+#
+# Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+# This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import json
+import logging
+import threading
+import time
+import Queue
+
+from pydispatch import dispatcher
+from pydio import PUBLISH_SIGNAL, TRANSFER_CALLBACK_SIGNAL
+
+# -*- coding: utf-8 -*-
+
+# Min delay between two progress events of a job
+PROGRESS_PUSH_DELAY = 1.0
+# Progress is also checked at this interval without any transfer signal (e.g. jobs running in another process)
+PROGRESS_IDLE_DELAY = 5.0
+# Comment line sent to keep idle connections open
+HEARTBEAT_DELAY = 15.0
+# Events kept for a client that does not read them fast enough, older ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+# Fields of the global progress computed again at every read, ignored when looking for the jobs that changed
+VOLATILE_PROGRESS_KEYS = ('total_time', 'eta')
+
+
+def comparable_progress(progress):
+    """
+    :param progress: dict running state and progress of a job
+    :return: str json of the progress without its volatile fields
+    """
+    state = progress.get('state')
+    if state and isinstance(state.get('global'), dict):
+        global_progress = dict((key, value) for key, value in state['global'].items()
+                               if key not in VOLATILE_PROGRESS_KEYS)
+        progress = dict(progress, state=dict(state, **{'global': global_progress}))
+    return json.dumps(progress, sort_keys=True)
+
+
+class EventBroadcaster(object):
+
+    def __init__(self, get_jobs_progress, progress_delay=PROGRESS_PUSH_DELAY):
+        """
+        Push job status and progress to the UI (server-sent events) instead of letting it poll the API.
+        Status messages (PUBLISH_SIGNAL) are sent as they come. Transfer callbacks only wake up a single thread
+        that sends the progress of the jobs that changed, at most every progress_delay seconds, whatever the
+        number of clients and transfers.
+
+        :param get_jobs_progress: callable returning dict() job_id => dict() running state, progress and last event
+        :param progress_delay: float min seconds between two progress events of a job
+        :return:
+        """
+        self.get_jobs_progress = get_jobs_progress
+        self.progress_delay = progress_delay
+        self.subscribers = []
+        self.last_progress = {}
+        self._lock = threading.Lock()
+        self._progress_event = threading.Event()
+        self._thread = None
+        dispatcher.connect(self.handle_publish_event, signal=PUBLISH_SIGNAL, sender=dispatcher.Any)
+        dispatcher.connect(self.handle_transfer_event, signal=TRANSFER_CALLBACK_SIGNAL, sender=dispatcher.Any)
+
+    def subscribe(self):
+        """
+        Register a client. It first receives the current progress of all the jobs.
+        :return: Queue.Queue of (event, data) tuples
+        """
+        queue = Queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self.subscribers.append(queue)
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run_progress_loop, name='EventBroadcaster')
+                self._thread.daemon = True
+                self._thread.start()
+        for job_id, progress in self.get_jobs_progress().items():
+            self.put(queue, 'progress', json.dumps(dict(progress, job_id=job_id)))
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            if queue in self.subscribers:
+                self.subscribers.remove(queue)
+
+    def put(self, queue, event, data):
+        try:
+            queue.put_nowait((event, data))
+        except Queue.Full:
+            # Slow client: drop its oldest event
+            try:
+                queue.get_nowait()
+                queue.put_nowait((event, data))
+            except (Queue.Empty, Queue.Full):
+                pass
+
+    def broadcast(self, event, data):
+        """
+        :param event: str event name
+        :param data: dict, sent as json
+        :return:
+        """
+        data = json.dumps(data)
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for queue in subscribers:
+            self.put(queue, event, data)
+
+    def handle_publish_event(self, sender, channel, message):
+        job_config = getattr(sender, 'job_config', None)
+        if not self.subscribers or not job_config:
+            return
+        self.broadcast('status', {'job_id': job_config.id, 'channel': channel, 'message': message})
+        # Job started, paused or stopped
+        self._progress_event.set()
+
+    def handle_transfer_event(self, sender, change):
+        if self.subscribers:
+            self._progress_event.set()
+
+    def run_progress_loop(self):
+        while True:
+            self._progress_event.wait(PROGRESS_IDLE_DELAY)
+            self._progress_event.clear()
+            if not self.subscribers:
+                continue
+            try:
+                self.push_progress()
+            except Exception as e:
+                logging.warning('Cannot push jobs progress: %s' % e)
+            time.sleep(self.progress_delay)
+
+    def push_progress(self):
+        """
+        Send the progress of the jobs that changed since it was last sent
+        :return:
+        """
+        for job_id, progress in self.get_jobs_progress().items():
+            key = comparable_progress(progress)
+            if self.last_progress.get(job_id) == key:
+                continue
+            self.last_progress[job_id] = key
+            data = json.dumps(dict(progress, job_id=job_id))
+            with self._lock:
+                subscribers = list(self.subscribers)
+            for queue in subscribers:
+                self.put(queue, 'progress', data)
+
+    def stream(self):
+        """
+        Server-sent events of a new client, until it disconnects
+        :return: generator of str
+        """
+        queue = self.subscribe()
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event, data = queue.get(timeout=HEARTBEAT_DELAY)
+                except Queue.Empty:
+                    yield ': heartbeat\n\n'
+                    continue
+                yield 'event: %s\ndata: %s\n\n' % (event, data)
+        finally:
+            self.unsubscribe(queue)
@@ -215,7 +215,10 @@ angular.module('project', ['ngRoute', 'ngResource', 'ui.bootstrap', 'ui.bootstra
         };
 
         var t2;
-        (function tickJobs() {
+        var events;
+        var pushed = false;
+        function tickJobs() {
+            if(t2) $timeout.cancel(t2);
             var all = Jobs.query(function(){
                 $scope.error = null;
                 if(!all.length){
@@ -223,17 +226,48 @@ angular.module('project', ['ngRoute', 'ngResource', 'ui.bootstrap', 'ui.bootstra
                     return;
                 }
                 $scope.jobs = all;
-                t2 = $timeout(tickJobs, 2000);
+                // Progress is pushed by the agent, only poll for the other fields
+                t2 = $timeout(tickJobs, pushed ? 20000 : 2000);
             }, function(response){
                 if(!response.status){
                     $scope.error = window.translate('Ooops, cannot contact agent! Make sure it is running correctly, process will try to reconnect in 20s');
                     t2 = $timeout(tickJobs, 20000);
                 }
             });
-        })();
+        }
+        tickJobs();
+
+        if(window.EventSource){
+            events = new EventSource('/events');
+            events.onopen = function(){
+                pushed = true;
+            };
+            events.onerror = function(){
+                if(!pushed) return;
+                pushed = false;
+                tickJobs();
+            };
+            events.addEventListener('progress', function(e){
+                var data = JSON.parse(e.data);
+                $scope.$apply(function(){
+                    angular.forEach($scope.jobs, function(j){
+                        if(j.id != data.job_id) return;
+                        j.running = data.running;
+                        if(data.state) j.state = data.state;
+                        else delete j.state;
+                        if(data.last_event) j.last_event = data.last_event;
+                    });
+                });
+            });
+            events.addEventListener('status', function(){
+                // Job started, paused or stopped: refresh now
+                tickJobs();
+            });
+        }
 
         $scope.$on('$destroy', function(){
             $timeout.cancel(t2);
+            if(events) events.close();
         });
         /*
         $scope.jobs = Jobs.query(function(resp){
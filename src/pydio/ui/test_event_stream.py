@@ -0,0 +1,139 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import json
+import threading
+import time
+import unittest
+
+import mock
+from pydispatch import dispatcher
+
+from pydio import PUBLISH_SIGNAL, TRANSFER_CALLBACK_SIGNAL
+from pydio.ui import event_stream
+from pydio.ui.event_stream import EventBroadcaster
+
+# -*- coding: utf-8 -*-
+
+
+class JobProgress(object):
+    """
+    Progress of a single job, the total time being computed again at every read like the merger does
+    """
+    def __init__(self):
+        self.done = 0
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.reads += 1
+            return {'job': {'running': True, 'last_event': {'type': 'sync', 'message': 'Synchronized'},
+                            'state': {'global': {'queue_done': self.done, 'total_time': time.time(), 'eta': -1},
+                                      'tasks': {'total': 0, 'current': []}, 'resources': None}}}
+
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+class EventBroadcasterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.progress = JobProgress()
+        self.broadcaster = EventBroadcaster(self.progress, progress_delay=0.2)
+
+    def tearDown(self):
+        dispatcher.disconnect(self.broadcaster.handle_publish_event, signal=PUBLISH_SIGNAL, sender=dispatcher.Any)
+        dispatcher.disconnect(self.broadcaster.handle_transfer_event, signal=TRANSFER_CALLBACK_SIGNAL,
+                              sender=dispatcher.Any)
+        # The progress thread then stays idle
+        del self.broadcaster.subscribers[:]
+
+    def test_first_progress_is_sent_on_subscribe(self):
+        queue = self.broadcaster.subscribe()
+        event, data = queue.get_nowait()
+        self.assertEqual('progress', event)
+        data = json.loads(data)
+        self.assertEqual('job', data['job_id'])
+        self.assertEqual('Synchronized', data['last_event']['message'])
+
+    def test_volatile_fields_are_not_changes(self):
+        queue = self.broadcaster.subscribe()
+        drain(queue)
+        self.broadcaster.push_progress()
+        self.assertEqual(1, len(drain(queue)))
+        self.broadcaster.push_progress()
+        self.assertEqual([], drain(queue))
+        self.progress.done = 1
+        self.broadcaster.push_progress()
+        events = drain(queue)
+        self.assertEqual(1, len(events))
+        self.assertEqual(1, json.loads(events[0][1])['state']['global']['queue_done'])
+
+    def test_progress_is_rate_limited(self):
+        queue = self.broadcaster.subscribe()
+        drain(queue)
+        reads = self.progress.reads
+        start = time.time()
+        while time.time() - start < 0.5:
+            self.progress.done += 1
+            self.broadcaster.handle_transfer_event(None, {})
+            time.sleep(0.01)
+        time.sleep(0.1)
+        # One push every progress_delay, whatever the number of transfer callbacks
+        self.assertTrue(1 <= self.progress.reads - reads <= 4)
+        self.assertTrue(1 <= len(drain(queue)) <= 4)
+
+    def test_slow_client_drops_oldest_events(self):
+        queue = self.broadcaster.subscribe()
+        drain(queue)
+        with mock.patch.object(event_stream, 'SUBSCRIBER_QUEUE_SIZE', 3):
+            queue = self.broadcaster.subscribe()
+        drain(queue)
+        for i in range(5):
+            self.broadcaster.broadcast('status', {'message': i})
+        self.assertEqual([2, 3, 4], [json.loads(data)['message'] for event, data in drain(queue)])
+
+    def test_heartbeat(self):
+        with mock.patch.object(event_stream, 'HEARTBEAT_DELAY', 0.05):
+            stream = self.broadcaster.stream()
+            self.assertEqual('retry: 5000\n\n', next(stream))
+            self.assertTrue(next(stream).startswith('event: progress\n'))
+            self.assertEqual(': heartbeat\n\n', next(stream))
+            stream.close()
+
+    def test_unsubscribe_when_client_disconnects(self):
+        stream = self.broadcaster.stream()
+        next(stream)
+        self.assertEqual(1, len(self.broadcaster.subscribers))
+        stream.close()
+        self.assertEqual([], self.broadcaster.subscribers)
+        # Nothing is pushed without subscriber
+        reads = self.progress.reads
+        self.broadcaster.handle_transfer_event(None, {})
+        time.sleep(0.1)
+        self.assertEqual(reads, self.progress.reads)
+
+
+if __name__ == '__main__':
+    unittest.main()
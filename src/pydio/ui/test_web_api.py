@@ -0,0 +1,94 @@
+#
+#  Copyright 2007-2014 Charles du Jeu - Abstrium SAS <team (at) pyd.io>
+#  This file is part of Pydio.
+#
+#  Pydio is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Pydio is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Pydio.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  The latest code can be found at <http://pyd.io/>.
+#
+import unittest
+
+import mock
+from flask import Flask
+from flask_restful import Api
+
+from pydio.ui import web_api
+
+# -*- coding: utf-8 -*-
+
+
+class BandwidthCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        Api(app).add_resource(web_api.CmdManager, '/cmd/<string:cmd>/<string:job_id>')
+        self.client = app.test_client()
+        self.scheduler = mock.Mock()
+        self.scheduler.set_job_bandwidth.return_value = {'up': 1024, 'down': 0}
+        patches = [mock.patch.object(web_api.authDB, 'isAuthenticated', return_value=True),
+                   mock.patch.object(web_api.PydioScheduler, 'Instance', return_value=self.scheduler)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_set_limits(self):
+        resp = self.client.get('/cmd/bandwidth/job?up=1&down=0')
+        self.assertEqual(200, resp.status_code)
+        self.scheduler.set_job_bandwidth.assert_called_once_with('job', up=1, down=0)
+
+    def test_invalid_values_are_rejected(self):
+        for query in ('up=fast', 'up=-1', 'down=-100', 'up=10&down=-1'):
+            resp = self.client.get('/cmd/bandwidth/job?' + query)
+            self.assertEqual(400, resp.status_code, query)
+        self.assertFalse(self.scheduler.set_job_bandwidth.called)
+
+    def test_unknown_job(self):
+        self.scheduler.set_job_bandwidth.return_value = False
+        self.assertEqual(404, self.client.get('/cmd/bandwidth/job?up=1').status_code)
+
+
+
+class GlobalBandwidthCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        Api(app).add_resource(web_api.CmdManager, '/cmd/<string:cmd>/<string:job_id>', '/cmd/<string:cmd>')
+        self.client = app.test_client()
+        self.scheduler = mock.Mock()
+        self.scheduler.set_global_bandwidth.return_value = {'up': 1024, 'down': 0}
+        patches = [mock.patch.object(web_api.authDB, 'isAuthenticated', return_value=True),
+                   mock.patch.object(web_api.PydioScheduler, 'Instance', return_value=self.scheduler)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_set_limits(self):
+        resp = self.client.get('/cmd/bandwidth?up=1')
+        self.assertEqual(200, resp.status_code)
+        self.scheduler.set_global_bandwidth.assert_called_once_with(up=1, down=None)
+        self.assertFalse(self.scheduler.set_job_bandwidth.called)
+
+    def test_invalid_values_are_rejected(self):
+        for query in ('up=fast', 'down=-1'):
+            self.assertEqual(400, self.client.get('/cmd/bandwidth?' + query).status_code, query)
+        self.assertFalse(self.scheduler.set_global_bandwidth.called)
+
+    def test_other_commands_are_generic_signals(self):
+        self.scheduler.handle_generic_signal.return_value = 'success'
+        self.client.get('/cmd/start-all')
+        self.assertEqual('start-all', self.scheduler.handle_generic_signal.call_args[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -29,6 +29,7 @@ from pydio.job.job_config import JobConfig, JobsLoader
 from pydio.job.EventLogger import EventLogger
 from pydio.job.localdb import LocalDbHandler
 from pydio.job.scheduler import PydioScheduler
+from pydio.ui.event_stream import EventBroadcaster
 import json
 import requests
 import keyring
@@ -83,6 +84,7 @@ class PydioApi(Api):
         self.external_ip = external_ip
         authDB.add_user(user, password)
         self.running = False
+        self.events = EventBroadcaster(self.get_jobs_progress)
         if getattr(sys, 'frozen', False):
             self.real_static_folder = Path(sys._MEIPASS) / 'ui' / 'res'
             static_folder = str(self.real_static_folder)
@@ -107,10 +109,35 @@ class PydioApi(Api):
         self.app.add_url_rule('/res/config.js', 'config', self.server_js_config)
         self.app.add_url_rule('/res/dynamic.css', 'dynamic_css', self.serve_dynamic_css)
         self.app.add_url_rule('/res/about.html', 'dynamic_about', self.serve_about_content)
+        self.app.add_url_rule('/events', 'events', self.serve_events)
         if EndpointResolver:
             self.add_resource(ResolverManager, '/resolve/<string:client_id>')
             self.app.add_url_rule('/res/dynamic.png', 'dynamic_png', self.serve_dynamic_image)
 
+    def get_jobs_progress(self):
+        """
+        Same running state and progress as /jobs-status, for all the jobs
+        :return: dict() job_id => dict()
+        """
+        scheduler = PydioScheduler.Instance()
+        progress = {}
+        for job_id in JobsLoader.Instance().get_jobs():
+            running = scheduler.is_job_running(job_id)
+            progress[job_id] = {'running': running, 'state': scheduler.get_job_progress(job_id) if running else None,
+                                'last_event': get_last_event(job_id)}
+        return progress
+
+    @authDB.requires_auth
+    def serve_events(self):
+        """
+        Server-sent events stream: "status" events for job messages, "progress" events when a job progress changes
+        :return: Response
+        """
+        return Response(response=self.events.stream(),
+                        status=200,
+                        mimetype="text/event-stream",
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     def serve_i18n_file(self):
         s = ''
         from pydio.utils.i18n import get_languages
@@ -175,7 +202,8 @@ class PydioApi(Api):
     def start_server(self):
         try:
             self.running = True
-            self.app.run(port=self.port, host=self.external_ip)
+            # Threaded: event streams stay open while other requests are served
+            self.app.run(port=self.port, host=self.external_ip, threaded=True)
         except Exception:
             self.running = False
             logging.exception("Error while starting web server")
@@ -351,6 +379,19 @@ class FoldersManager(Resource):
         return o['tree']['tree']
 
 
+def get_last_event(job_id, logger=None):
+    """
+    Latest event of a job (sync state or transfer), shown as the job status text
+    :param job_id: str
+    :param logger: EventLogger of the job, built if None
+    :return: dict, None if the job has no event yet
+    """
+    if logger is None:
+        logger = EventLogger(JobsLoader.Instance().build_job_data_path(job_id))
+    last_events = logger.get_all(1, 0)
+    return last_events.pop() if len(last_events) else None
+
+
 class JobManager(Resource):
 
     loader = None
@@ -433,9 +474,9 @@ class JobManager(Resource):
             notification = logger.consume_notification()
             if notification:
                 job_data['notification'] = notification
-        last_events = logger.get_all(1, 0)
-        if len(last_events):
-            job_data['last_event'] = last_events.pop()
+        last_event = get_last_event(job_id, logger)
+        if last_event:
+            job_data['last_event'] = last_event
         if running:
             job_data['state'] = PydioScheduler.Instance().get_job_progress(job_id)
 
@@ -501,6 +542,20 @@ class LogManager(Resource):
 
 class CmdManager(Resource):
 
+    @staticmethod
+    def bandwidth_args():
+        """
+        :return: tuple (up, down) in KB/s, None when not given, or False for invalid values
+        """
+        try:
+            up = int(request.args['up']) if 'up' in request.args else None
+            down = int(request.args['down']) if 'down' in request.args else None
+        except ValueError:
+            return False
+        if (up is not None and up < 0) or (down is not None and down < 0):
+            return False
+        return up, down
+
     @authDB.requires_auth
     def get(self, cmd, job_id=None):
         if job_id:
@@ -509,7 +564,22 @@ class CmdManager(Resource):
                 job_config.active = True if cmd == 'enable' else False
                 JobsLoader.Instance().update_job(job_config)
                 PydioScheduler.Instance().reload_configs()
+            elif cmd == 'bandwidth':
+                # /cmd/bandwidth/<job_id>?up=100&down=500 in KB/s, 0 to remove the limit
+                rates = self.bandwidth_args()
+                if not rates:
+                    return {'message': 'Invalid bandwidth value'}, 400
+                limits = PydioScheduler.Instance().set_job_bandwidth(job_id, up=rates[0], down=rates[1])
+                if limits is False:
+                    return {'message': 'Unknown job'}, 404
+                return limits
             PydioScheduler.Instance().handle_job_signal(self, cmd, job_id)
+        elif cmd == 'bandwidth':
+            # /cmd/bandwidth?up=100&down=500 in KB/s for all the jobs, 0 to remove the limit
+            rates = self.bandwidth_args()
+            if not rates:
+                return {'message': 'Invalid bandwidth value'}, 400
+            return PydioScheduler.Instance().set_global_bandwidth(up=rates[0], down=rates[1])
         else:
             return PydioScheduler.Instance().handle_generic_signal(self, cmd)
         return ('success',)
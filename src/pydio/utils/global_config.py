@@ -30,6 +30,7 @@ class ConfigManager:
     rdiff_path = ''
     proxies = None
     proxies_loaded = False
+    bandwidth = None
 
     def __init__(self, configs_path, data_path):
         self.configs_path = configs_path
@@ -80,4 +81,43 @@ class ConfigManager:
                     logging.error('Error while trying to load proxies.json file')
             self.proxies_loaded = True
             pass
-        return self.proxies
\ No newline at end of file
+        return self.proxies
+
+    def get_global_bandwidth(self):
+        """
+        Transfer rate limits shared by all the jobs, loaded from self.configs_path/bandwidth.json
+        :return: dict {'up': KB/s, 'down': KB/s}, 0 for no limit
+        """
+        if self.bandwidth is None:
+            self.bandwidth = {'up': 0, 'down': 0}
+            bandwidth_file = self.configs_path + '/bandwidth.json'
+            if os.path.exists(bandwidth_file):
+                try:
+                    with open(bandwidth_file, 'r') as handle:
+                        data = json.load(handle)
+                    for direction in ('up', 'down'):
+                        rate = data.get(direction, 0) if isinstance(data, dict) else 0
+                        if isinstance(rate, int) and not isinstance(rate, bool) and rate >= 0:
+                            self.bandwidth[direction] = rate
+                        else:
+                            logging.warning('Ignoring invalid global %s bandwidth limit %r' % (direction, rate))
+                except Exception as e:
+                    logging.error('Error while trying to load bandwidth.json file')
+        return dict(self.bandwidth)
+
+    def set_global_bandwidth(self, up=None, down=None):
+        """
+        Change the transfer rate limits shared by all the jobs, and save them in self.configs_path/bandwidth.json
+        :param up: int KB/s, 0 for no limit, None to keep the current value
+        :param down: int KB/s, 0 for no limit, None to keep the current value
+        :return: dict {'up': KB/s, 'down': KB/s}
+        """
+        bandwidth = self.get_global_bandwidth()
+        if up is not None:
+            bandwidth['up'] = up
+        if down is not None:
+            bandwidth['down'] = down
+        with open(self.configs_path + '/bandwidth.json', 'w') as handle:
+            json.dump(bandwidth, handle)
+        self.bandwidth = bandwidth
+        return dict(bandwidth)
\ No newline at end of file